@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from sklearn import cluster
+from sklearn.neighbors import KDTree
+
+import schema
+
+
+class ClusterAssigner:
+    """ClusterAssigner assigns new customers to the clusters of a trained clustering model.
+
+    It keeps everything that is needed to turn the aggregated response of a customer
+    into the features of the model: the column layout, the gender encoding and the
+    fitted scaler. A customer is assigned to the cluster of the nearest representative
+    in manhattan distance, which is looked up in a KD-tree.
+
+    By default, the labeled customers are compressed into BIRCH subclusters,
+    whose centers are the representatives, each labeled by the most common label
+    of its customers. If `threshold` is None, every labeled customer is a representative,
+    which is exact but slower.
+
+    Parameters
+    ----------
+    feature_columns : list
+        The names of the feature columns of the model, in order.
+        The gender columns are named 'gender_<gender>'.
+
+    scaler : sklearn.preprocessing.MinMaxScaler
+        The scaler fitted on the features.
+
+    X_scaled : numpy.ndarray
+        The scaled features of the labeled customers.
+
+    labels : numpy.ndarray
+        The cluster label of each labeled customer.
+
+    threshold : float
+        The BIRCH subcluster radius threshold, or None.
+
+    chunksize : int
+        The number of customers assigned in one vectorized chunk.
+    """
+
+    def __init__(self,
+                 feature_columns,
+                 scaler,
+                 X_scaled,
+                 labels,
+                 threshold=0.4,
+                 chunksize=100000):
+        self.feature_columns = list(feature_columns)
+        self.scaler = scaler
+        self.chunksize = chunksize
+
+        X_scaled = np.asarray(X_scaled, dtype=np.float64)
+        labels = np.asarray(labels)
+        if threshold is None:
+            self.representatives = X_scaled
+            self.labels = labels
+        else:
+            birch = cluster.Birch(threshold=threshold, n_clusters=None)
+            birch.fit(X_scaled)
+            self.representatives = birch.subcluster_centers_
+
+            # the most common label of the customers nearest to each subcluster center
+            tree = KDTree(self.representatives, metric='manhattan')
+            nearest = tree.query(X_scaled, k=1, return_distance=False)[:, 0]
+            _, codes = np.unique(labels, return_inverse=True)
+            counts = np.zeros((len(self.representatives), codes.max() + 1),
+                              dtype=np.int64)
+            np.add.at(counts, (nearest, codes), 1)
+            self.labels = np.unique(labels)[counts.argmax(axis=1)]
+
+        self.tree = KDTree(self.representatives, metric='manhattan')
+
+    def transform(self, df):
+        """Builds the scaled features of the model from the aggregated response.
+
+        Parameters
+        ----------
+        df : pandas.Dataframe
+            The data frame containing the aggregated response of the customers,
+            with the same columns as `response_agg`. Extra columns are ignored.
+
+        Returns
+        -------
+        X_scaled : numpy.ndarray
+            The scaled features.
+        """
+        genders = pd.Categorical(
+            df['gender'], categories=schema.GENDER_DTYPE.categories)
+        if (genders.codes < 0).any():
+            raise ValueError('Unknown genders: {}'.format(
+                df['gender'][genders.codes < 0].unique().tolist()))
+
+        X = np.empty((df.shape[0], len(self.feature_columns)),
+                     dtype=np.float64)
+        for i, col in enumerate(self.feature_columns):
+            if col.startswith('gender_'):
+                X[:, i] = genders == col[len('gender_'):]
+            else:
+                X[:, i] = df[col].values
+
+        # the same as self.scaler.transform(X), without copying X again
+        X *= self.scaler.scale_
+        X += self.scaler.min_
+
+        return X
+
+    def assign(self, df):
+        """Assigns customers to the clusters chunk by chunk.
+
+        Parameters
+        ----------
+        df : pandas.Dataframe
+            The data frame containing the aggregated response of the customers.
+
+        Returns
+        -------
+        labels : numpy.ndarray
+            The cluster label of each customer.
+        """
+        labels = np.empty(df.shape[0], dtype=self.labels.dtype)
+        for start in range(0, df.shape[0], self.chunksize):
+            stop = start + self.chunksize
+            X_scaled = self.transform(df.iloc[start:stop])
+            nearest = self.tree.query(
+                X_scaled, k=1, return_distance=False)[:, 0]
+            labels[start:stop] = self.labels[nearest]
+
+        return labels
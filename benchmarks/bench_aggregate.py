@@ -0,0 +1,145 @@
+"""Compares the single-pass `combiner.aggregate_merged_response` with the
+original implementation based on seven groupby reductions and merges.
+It reports wall time and peak memory for the original number of customers
+and for a synthetic data set that is 10 times larger.
+
+Usage: python -m benchmarks.bench_aggregate
+"""
+import pandas as pd
+
+import cleaner as cln
+import combiner as cbn
+import generator as gen
+import model as mdl
+from benchmarks import fixtures
+
+
+def aggregate_merged_response_merges(response_merged, profile_cleaned):
+    """The original implementation of `combiner.aggregate_merged_response`,
+    which merges seven groupby reductions one by one.
+    """
+    response_groups = response_merged[
+        response_merged['offer_type'] != 'informational'].groupby(
+            by=['profile_id', 'offer_type'])
+
+    response_agg = response_groups[['response']].sum().reset_index()
+
+    # For the following features, I think we need to use their average.
+    response_agg = response_agg.merge(
+        response_groups[['resp_number']].mean().reset_index(),
+        on=['profile_id', 'offer_type'])
+
+    response_agg = response_agg.merge(
+        response_groups[['resp_amount']].mean().reset_index(),
+        on=['profile_id', 'offer_type'])
+
+    response_agg = response_agg.merge(
+        response_groups[['resp_reward']].mean().reset_index(),
+        on=['profile_id', 'offer_type'])
+
+    # For the following features, the average is better than the others.
+    response_agg = response_agg.merge(
+        response_groups[['difficulty']].mean().reset_index(),
+        on=['profile_id', 'offer_type'])
+
+    response_agg = response_agg.merge(
+        response_groups[['duration']].mean().reset_index(),
+        on=['profile_id', 'offer_type'])
+
+    response_agg = response_agg.merge(
+        response_groups[['reward']].mean().reset_index(),
+        on=['profile_id', 'offer_type'])
+
+    response_agg.columns = [
+        'profile_id', 'offer_type', 'response_sum', 'resp_number_mean',
+        'resp_amount_mean', 'resp_reward_mean', 'difficulty_mean',
+        'duration_mean', 'reward_mean'
+    ]
+
+    # Combine the responses of each customer to the two types of offer.
+    response_agg_bogo = response_agg[response_agg['offer_type'] ==
+                                     'bogo'].drop(
+                                         'offer_type', axis=1)
+
+    response_agg_discount = response_agg[response_agg['offer_type'] ==
+                                         'discount'].drop(
+                                             'offer_type', axis=1)
+
+    response_agg = response_agg_bogo.merge(
+        response_agg_discount,
+        on='profile_id',
+        how='outer',
+        suffixes=['_bogo', '_discount'],
+        validate='one_to_one')
+
+    # Merge the data in the profile as well.
+    response_agg = response_agg.merge(
+        profile_cleaned, on='profile_id', how='left', validate='one_to_one')
+
+    # Fill null values.
+    response_agg = response_agg.fillna(0.0)
+
+    return response_agg
+
+
+def replicate(response_merged, profile_cleaned, times):
+    """Replicates the customers several times with new profile IDs.
+    """
+    id_offset = profile_cleaned['profile_id'].max()
+    response_merged_list = []
+    profile_cleaned_list = []
+    for i in range(times):
+        response_copy = response_merged.copy()
+        response_copy['profile_id'] += i * id_offset
+        response_merged_list.append(response_copy)
+
+        profile_copy = profile_cleaned.copy()
+        profile_copy['profile_id'] += i * id_offset
+        profile_cleaned_list.append(profile_copy)
+
+    return (pd.concat(response_merged_list, ignore_index=True),
+            pd.concat(profile_cleaned_list, ignore_index=True))
+
+
+def main():
+    """The main function.
+    """
+    print('Make the synthetic response data...')
+    portfolio, profile = fixtures.load_portfolio_and_profile()
+    transcript = fixtures.make_transcript(portfolio, profile)
+
+    offer_id_map = gen.gen_id_map(portfolio['id'])
+    profile_id_map = gen.gen_id_map(profile['id'])
+    portfolio_cleaned = cln.clean_portfolio_df(portfolio, offer_id_map)
+    profile_cleaned = cln.clean_profile_df(profile, profile_id_map, True,
+                                           False)
+    transcript_cleaned = cln.clean_transcript_df(transcript, offer_id_map,
+                                                 profile_id_map)
+
+    response = cbn.create_response(transcript_cleaned)
+    response_merged = cbn.merge_response(response, portfolio_cleaned,
+                                         profile_cleaned)
+    response_merged = response_merged[
+        response_merged['offer_type'] != 'informational']
+
+    for times in [1, 10]:
+        merged, profiles = replicate(response_merged, profile_cleaned, times)
+
+        expected, merges_time, merges_peak = mdl.measure(
+            aggregate_merged_response_merges, merged, profiles)
+        response_agg, single_time, single_peak = mdl.measure(
+            cbn.aggregate_merged_response, merged, profiles)
+
+        pd.testing.assert_frame_equal(
+            response_agg, expected, check_exact=True)
+
+        print('{}x: {} customers, response_agg.shape: {}'.format(
+            times, merged['profile_id'].nunique(), response_agg.shape))
+        print('    groupby + merges: {:.3f}s, peak {:.1f} MB'.format(
+            merges_time, merges_peak / 1e6))
+        print('    single pass:      {:.3f}s, peak {:.1f} MB'.format(
+            single_time, single_peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
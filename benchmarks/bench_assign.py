@@ -0,0 +1,88 @@
+"""Measures the throughput of `assigner.ClusterAssigner` on synthetic new customers,
+which are resampled from the labeled customers with noise added to their features.
+It needs the outputs of model.py.
+
+Usage: python -m benchmarks.bench_assign [--model-dir DIR] [--rows N]
+"""
+import numpy as np
+
+import os
+import time
+import argparse
+import constant
+import assigner as asg
+import storer as sto
+
+
+def make_new_customers(response_labeled, num_rows, seed=103):
+    """Makes synthetic new customers from the labeled customers.
+    """
+    rs = np.random.RandomState(seed)
+    new_customers = response_labeled.iloc[rs.randint(
+        0, response_labeled.shape[0], num_rows)].reset_index(drop=True)
+
+    for col in ['age', 'income', 'resp_amount_mean_bogo',
+                'resp_amount_mean_discount']:
+        values = new_customers[col].values.astype(np.float64)
+        noise = rs.normal(0.0, 0.05 * np.nanstd(values), num_rows)
+        new_customers[col] = np.maximum(values + noise, 0.0)
+
+    return new_customers
+
+
+def timed(func, *args):
+    """Returns the result and the wall time of a function call.
+    """
+    start_time = time.time()
+    result = func(*args)
+    return (result, time.time() - start_time)
+
+
+def main(model_dir, num_rows):
+    """The main function.
+    """
+    response_labeled = sto.load(
+        os.path.join(model_dir, constant.PICKLE_RESPONSE_LABELED))
+    cluster_assigner = sto.load(
+        os.path.join(model_dir, constant.PICKLE_CLUSTER_ASSIGNER))
+    cluster_col_name = response_labeled.columns[0]
+
+    new_customers = make_new_customers(response_labeled, num_rows)
+    print('new customers: {}, representatives: {}'.format(
+        num_rows, len(cluster_assigner.representatives)))
+
+    labels, seconds = timed(cluster_assigner.assign, new_customers)
+    print('    {:<36}{:>8.3f}s {:>12,.0f} rows/s'.format(
+        'assign', seconds, num_rows / seconds))
+
+    # every labeled customer is a representative of the exact assigner
+    exact_assigner = asg.ClusterAssigner(
+        cluster_assigner.feature_columns,
+        cluster_assigner.scaler,
+        cluster_assigner.transform(response_labeled),
+        response_labeled[cluster_col_name].values,
+        threshold=None)
+    num_exact_rows = min(num_rows, 100000)
+    exact_labels, seconds = timed(exact_assigner.assign,
+                                  new_customers.iloc[:num_exact_rows])
+    print('    {:<36}{:>8.3f}s {:>12,.0f} rows/s'.format(
+        'assign (all labeled customers)', seconds, num_exact_rows / seconds))
+    print('label agreement: {}'.format(
+        (labels[:num_exact_rows] == exact_labels).mean()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the cluster assigner.')
+    parser.add_argument(
+        '--model-dir',
+        default=constant.MODEL_DIR,
+        help='the directory of the outputs of model.py')
+    parser.add_argument(
+        '--rows',
+        type=int,
+        default=1000000,
+        help='the number of new customers')
+    args = parser.parse_args()
+
+    main(args.model_dir, args.rows)
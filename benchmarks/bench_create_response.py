@@ -0,0 +1,127 @@
+"""Compares the vectorized `combiner.create_response` with the original
+groupby/iterrows loop on a synthetic transcript of the original size.
+
+Usage: python -m benchmarks.bench_create_response
+"""
+import pandas as pd
+from collections import defaultdict
+
+import time
+import cleaner as cln
+import combiner as cbn
+import generator as gen
+from benchmarks import fixtures
+
+
+class DictAmountStorer:
+    """The original implementation of `combiner.AmountStorer`,
+    which keeps the amounts in a dictionary keyed by strings.
+    """
+
+    def __init__(self):
+        self.map = defaultdict(float)
+
+    def gen_key(self, profile_id, time):
+        return str(profile_id) + "-" + str(time)
+
+    def set_amount(self, profile_id, time, amount):
+        self.map[self.gen_key(profile_id, time)] += amount
+
+    def get_amount(self, profile_id, time):
+        return self.map[self.gen_key(profile_id, time)]
+
+
+def check_validity_loop(profile_id, group, expected_event_set, amountStorer):
+    """The original implementation of `combiner.check_validity`,
+    which iterates over the rows of a group.
+    """
+    count = 0
+    amount = 0.0
+    reward = 0
+
+    group = group.sort_values(by='time')
+    event_set = set()
+
+    for _, row in group.iterrows():
+        event = row['event']
+        event_set.add(event)
+
+        if event == 'offer completed':
+            if event_set == expected_event_set:
+                count += 1
+                amount += amountStorer.get_amount(profile_id, row['time'])
+                reward += row['event_reward']
+
+            event_set.clear()
+
+    return (count, amount, reward)
+
+
+def create_response_loop(transcript_cleaned):
+    """The original implementation of `combiner.create_response`.
+    It shares no code with the combiner, so that the comparison is independent.
+    """
+    transcript_grouped = transcript_cleaned.groupby(['profile_id', 'offer_id'])
+    expected_event_set = {'offer received', 'offer viewed', 'offer completed'}
+    responses = []
+
+    amountStorer = DictAmountStorer()
+
+    for name, group in transcript_grouped:
+        profile_id, offer_id = name
+
+        if offer_id == 0:
+            for _, row in group.iterrows():
+                amountStorer.set_amount(profile_id, row['time'],
+                                        row['event_amount'])
+
+            continue
+
+        count, amount, reward = check_validity_loop(
+            profile_id, group, expected_event_set, amountStorer)
+
+        if count > 0:
+            responses.append([1, profile_id, offer_id, count, amount, reward])
+        else:
+            responses.append([0, profile_id, offer_id, 0, 0.0, 0])
+
+    response = pd.DataFrame(
+        data=responses,
+        columns=[
+            'response', 'profile_id', 'offer_id', 'resp_number', 'resp_amount',
+            'resp_reward'
+        ])
+
+    return response
+
+
+def main():
+    """The main function.
+    """
+    print('Make the synthetic transcript...')
+    portfolio, profile = fixtures.load_portfolio_and_profile()
+    transcript = fixtures.make_transcript(portfolio, profile)
+
+    offer_id_map = gen.gen_id_map(portfolio['id'])
+    profile_id_map = gen.gen_id_map(profile['id'])
+    transcript_cleaned = cln.clean_transcript_df(transcript, offer_id_map,
+                                                 profile_id_map)
+    print('transcript_cleaned.shape: {}'.format(transcript_cleaned.shape))
+
+    start_time = time.time()
+    expected = create_response_loop(transcript_cleaned)
+    loop_time = time.time() - start_time
+    print('groupby/iterrows loop: {:.3f}s'.format(loop_time))
+
+    start_time = time.time()
+    response = cbn.create_response(transcript_cleaned)
+    vectorized_time = time.time() - start_time
+    print('vectorized engine: {:.3f}s ({:.0f}x)'.format(
+        vectorized_time, loop_time / vectorized_time))
+
+    pd.testing.assert_frame_equal(response, expected, check_exact=True)
+    print('The outputs are identical.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compares the positional joins of `combiner.merge_response` with the
+original hash merges on synthetic data of the original size and 10 times larger.
+
+Usage: python -m benchmarks.bench_merge
+"""
+import pandas as pd
+
+import time
+import cleaner as cln
+import combiner as cbn
+import generator as gen
+import schema
+from benchmarks import fixtures
+
+
+def merge_response_hash(response, portfolio_cleaned, profile_cleaned):
+    """The original implementation of `combiner.merge_response`,
+    which joins the data frames with two hash merges.
+    """
+    response_merged = pd.merge(
+        response,
+        portfolio_cleaned,
+        on='offer_id',
+        how='left',
+        validate='many_to_one')
+
+    response_merged = pd.merge(
+        response_merged,
+        profile_cleaned,
+        on='profile_id',
+        how='left',
+        validate='many_to_one')
+
+    # make sure some column types are correct
+    response_merged[['reg_year']] = response_merged[['reg_year']].astype(int)
+    response_merged[['reg_month']] = response_merged[['reg_month']].astype(int)
+
+    return response_merged
+
+
+def best_time(func, *args, repeat=5):
+    """Returns the result and the best wall time of several function calls.
+    """
+    best = None
+    for _ in range(repeat):
+        start_time = time.time()
+        result = func(*args)
+        wall_time = time.time() - start_time
+        best = wall_time if best is None else min(best, wall_time)
+
+    return (result, best)
+
+
+def main():
+    """The main function.
+    """
+    for scale in [1, 10]:
+        portfolio, profile, transcript = fixtures.make_fixtures(scale)
+        offer_id_map = gen.gen_id_map(portfolio['id'])
+        profile_id_map = gen.gen_id_map(profile['id'])
+        portfolio_cleaned = schema.enforce(
+            cln.clean_portfolio_df(portfolio, offer_id_map),
+            schema.PORTFOLIO_CLEANED)
+        profile_cleaned = schema.enforce(
+            cln.clean_profile_df(profile, profile_id_map, True, False),
+            schema.PROFILE_CLEANED)
+        response = cbn.create_response(
+            cln.clean_transcript_df(transcript, offer_id_map, profile_id_map))
+
+        expected, hash_time = best_time(merge_response_hash, response,
+                                        portfolio_cleaned, profile_cleaned)
+        response_merged, positional_time = best_time(
+            cbn.merge_response, response, portfolio_cleaned, profile_cleaned)
+
+        # only the types of reg_year and reg_month differ
+        pd.testing.assert_frame_equal(
+            response_merged, expected, check_dtype=False, check_exact=True)
+        assert str(response_merged['reg_year'].dtype) == 'int16'
+        assert str(response_merged['reg_month'].dtype) == 'int8'
+
+        print('{}x: {} response rows, {} customers'.format(
+            scale, response.shape[0], profile_cleaned.shape[0]))
+        print('    hash merges (before): {:.3f}s, {:.1f} MB'.format(
+            hash_time, expected.memory_usage(deep=True).sum() / 1e6))
+        print('    positional (after):   {:.3f}s, {:.1f} MB'.format(
+            positional_time,
+            response_merged.memory_usage(deep=True).sum() / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Compares `combiner.combine_out_of_core` with the in-memory `combiner.combine`
+on synthetic data of the original size and 10 times larger.
+Both add the features of the in-window spend, and the stored rows of the
+out-of-core run are checked to be exactly the rows of the in-memory run.
+
+Usage: python -m benchmarks.bench_out_of_core [--scales 1 10] [--memory-budget 16M]
+"""
+import pandas as pd
+
+import os
+import time
+import argparse
+import tempfile
+import cleaner as cln
+import combiner as cmb
+import generator as gen
+import storer as sto
+from benchmarks import fixtures
+
+
+def main(scales, memory_budget):
+    """The main function.
+    """
+    for scale in scales:
+        portfolio, profile, transcript = fixtures.make_fixtures(scale)
+        portfolio_cleaned, profile_cleaned, transcript_cleaned = cln.clean(
+            portfolio, profile, transcript, gen.gen_id_map(portfolio['id']),
+            gen.gen_id_map(profile['id']))
+        del transcript
+
+        start_time = time.time()
+        expected = cmb.combine(
+            portfolio_cleaned,
+            profile_cleaned,
+            transcript_cleaned[cmb.RESPONSE_INPUT_COLUMNS],
+            window_spend=True)
+        in_memory_seconds = time.time() - start_time
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            transcript_cleaned_path = os.path.join(tmp_dir, 'transcript')
+            response_agg_path = os.path.join(tmp_dir, 'response_agg')
+            sto.store(transcript_cleaned, transcript_cleaned_path, 'columnar')
+            num_events = transcript_cleaned.shape[0]
+            del transcript_cleaned
+
+            start_time = time.time()
+            cmb.combine_out_of_core(portfolio_cleaned, profile_cleaned,
+                                    transcript_cleaned_path, response_agg_path,
+                                    memory_budget, True)
+            out_of_core_seconds = time.time() - start_time
+
+            response_agg = sto.load(response_agg_path)
+
+        # the window columns are summed per window, so they are exact as well
+        pd.testing.assert_frame_equal(
+            response_agg.reset_index(drop=True),
+            expected.reset_index(drop=True),
+            check_exact=True)
+
+        print('{}x: {} events, response_agg.shape: {}'.format(
+            scale, num_events, response_agg.shape))
+        print('    in memory:   {:.3f}s'.format(in_memory_seconds))
+        print('    out of core: {:.3f}s'.format(out_of_core_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the out-of-core combiner.')
+    parser.add_argument(
+        '--scales',
+        type=int,
+        nargs='+',
+        default=[1, 10],
+        help='the sizes of the synthetic data in multiples of the original data')
+    parser.add_argument(
+        '--memory-budget',
+        type=cmb.parse_size,
+        default=cmb.parse_size('16M'),
+        help='the memory budget of the out-of-core combiner, e.g. 16M')
+    args = parser.parse_args()
+
+    main(args.scales, args.memory_budget)
@@ -0,0 +1,85 @@
+"""Compares the store and load throughput of the storage backends in `storer`
+on a synthetic cleaned transcript.
+
+Usage: python -m benchmarks.bench_storer [--times N]
+"""
+import pandas as pd
+
+import os
+import time
+import argparse
+import tempfile
+import cleaner as cln
+import generator as gen
+import schema
+import storer as sto
+from benchmarks import fixtures
+
+
+def make_transcript_cleaned(times):
+    """Makes a synthetic cleaned transcript that is several times larger than the original.
+    """
+    portfolio, profile = fixtures.load_portfolio_and_profile()
+    transcript = fixtures.make_transcript(portfolio, profile)
+    transcript_cleaned = cln.clean_transcript_df(
+        transcript, gen.gen_id_map(portfolio['id']),
+        gen.gen_id_map(profile['id']))
+    transcript_cleaned = schema.enforce(transcript_cleaned,
+                                        schema.TRANSCRIPT_CLEANED)
+
+    return pd.concat([transcript_cleaned] * times, ignore_index=True)
+
+
+def timed(func, *args, **kwargs):
+    """Returns the result and the wall time of a function call.
+    """
+    start_time = time.time()
+    result = func(*args, **kwargs)
+    return (result, time.time() - start_time)
+
+
+def report(name, num_bytes, seconds):
+    print('    {:<36}{:>8.3f}s {:>10.1f} MB/s'.format(name, seconds,
+                                                     num_bytes / 1e6 / seconds))
+
+
+def main(times):
+    """The main function.
+    """
+    transcript_cleaned = make_transcript_cleaned(times)
+    num_bytes = transcript_cleaned.memory_usage(deep=True).sum()
+    columns = ['profile_id', 'time']
+    print('transcript_cleaned.shape: {}, {:.1f} MB in memory'.format(
+        transcript_cleaned.shape, num_bytes / 1e6))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in ['joblib', 'columnar']:
+            path = os.path.join(tmp_dir, backend)
+            print('{}:'.format(backend))
+
+            _, seconds = timed(sto.store, transcript_cleaned, path, backend)
+            report('store', num_bytes, seconds)
+
+            loaded, seconds = timed(sto.load, path)
+            report('load all columns', num_bytes, seconds)
+            pd.testing.assert_frame_equal(loaded, transcript_cleaned)
+
+            _, seconds = timed(sto.load, path, columns)
+            report('load {}'.format(columns), num_bytes, seconds)
+
+            if backend == 'columnar':
+                _, seconds = timed(sto.load_arrays, path, columns)
+                report('memory-map {}'.format(columns), num_bytes, seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the storage backends.')
+    parser.add_argument(
+        '--times',
+        type=int,
+        default=10,
+        help='how many times larger than the original transcript')
+    args = parser.parse_args()
+
+    main(args.times)
@@ -0,0 +1,96 @@
+"""Compares updating the aggregated response with a batch of new events by
+`updater.ResponseUpdater` with combining the whole transcript again.
+The batch is the latest events of the synthetic transcript, and the state
+is built from all earlier events and stored. The batch is applied to the
+stored state in place, and the updated result is checked against the full result.
+
+Usage: python -m benchmarks.bench_update [--scales 1 10] [--batch-sizes 1000 10000]
+"""
+import numpy as np
+import pandas as pd
+
+import time
+import argparse
+import tempfile
+import cleaner as cln
+import combiner as cmb
+import generator as gen
+import updater as upd
+from benchmarks import fixtures
+
+
+def main(scales, batch_sizes):
+    for scale in scales:
+        portfolio, profile, transcript = fixtures.make_fixtures(scale)
+        portfolio_cleaned, profile_cleaned, transcript_cleaned = cln.clean(
+            portfolio, profile, transcript, gen.gen_id_map(portfolio['id']),
+            gen.gen_id_map(profile['id']))
+        del transcript
+
+        # the events arrive in time order
+        order = np.argsort(transcript_cleaned['time'].values, kind='mergesort')
+        transcript_cleaned = transcript_cleaned.iloc[order].reset_index(
+            drop=True)
+
+        start_time = time.time()
+        response_agg = cmb.combine(portfolio_cleaned, profile_cleaned,
+                                   transcript_cleaned)
+        full_seconds = time.time() - start_time
+
+        for batch_size in batch_sizes:
+            history = transcript_cleaned.iloc[:-batch_size]
+            batch = transcript_cleaned.iloc[-batch_size:]
+
+            updater = upd.ResponseUpdater()
+            updater.update(history, portfolio_cleaned)
+
+            with tempfile.TemporaryDirectory() as state_dir:
+                updater.store(state_dir)
+
+                # the stored state is memory-mapped and updated in place
+                start_time = time.time()
+                updater = upd.ResponseUpdater.load(state_dir)
+                profile_ids = updater.update(batch, portfolio_cleaned)
+                update_seconds = time.time() - start_time
+                updater.store(state_dir)
+                store_seconds = time.time() - start_time - update_seconds
+
+                start_time = time.time()
+                updated = updater.get_response_agg(profile_cleaned)
+                output_seconds = time.time() - start_time
+
+                pd.testing.assert_frame_equal(
+                    updated, response_agg, check_exact=False, rtol=1e-9)
+                del updater
+
+            print('scale {}x, {} events in the history, a batch of {} events '
+                  '({} customers):'.format(scale, history.shape[0],
+                                           batch_size, len(profile_ids)))
+            print('    combine the whole transcript: {:.3f}s'.format(
+                full_seconds))
+            print('    load and update the state:    {:.3f}s'.format(
+                update_seconds))
+            print('    store the state:              {:.3f}s'.format(
+                store_seconds))
+            print('    make the aggregated response: {:.3f}s'.format(
+                output_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the incremental update of the response.')
+    parser.add_argument(
+        '--scales',
+        type=int,
+        nargs='+',
+        default=[1, 10],
+        help='the sizes of the synthetic data in multiples of the original data')
+    parser.add_argument(
+        '--batch-sizes',
+        type=int,
+        nargs='+',
+        default=[1000, 10000],
+        help='the numbers of new events in a batch')
+    args = parser.parse_args()
+
+    main(args.scales, args.batch_sizes)
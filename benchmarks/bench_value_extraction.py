@@ -0,0 +1,76 @@
+"""Compares the single-pass extraction of column 'value' in
+`cleaner.extract_value_cols` with the original four `apply` passes.
+
+Usage: python -m benchmarks.bench_value_extraction
+"""
+import numpy as np
+
+import time
+import cleaner as cln
+import generator as gen
+from benchmarks import fixtures
+
+
+def extract_value_cols_apply(value_col, offer_id_map):
+    """The original extraction of column 'value' in `cleaner.clean_transcript_df`.
+    """
+
+    def extract_offer_id_from_value(value):
+        keys = value.keys()
+        if 'offer_id' in keys:
+            return value['offer_id']
+        elif 'offer id' in keys:
+            return value['offer id']
+        else:
+            return '0'
+
+    offer_id_strs = value_col.apply(lambda x: extract_offer_id_from_value(x))
+
+    offer_ids = offer_id_strs.apply(lambda x: offer_id_map[x]
+                                    if x != '0' else 0)
+
+    amounts = value_col.apply(lambda x: x['amount']
+                              if 'amount' in x.keys() else 0)
+
+    rewards = value_col.apply(lambda x: x['reward']
+                              if 'reward' in x.keys() else 0)
+
+    return (offer_ids.values, amounts.values, rewards.values)
+
+
+def best_time(func, *args, repeat=5):
+    """Returns the result and the best wall time of several calls.
+    """
+    times = []
+    for _ in range(repeat):
+        start_time = time.time()
+        result = func(*args)
+        times.append(time.time() - start_time)
+
+    return (result, min(times))
+
+
+def main():
+    """The main function.
+    """
+    portfolio, profile = fixtures.load_portfolio_and_profile()
+    transcript = fixtures.make_transcript(portfolio, profile)
+    offer_id_map = gen.gen_id_map(portfolio['id'])
+    print('The number of values: {}'.format(transcript.shape[0]))
+
+    expected, apply_time = best_time(extract_value_cols_apply,
+                                     transcript['value'], offer_id_map)
+    print('four apply passes: {:.3f}s'.format(apply_time))
+
+    result, single_time = best_time(cln.extract_value_cols,
+                                    transcript['value'], offer_id_map)
+    print('single pass:       {:.3f}s ({:.1f}x)'.format(
+        single_time, apply_time / single_time))
+
+    for new_col, old_col in zip(result, expected):
+        np.testing.assert_array_equal(new_col, old_col)
+    print('The outputs are identical.')
+
+
+if __name__ == '__main__':
+    main()
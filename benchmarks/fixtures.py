@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+
+import os
+import constant
+
+# The hours at which the offers are sent out in the original transcript.
+OFFER_WAVES = [0, 168, 336, 408, 504, 576]
+# The last hour recorded in the original transcript.
+MAX_TIME = 714
+# The number of customers in the original profile.
+NUM_CUSTOMERS = 17000
+
+# The offers of the original portfolio, without their IDs:
+# (reward, channels, difficulty, duration, offer_type).
+OFFERS = [
+    (10, ['email', 'mobile', 'social'], 10, 7, 'bogo'),
+    (10, ['web', 'email', 'mobile', 'social'], 10, 5, 'bogo'),
+    (0, ['web', 'email', 'mobile'], 0, 4, 'informational'),
+    (5, ['web', 'email', 'mobile'], 5, 7, 'bogo'),
+    (5, ['web', 'email'], 20, 10, 'discount'),
+    (3, ['web', 'email', 'mobile', 'social'], 7, 7, 'discount'),
+    (2, ['web', 'email', 'mobile', 'social'], 10, 10, 'discount'),
+    (0, ['email', 'mobile', 'social'], 0, 3, 'informational'),
+    (5, ['web', 'email', 'mobile', 'social'], 5, 5, 'bogo'),
+    (2, ['web', 'email', 'mobile'], 10, 7, 'discount'),
+]
+# The genders in the original profile and their shares. None means unknown.
+GENDERS = ['M', 'F', None, 'O']
+GENDER_SHARES = [0.4991, 0.3605, 0.1279, 0.0125]
+
+
+def load_portfolio_and_profile(input_dir=constant.DATA_DIR):
+    """Loads the original portfolio and profile data.
+    """
+    portfolio = pd.read_json(
+        os.path.join(input_dir, constant.JSON_PORTFOLIO),
+        orient='records',
+        lines=True)
+    profile = pd.read_json(
+        os.path.join(input_dir, constant.JSON_PROFILE),
+        orient='records',
+        lines=True)
+
+    return (portfolio, profile)
+
+
+def make_ids(num_ids, rs):
+    """Makes unique random IDs of 32 hexadecimal digits, like the original IDs.
+    """
+    ids = {}
+    while len(ids) < num_ids:
+        # the IDs are kept in the order in which they are made
+        ids.update((rs.bytes(16).hex(), None)
+                   for _ in range(num_ids - len(ids)))
+
+    return list(ids)
+
+
+def make_portfolio(seed=103):
+    """Makes a synthetic portfolio with the offers of the original one and new IDs.
+    Its columns have the types that pandas.read_json gives for the original file.
+    """
+    rs = np.random.RandomState(seed)
+    portfolio = pd.DataFrame(
+        data=[list(offer) for offer in OFFERS],
+        columns=['reward', 'channels', 'difficulty', 'duration', 'offer_type'])
+    portfolio['id'] = make_ids(len(OFFERS), rs)
+
+    return portfolio
+
+
+def make_profile(num_customers=NUM_CUSTOMERS, seed=103):
+    """Makes a deterministic synthetic profile of customers.
+    It has the same schema and the same quirks as the original profile:
+    a customer of unknown gender has age 118 and no income,
+    and 'became_member_on' is an integer like 20170715.
+    """
+    rs = np.random.RandomState(seed)
+    genders = np.asarray(GENDERS, dtype=object)[rs.choice(
+        len(GENDERS), size=num_customers, p=GENDER_SHARES)]
+    unknown = pd.isnull(genders)
+
+    ages = np.clip(np.round(rs.normal(54.4, 17.4, num_customers)), 18, 101)
+    ages[unknown] = 118
+    incomes = np.clip(
+        np.round(rs.normal(65405, 21598, num_customers), -3), 30000, 120000)
+    incomes[unknown] = np.nan
+
+    first_day = pd.Timestamp('2013-07-29')
+    days = rs.randint(0, (pd.Timestamp('2018-07-26') - first_day).days + 1,
+                      num_customers)
+    member_dates = first_day + pd.to_timedelta(days, unit='D')
+    became_member_on = (member_dates.year * 10000 + member_dates.month * 100 +
+                        member_dates.day).values.astype(np.int64)
+
+    profile = pd.DataFrame({
+        'gender': genders,
+        'age': ages.astype(np.int64),
+        'id': make_ids(num_customers, rs),
+        'became_member_on': became_member_on,
+        'income': incomes
+    })
+
+    return profile[['gender', 'age', 'id', 'became_member_on', 'income']]
+
+
+def make_fixtures(scale=1, seed=103):
+    """Makes the synthetic portfolio, profile and transcript
+    with `scale` times the customers of the original data.
+    """
+    portfolio = make_portfolio(seed)
+    profile = make_profile(NUM_CUSTOMERS * scale, seed)
+    transcript = make_transcript(portfolio, profile, seed)
+
+    return (portfolio, profile, transcript)
+
+
+def write_fixtures(dir_path, scale=1, seed=103):
+    """Writes the synthetic data as JSON lines files named like the original ones,
+    so that the programs can be run on them.
+    """
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+    for df, name in zip(
+            make_fixtures(scale, seed),
+        [constant.JSON_PORTFOLIO, constant.JSON_PROFILE,
+         constant.JSON_TRANSCRIPT]):
+        df.to_json(
+            os.path.join(dir_path, name), orient='records', lines=True)
+
+
+def make_transcript(portfolio, profile, seed=103):
+    """Makes a deterministic synthetic transcript for the given offers and customers.
+    It has the same schema and the same quirks as the original transcript:
+    'offer received' and 'offer viewed' carry {'offer id': ...},
+    'offer completed' carries {'offer_id': ..., 'reward': ...}
+    and 'transaction' carries {'amount': ...}.
+
+    Parameters
+    ----------
+    portfolio : pandas.Dataframe
+        The data frame containing the original offer data.
+
+    profile : pandas.Dataframe
+        The data frame containing the original profile data.
+
+    seed : int
+        The seed of the random number generator.
+
+    Returns
+    -------
+    transcript : pandas.Dataframe
+        The data frame containing the synthetic event records.
+    """
+    rs = np.random.RandomState(seed)
+    person_ids = profile['id'].values
+    offer_ids = portfolio['id'].values
+    offer_types = portfolio['offer_type'].values
+    offer_rewards = portfolio['reward'].values
+    offer_durations = portfolio['duration'].values.astype(int)
+
+    # offer received
+    num_persons = len(person_ids)
+    num_waves = len(OFFER_WAVES)
+    received_mask = rs.rand(num_persons, num_waves) < 0.75
+    recv_person, recv_wave = np.nonzero(received_mask)
+    recv_time = np.asarray(OFFER_WAVES)[recv_wave]
+    recv_offer = rs.randint(0, len(offer_ids), size=len(recv_person))
+
+    # offer viewed
+    viewed_mask = rs.rand(len(recv_person)) < 0.75
+    view_person = recv_person[viewed_mask]
+    view_offer = recv_offer[viewed_mask]
+    view_time = recv_time[viewed_mask] + 6 * rs.randint(
+        0, 12, size=viewed_mask.sum())
+
+    # offer completed, which always coincides with a transaction
+    completable = offer_types[recv_offer] != 'informational'
+    completed_mask = completable & (rs.rand(len(recv_person)) < 0.55)
+    comp_person = recv_person[completed_mask]
+    comp_offer = recv_offer[completed_mask]
+    comp_time = recv_time[completed_mask] + 6 * rs.randint(
+        0, 4 * offer_durations[comp_offer] + 1)
+    comp_time = np.minimum(comp_time, MAX_TIME)
+
+    # transaction
+    num_tx = rs.poisson(6.2, size=num_persons)
+    tx_person = np.concatenate(
+        [np.repeat(np.arange(num_persons), num_tx), comp_person])
+    tx_time = np.concatenate(
+        [6 * rs.randint(0, MAX_TIME // 6 + 1, size=num_tx.sum()), comp_time])
+    tx_amount = np.round(
+        rs.lognormal(mean=2.3, sigma=0.8, size=len(tx_person)), 2)
+
+    events = np.concatenate([
+        np.repeat('offer received', len(recv_person)),
+        np.repeat('offer viewed', len(view_person)),
+        np.repeat('transaction', len(tx_person)),
+        np.repeat('offer completed', len(comp_person))
+    ])
+    persons = np.concatenate([recv_person, view_person, tx_person, comp_person])
+    times = np.concatenate([recv_time, view_time, tx_time, comp_time])
+    values = [{'offer id': offer_ids[o]} for o in recv_offer]
+    values += [{'offer id': offer_ids[o]} for o in view_offer]
+    values += [{'amount': float(a)} for a in tx_amount]
+    values += [{
+        'offer_id': offer_ids[o],
+        'reward': int(offer_rewards[o])
+    } for o in comp_offer]
+
+    # The events are recorded in chronological order.
+    order = np.argsort(times, kind='mergesort')
+
+    transcript = pd.DataFrame({
+        'person': person_ids[persons[order]],
+        'event': events[order],
+        'value': [values[i] for i in order],
+        'time': times[order]
+    })
+
+    return transcript[['person', 'event', 'value', 'time']]
@@ -0,0 +1,143 @@
+"""Measures the latency of the customer lookup service in server.py.
+By default, the service is started in this process on the outputs of model.py,
+otherwise the service at `--url` is tested.
+
+Usage: python -m benchmarks.load_test [--url URL] [--requests N] [--concurrency N] [--batch-size N]
+"""
+import numpy as np
+from werkzeug.serving import make_server
+
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import constant
+import generator as gen
+import server
+import storer as sto
+
+
+def load_ids(model_dir, processed_data_dir):
+    """Loads the integer and the original IDs of the labeled customers.
+    """
+    response_labeled = sto.load(
+        os.path.join(model_dir, constant.PICKLE_RESPONSE_LABELED))
+    ids = [str(id) for id in response_labeled['profile_id'].values]
+
+    profile_id_map_path = os.path.join(processed_data_dir,
+                                       constant.TXT_PROFILE_ID_MAP)
+    if os.path.exists(profile_id_map_path):
+        profile_id_map = gen.IdEncoder.load(profile_id_map_path)
+        ids += profile_id_map.decode(
+            response_labeled['profile_id'].values).tolist()
+
+    return ids
+
+
+def start_server(model_dir, processed_data_dir):
+    """Starts the service in a background thread and returns its URL and the service.
+    """
+    service = server.CustomerService(model_dir, processed_data_dir,
+                                     reload_interval=0)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    http_server = make_server(
+        '127.0.0.1', 0, server.create_app(service), threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+    return ('http://127.0.0.1:{}'.format(http_server.server_port), service)
+
+
+def send(url, ids, batch_size):
+    """Sends one lookup request and returns its latency in seconds.
+    """
+    if batch_size == 0:
+        req = urllib.request.Request('{}/customers/{}'.format(url, ids[0]))
+    else:
+        req = urllib.request.Request(
+            '{}/customers'.format(url),
+            data=json.dumps({
+                'ids': ids
+            }).encode(),
+            headers={'Content-Type': 'application/json'})
+
+    start_time = time.perf_counter()
+    with urllib.request.urlopen(req) as response:
+        response.read()
+    return time.perf_counter() - start_time
+
+
+def main(url, num_requests, concurrency, batch_size, model_dir,
+         processed_data_dir):
+    """The main function.
+    """
+    ids = load_ids(model_dir, processed_data_dir)
+    service = None
+    if url is None:
+        url, service = start_server(model_dir, processed_data_dir)
+
+    rs = np.random.RandomState(103)
+    requests = [[ids[i] for i in rs.randint(0, len(ids), max(batch_size, 1))]
+                for _ in range(num_requests)]
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = np.array(
+            list(
+                executor.map(lambda req: send(url, req, batch_size),
+                             requests)))
+    seconds = time.time() - start_time
+
+    print('{} requests of {} ({} concurrent): {:.0f} requests/s'.format(
+        num_requests,
+        'single lookups' if batch_size == 0 else
+        'batches of {}'.format(batch_size), concurrency,
+        num_requests / seconds))
+    print('    p50: {:.3f} ms'.format(np.percentile(latencies, 50) * 1000))
+    print('    p99: {:.3f} ms'.format(np.percentile(latencies, 99) * 1000))
+
+    if service is not None:
+        # the time spent in the index, without HTTP and JSON
+        latencies = []
+        for req in requests:
+            start_time = time.perf_counter()
+            for key in req:
+                service.index.lookup(key)
+            latencies.append(time.perf_counter() - start_time)
+        print('lookups in the index:')
+        print('    p50: {:.3f} ms'.format(np.percentile(latencies, 50) * 1000))
+        print('    p99: {:.3f} ms'.format(np.percentile(latencies, 99) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load test the customer lookup service.')
+    parser.add_argument(
+        '--url', help='the URL of a running service, e.g. http://127.0.0.1:5000')
+    parser.add_argument(
+        '--requests', type=int, default=5000, help='the number of requests')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=4,
+        help='the number of concurrent clients')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=0,
+        help='the number of customers in each batch request, 0 for single lookups')
+    parser.add_argument(
+        '--model-dir',
+        default=constant.MODEL_DIR,
+        help='the directory of the outputs of model.py')
+    parser.add_argument(
+        '--processed-data-dir',
+        default=constant.PROCESSED_DATA_DIR,
+        help='the directory of the processed data')
+    args = parser.parse_args()
+
+    main(args.url, args.requests, args.concurrency, args.batch_size,
+         args.model_dir, args.processed_data_dir)
@@ -0,0 +1,303 @@
+"""Times every stage of the pipeline on deterministic synthetic data
+at several scales of the original data, and appends the results to a history file.
+Each result is compared with the latest earlier result of the same benchmark.
+
+Usage: python -m benchmarks.suite [--scales 1 10 100] [--repeat N] [--history PATH]
+"""
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn import cluster
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import cleaner as cln
+import combiner as cmb
+import evaluator as evl
+import generator as gen
+import model as mdl
+import schema
+import storer as sto
+from benchmarks import fixtures
+
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), 'history.jsonl')
+# The exact model and the exact evaluation need O(n^2) memory,
+# so they are only timed for up to this many customers.
+EXACT_LIMIT = 20000
+# A result slower than the previous one by this ratio and by this many seconds
+# is reported as a regression, so that the noise of tiny timings is ignored.
+REGRESSION_RATIO = 1.2
+REGRESSION_SECONDS = 0.05
+
+
+class Suite:
+    """Suite times the benchmarks and collects the results.
+    """
+
+    def __init__(self, scale, repeat=1):
+        self.scale = scale
+        self.repeat = repeat
+        self.results = []
+
+    def time(self, name, func, *args, rows=None):
+        """Times a function call, and returns its result.
+        The best time of `repeat` calls is recorded.
+        """
+        times = []
+        for _ in range(self.repeat):
+            start_time = time.perf_counter()
+            result = func(*args)
+            times.append(time.perf_counter() - start_time)
+
+        seconds = min(times)
+        self.results.append({
+            'scale': self.scale,
+            'benchmark': name,
+            'seconds': seconds,
+            'rows': rows,
+            'rows_per_second': rows / seconds if rows and seconds > 0 else None
+        })
+        print('    {:<40}{:>10.3f}s'.format(name, seconds))
+
+        return result
+
+
+def run_scale(scale, repeat):
+    """Runs all benchmarks at one scale, and returns the results.
+    """
+    suite = Suite(scale, repeat)
+    print('Scale {}x:'.format(scale))
+
+    portfolio, profile, transcript = suite.time(
+        'fixtures', fixtures.make_fixtures, scale)
+    print('    ({} customers, {} events)'.format(profile.shape[0],
+                                                 transcript.shape[0]))
+
+    # cleaner
+    offer_id_map = gen.gen_id_map(portfolio['id'])
+    profile_id_map = suite.time(
+        'gen_id_map(profile)',
+        gen.gen_id_map,
+        profile['id'],
+        rows=profile.shape[0])
+    portfolio_cleaned = suite.time(
+        'clean_portfolio_df',
+        cln.clean_portfolio_df,
+        portfolio,
+        offer_id_map,
+        rows=portfolio.shape[0])
+    profile_cleaned = suite.time(
+        'clean_profile_df',
+        cln.clean_profile_df,
+        profile,
+        profile_id_map,
+        True,
+        False,
+        rows=profile.shape[0])
+    transcript_cleaned = suite.time(
+        'clean_transcript_df',
+        cln.clean_transcript_df,
+        transcript,
+        offer_id_map,
+        profile_id_map,
+        rows=transcript.shape[0])
+    del transcript
+
+    portfolio_cleaned = schema.enforce(portfolio_cleaned,
+                                       schema.PORTFOLIO_CLEANED)
+    profile_cleaned = schema.enforce(profile_cleaned, schema.PROFILE_CLEANED)
+    transcript_cleaned = suite.time(
+        'schema.enforce(transcript)',
+        schema.enforce,
+        transcript_cleaned,
+        schema.TRANSCRIPT_CLEANED,
+        rows=transcript_cleaned.shape[0])
+
+    # storer
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in ['joblib', 'columnar']:
+            path = os.path.join(tmp_dir, backend)
+            suite.time(
+                'storer.store(transcript, {})'.format(backend),
+                sto.store,
+                transcript_cleaned,
+                path,
+                backend,
+                rows=transcript_cleaned.shape[0])
+            suite.time(
+                'storer.load(transcript, {})'.format(backend),
+                sto.load,
+                path,
+                rows=transcript_cleaned.shape[0])
+
+    # combiner
+    response = suite.time(
+        'create_response',
+        cmb.create_response,
+        transcript_cleaned,
+        rows=transcript_cleaned.shape[0])
+    del transcript_cleaned
+    response_merged = suite.time(
+        'merge_response',
+        cmb.merge_response,
+        response,
+        portfolio_cleaned,
+        profile_cleaned,
+        rows=response.shape[0])
+    response_merged = response_merged[
+        response_merged['offer_type'] != 'informational']
+    response_agg = suite.time(
+        'aggregate_merged_response',
+        cmb.aggregate_merged_response,
+        response_merged,
+        profile_cleaned,
+        rows=response_merged.shape[0])
+    response_agg = schema.enforce(response_agg, schema.RESPONSE_AGG)
+
+    # model
+    _, _, X_scaled, _ = mdl.scale_features(response_agg)
+    num_customers = X_scaled.shape[0]
+    summary_model = mdl.SummaryClustering(n_clusters=6)
+    labels = suite.time(
+        'SummaryClustering.fit_predict',
+        summary_model.fit_predict,
+        X_scaled,
+        rows=num_customers)
+    if num_customers <= EXACT_LIMIT:
+        exact_model = cluster.AgglomerativeClustering(
+            n_clusters=6, affinity='manhattan', linkage='average')
+        labels = suite.time(
+            'AgglomerativeClustering.fit_predict',
+            exact_model.fit_predict,
+            X_scaled,
+            rows=num_customers)
+        suite.time(
+            'chunked_silhouette_score',
+            evl.chunked_silhouette_score,
+            X_scaled,
+            labels,
+            rows=num_customers)
+    suite.time(
+        'sampled_silhouette_score',
+        evl.sampled_silhouette_score,
+        X_scaled,
+        labels,
+        rows=num_customers)
+
+    return suite.results
+
+
+def get_environment():
+    """Describes the code and the environment of a run.
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+
+def load_history(history_path):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results, history):
+    """Compares the results with the latest earlier results of the same benchmarks.
+    Returns the number of regressions.
+    """
+    previous = {}
+    for record in history:
+        previous[(record['scale'], record['benchmark'])] = record
+
+    num_regressions = 0
+    print('Comparison with the previous run:')
+    for result in results:
+        record = previous.get((result['scale'], result['benchmark']))
+        if record is None:
+            continue
+        ratio = result['seconds'] / max(record['seconds'], 1e-9)
+        flag = ''
+        if (ratio > REGRESSION_RATIO and
+                result['seconds'] - record['seconds'] > REGRESSION_SECONDS):
+            flag = '  REGRESSION'
+            num_regressions += 1
+        print('    {:>4}x {:<40}{:>10.3f}s -> {:>8.3f}s  x{:.2f}{}'.format(
+            result['scale'], result['benchmark'], record['seconds'],
+            result['seconds'], ratio, flag))
+
+    return num_regressions
+
+
+def main(scales, repeat, history_path):
+    """The main function.
+    """
+    run_id = time.strftime('%Y%m%dT%H%M%S')
+    environment = get_environment()
+
+    results = []
+    for scale in scales:
+        results += run_scale(scale, repeat)
+
+    history = load_history(history_path)
+    num_regressions = compare(results, history)
+
+    with open(history_path, 'a') as f:
+        for result in results:
+            record = {'run_id': run_id}
+            record.update(environment)
+            record.update(result)
+            f.write(json.dumps(record) + '\n')
+    print('{} results are appended to {}, {} regression(s).'.format(
+        len(results), history_path, num_regressions))
+
+    return num_regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark every stage of the pipeline.')
+    parser.add_argument(
+        '--scales',
+        type=int,
+        nargs='+',
+        default=[1, 10],
+        help='the sizes of the synthetic data in multiples of the original data')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='the number of times each benchmark is run, the best time is kept')
+    parser.add_argument(
+        '--history',
+        default=HISTORY_PATH,
+        help='the JSON lines file to which the results are appended')
+    parser.add_argument(
+        '--fail-on-regression',
+        action='store_true',
+        help='exit with status 1 if any benchmark regressed')
+    args = parser.parse_args()
+
+    num_regressions = main(args.scales, args.repeat, args.history)
+    if args.fail_on_regression and num_regressions > 0:
+        sys.exit(1)
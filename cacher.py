@@ -0,0 +1,198 @@
+import os
+import ast
+import json
+import time
+import shutil
+import hashlib
+import storer as sto
+
+# The sidecar file describing a cache entry.
+ENTRY_META = 'entry.json'
+# The default limits of a stage cache.
+MAX_BYTES = 2 * 2**30
+MAX_AGE = 30 * 24 * 3600
+
+
+def run_cached(stage,
+               func,
+               input_paths,
+               output_paths,
+               params,
+               cache_dir,
+               max_bytes=MAX_BYTES,
+               max_age=MAX_AGE):
+    """Runs a pipeline stage, unless its outputs for the same inputs are in the cache.
+
+    The fingerprint of a stage is the hash of the contents of its input files,
+    its parameters and the source files of the stage and the local modules it imports. If an entry with the same fingerprint
+    is in the cache, the outputs are copied from it instead of running the stage.
+    Otherwise the stage is run, and its outputs are copied into a new entry.
+
+    Parameters
+    ----------
+    stage : str
+        The name of the stage, which is also the name of its module, e.g. 'cleaner'.
+
+    func : function
+        The function running the stage without any argument.
+
+    input_paths : list
+        The paths of the input files or directories. Missing paths are allowed.
+
+    output_paths : list
+        The paths of the output files or directories.
+
+    params : dict
+        The parameters of the stage that change its outputs.
+
+    cache_dir : str
+        The directory of the cache.
+
+    max_bytes : int
+        The maximum size of the cache in bytes.
+
+    max_age : float
+        The maximum age of an unused entry in seconds.
+
+    Returns
+    -------
+    hit : bool
+        Whether the outputs were taken from the cache.
+    """
+    key = fingerprint(stage, input_paths, params)
+    entry_dir = os.path.join(cache_dir, '{}-{}'.format(stage, key))
+
+    if os.path.exists(os.path.join(entry_dir, ENTRY_META)):
+        print('The inputs of {} have not changed, '
+              'restore its outputs from {}...'.format(stage, entry_dir))
+        for i, output_path in enumerate(output_paths):
+            copy(os.path.join(entry_dir, str(i)), output_path)
+        # the age of an entry is counted from its last use
+        os.utime(os.path.join(entry_dir, ENTRY_META))
+        print('Done.\n')
+        return True
+
+    func()
+
+    tmp_dir = '{}.{}.tmp'.format(entry_dir, os.getpid())
+    sto.remove(tmp_dir)
+    os.makedirs(tmp_dir)
+    for i, output_path in enumerate(output_paths):
+        copy(output_path, os.path.join(tmp_dir, str(i)))
+    with open(os.path.join(tmp_dir, ENTRY_META), 'w') as f:
+        json.dump({
+            'stage': stage,
+            'inputs': list(input_paths),
+            'outputs': list(output_paths),
+            'params': params
+        },
+                  f,
+                  indent=2)
+    sto.remove(entry_dir)
+    os.rename(tmp_dir, entry_dir)
+
+    evict(cache_dir, max_bytes, max_age)
+
+    return False
+
+
+def fingerprint(stage, input_paths, params):
+    """Returns the hash of the inputs, the parameters and the source files of a stage.
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps(params, sort_keys=True).encode())
+
+    for path in get_source_paths(stage) + list(input_paths):
+        digest.update(os.path.basename(path).encode())
+        for file_path in list_files(path):
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_source_paths(stage):
+    """Returns the source files of a stage and of the local modules
+    it imports directly or indirectly, e.g. schema.py and separater.py.
+    """
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+
+    source_paths = []
+    names = [stage]
+    while names:
+        source_path = os.path.join(source_dir, names.pop() + '.py')
+        if source_path in source_paths or not os.path.isfile(source_path):
+            continue
+        source_paths.append(source_path)
+
+        with open(source_path) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names += [alias.name.split('.')[0] for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names.append(node.module.split('.')[0])
+
+    return sorted(source_paths)
+
+
+def list_files(path):
+    """Lists the files at a path in a stable order.
+    A file is listed as itself, and a missing path as nothing.
+    """
+    if os.path.isfile(path):
+        return [path]
+
+    file_paths = []
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        file_paths += [
+            os.path.join(dir_path, name) for name in sorted(file_names)
+        ]
+
+    return file_paths
+
+
+def copy(src_path, dst_path):
+    """Copies a file or a directory, replacing the destination.
+    """
+    sto.remove(dst_path)
+    dst_dir = os.path.dirname(dst_path)
+    if dst_dir and not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+
+    if os.path.isdir(src_path):
+        shutil.copytree(src_path, dst_path)
+    else:
+        shutil.copyfile(src_path, dst_path)
+
+
+def evict(cache_dir, max_bytes=MAX_BYTES, max_age=MAX_AGE):
+    """Removes the entries unused for longer than `max_age` seconds,
+    and then the least recently used entries until the cache is within `max_bytes`.
+    Returns the number of removed entries.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        meta_path = os.path.join(cache_dir, name, ENTRY_META)
+        if os.path.exists(meta_path):
+            entry_dir = os.path.join(cache_dir, name)
+            size = sum(
+                os.path.getsize(file_path)
+                for file_path in list_files(entry_dir))
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+    entries.sort()
+
+    total_bytes = sum(size for _, size, _ in entries)
+    now = time.time()
+    num_removed = 0
+    for used_time, size, entry_dir in entries:
+        if now - used_time <= max_age and total_bytes <= max_bytes:
+            break
+        sto.remove(entry_dir)
+        total_bytes -= size
+        num_removed += 1
+
+    return num_removed
@@ -3,9 +3,13 @@ import numpy as np
 import separater as sprt
 
 import os
+import argparse
 import constant
+import cacher as cch
 import generator as gen
+import indexer as idx
 import storer as sto
+import schema
 
 
 def clean_portfolio_df(original_df, offer_id_map):
@@ -16,8 +20,8 @@ def clean_portfolio_df(original_df, offer_id_map):
     original_df : pandas.Dataframe
         The data frame containing the offer data.
 
-    offer_id_map : collections.defaultdict
-        The dictionary containing all mappings from the old offer ID to the new offer ID.
+    offer_id_map : generator.IdEncoder
+        The encoder containing all mappings from the old offer ID to the new offer ID.
     
     Returns
     -------
@@ -35,8 +39,8 @@ def clean_portfolio_df(original_df, offer_id_map):
     portfolio_cleaned = portfolio_cleaned.join(channel_df)
 
     # simplify the ID of offer
-    portfolio_cleaned['offer_id'] = portfolio_cleaned['id'].apply(
-        lambda x: offer_id_map[x])
+    portfolio_cleaned['offer_id'] = gen.encode_ids(portfolio_cleaned['id'],
+                                                   offer_id_map)
 
     # drop the useless columns
     useless_columns = ['channels', 'id']
@@ -65,8 +69,8 @@ def clean_profile_df(original_df, profile_id_map, discretize,
     original_df : pandas.Dataframe
         The data frame containing the profile data.
 
-    profile_id_map : collections.defaultdict
-        The dictionary containing all mappings from the old profile ID to the new profile ID.
+    profile_id_map : generator.IdEncoder
+        The encoder containing all mappings from the old profile ID to the new profile ID.
 
     discretize : bool
         Whether to discretize age and income into multiple buckets.
@@ -82,8 +86,8 @@ def clean_profile_df(original_df, profile_id_map, discretize,
     profile_cleaned = original_df.copy()
 
     # simplify the ID of profile
-    profile_cleaned['profile_id'] = profile_cleaned['id'].apply(
-        lambda x: profile_id_map[x])
+    profile_cleaned['profile_id'] = gen.encode_ids(profile_cleaned['id'],
+                                                   profile_id_map)
 
     if drop_missing_rows:
         # drop missing rows
@@ -150,7 +154,10 @@ def clean_profile_df(original_df, profile_id_map, discretize,
     return profile_cleaned
 
 
-def clean_transcript_df(original_df, offer_id_map, profile_id_map):
+def clean_transcript_df(original_df,
+                        offer_id_map,
+                        profile_id_map,
+                        first_event_id=1):
     """Cleans the data frame of transcript.
 
     Parameters
@@ -158,11 +165,14 @@ def clean_transcript_df(original_df, offer_id_map, profile_id_map):
     original_df : pandas.Dataframe
         The data frame containing the profile data.
 
-    offer_id_map : collections.defaultdict
-        The dictionary containing all mappings from the old offer ID to the new offer ID.
+    offer_id_map : generator.IdEncoder
+        The encoder containing all mappings from the old offer ID to the new offer ID.
 
-    profile_id_map : collections.defaultdict
-        The dictionary containing all mappings from the old profile ID to the new profile ID.
+    profile_id_map : generator.IdEncoder
+        The encoder containing all mappings from the old profile ID to the new profile ID.
+
+    first_event_id : int
+        The event ID of the first row, which is not 1 for the later chunks of a transcript.
     
     Returns
     -------
@@ -172,39 +182,23 @@ def clean_transcript_df(original_df, offer_id_map, profile_id_map):
     transcript_cleaned = original_df.copy()
 
     # generate event ID
-    transcript_cleaned['event_id'] = range(1, transcript_cleaned.shape[0] + 1)
+    transcript_cleaned['event_id'] = range(
+        first_event_id, first_event_id + transcript_cleaned.shape[0])
 
     # replace and store the ID of profile(person)
-    transcript_cleaned['profile_id'] = transcript_cleaned['person'].apply(
-        lambda x: profile_id_map[x])
-
-    # extract the ID of offer from value
-    def extract_offer_id_from_value(value):
-        keys = value.keys()
-        if 'offer_id' in keys:
-            return value['offer_id']
-        elif 'offer id' in keys:
-            return value['offer id']
-        else:
-            return '0'
-
-    transcript_cleaned['offer_id_str'] = transcript_cleaned['value'].apply(
-        lambda x: extract_offer_id_from_value(x))
+    transcript_cleaned['profile_id'] = gen.encode_ids(
+        transcript_cleaned['person'], profile_id_map)
 
-    # replace and store the ID of offer
-    transcript_cleaned['offer_id'] = transcript_cleaned['offer_id_str'].apply(
-        lambda x: offer_id_map[x] if x != '0' else 0)
+    # extract the ID of offer, the amount and the reward from value
+    offer_ids, event_amounts, event_rewards = extract_value_cols(
+        transcript_cleaned['value'], offer_id_map)
 
-    # extract the amount from value
-    transcript_cleaned['event_amount'] = transcript_cleaned['value'].apply(
-        lambda x: x['amount'] if 'amount' in x.keys() else 0)
-
-    # extract the reward from value
-    transcript_cleaned['event_reward'] = transcript_cleaned['value'].apply(
-        lambda x: x['reward'] if 'reward' in x.keys() else 0)
+    transcript_cleaned['offer_id'] = offer_ids
+    transcript_cleaned['event_amount'] = event_amounts
+    transcript_cleaned['event_reward'] = event_rewards
 
     # drop the useless columns
-    useless_columns = ['person', 'value', 'offer_id_str']
+    useless_columns = ['person', 'value']
 
     for name in useless_columns:
         if name not in transcript_cleaned.columns:
@@ -220,49 +214,238 @@ def clean_transcript_df(original_df, offer_id_map, profile_id_map):
     return transcript_cleaned
 
 
-def main(input_dir, output_dir):
+def extract_value_cols(value_col, offer_id_map):
+    """Extracts the offer ID, the amount and the reward from column 'value'
+    in a single pass over the dictionaries.
+
+    Parameters
+    ----------
+    value_col : pandas.Series
+        The column containing the dictionaries of the transcript.
+        The offer ID is stored with either the key 'offer_id' or 'offer id'.
+
+    offer_id_map : generator.IdEncoder
+        The encoder containing all mappings from the old offer ID to the new offer ID.
+
+    Returns
+    -------
+    offer_ids : numpy.ndarray
+        The new offer IDs, which are 0 if there is no offer ID in the dictionary.
+
+    amounts : numpy.ndarray
+        The amounts, which are 0.0 if there is no amount in the dictionary.
+
+    rewards : numpy.ndarray
+        The rewards, which are 0 if there is no reward in the dictionary.
+    """
+    values = value_col.values
+    offer_id_strs = []
+    amounts = np.zeros(len(values), dtype=np.float64)
+    rewards = np.zeros(len(values), dtype=np.int64)
+
+    for i, value in enumerate(values):
+        if 'offer_id' in value:
+            offer_id_strs.append(value['offer_id'])
+        elif 'offer id' in value:
+            offer_id_strs.append(value['offer id'])
+        else:
+            offer_id_strs.append('0')
+
+        if 'amount' in value:
+            amounts[i] = value['amount']
+
+        if 'reward' in value:
+            rewards[i] = value['reward']
+
+    # map the few distinct offer IDs first, and then all rows at once
+    codes, uniques = pd.factorize(np.array(offer_id_strs, dtype=object))
+    new_ids = np.zeros(len(uniques), dtype=np.int64)
+    has_offer = uniques != '0'
+    new_ids[has_offer] = gen.encode_ids(uniques[has_offer], offer_id_map)
+    offer_ids = new_ids[codes]
+
+    return (offer_ids, amounts, rewards)
+
+
+def clean_transcript_chunks(transcript_path, offer_id_map, profile_id_map,
+                            chunksize):
+    """Reads the transcript in chunks and cleans them one by one.
+
+    Parameters
+    ----------
+    transcript_path : str
+        The path of the line-delimited JSON file containing the transcript.
+
+    offer_id_map : generator.IdEncoder
+        The encoder containing all mappings from the old offer ID to the new offer ID.
+
+    profile_id_map : generator.IdEncoder
+        The encoder containing all mappings from the old profile ID to the new profile ID.
+
+    chunksize : int
+        The number of lines read at a time.
+
+    Yields
+    ------
+    transcript_cleaned : pandas.Dataframe
+        The data frame containing cleaned transcript data of a chunk.
+    """
+    reader = pd.read_json(
+        transcript_path, orient='records', lines=True, chunksize=chunksize)
+
+    first_event_id = 1
+    for transcript in reader:
+        transcript_cleaned = clean_transcript_df(
+            transcript, offer_id_map, profile_id_map, first_event_id)
+        first_event_id += transcript.shape[0]
+
+        yield transcript_cleaned.reset_index(drop=True)
+
+
+def main(input_dir,
+         output_dir,
+         chunksize=None,
+         discretize=True,
+         drop_missing_rows=False,
+         cache_dir=None):
     """The main function.
+    The transcript is sorted by customer, offer and time and stored with the
+    offsets of its groups, see `indexer`. If `chunksize` is given, the transcript
+    is streamed in chunks of `chunksize` lines instead, and it is not sorted.
+    If `cache_dir` is given, the outputs are restored from the stage cache
+    when the inputs and the parameters have not changed.
     """
     print('Clean up the original data...')
     portfolio_path = os.path.join(input_dir, constant.JSON_PORTFOLIO)
     profile_path = os.path.join(input_dir, constant.JSON_PROFILE)
     transcript_path = os.path.join(input_dir, constant.JSON_TRANSCRIPT)
 
+    if cache_dir is not None:
+        # The ID maps are extended with the new IDs first, so that they are
+        # inputs of the stage and are fingerprinted with the original files.
+        # They are never restored from the cache, which could drop the IDs
+        # appended since the entry was made.
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        gen_id_maps(
+            pd.read_json(portfolio_path, orient='records', lines=True),
+            pd.read_json(profile_path, orient='records', lines=True),
+            output_dir)
+
+        output_paths = list(get_output_file_paths(output_dir))
+        if chunksize is None:
+            output_paths.append(get_offsets_file_path(output_dir))
+        cch.run_cached(
+            'cleaner', lambda: main(input_dir, output_dir, chunksize,
+                                    discretize, drop_missing_rows),
+            [portfolio_path, profile_path, transcript_path] +
+            list(get_id_map_file_paths(output_dir)), output_paths, {
+                'discretize': discretize,
+                'drop_missing_rows': drop_missing_rows,
+                'chunked': chunksize is not None
+            }, cache_dir)
+        return
+
     print('Load original data...')
     portfolio = pd.read_json(portfolio_path, orient='records', lines=True)
     profile = pd.read_json(profile_path, orient='records', lines=True)
-    transcript = pd.read_json(transcript_path, orient='records', lines=True)
-
-    print('Generate map for offer ID...')
-    offer_id_map = gen.gen_id_map(portfolio['id'])
-
-    print('Clean up data about portfolio (offer)...')
-    portfolio_cleaned = clean_portfolio_df(portfolio, offer_id_map)
+    transcript = None
+    if chunksize is None:
+        transcript = pd.read_json(
+            transcript_path, orient='records', lines=True)
 
-    print('Generate map for customer ID...')
-    profile_id_map = gen.gen_id_map(profile['id'])
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-    print('Clean up data about profile (customer)...')
-    profile_cleaned = clean_profile_df(profile, profile_id_map, True, False)
+    offer_id_map, profile_id_map = gen_id_maps(portfolio, profile, output_dir)
 
-    print('Clean up data about transcript (event record)...')
-    transcript_cleaned = clean_transcript_df(transcript, offer_id_map,
-                                             profile_id_map)
+    portfolio_cleaned, profile_cleaned, transcript_cleaned = clean(
+        portfolio, profile, transcript, offer_id_map, profile_id_map,
+        discretize, drop_missing_rows)
 
     print('Store data...')
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
     portfolio_cleaned_path, profile_cleaned_path, transcript_cleaned_path = get_output_file_paths(
         output_dir)
 
     sto.store(portfolio_cleaned, portfolio_cleaned_path)
     sto.store(profile_cleaned, profile_cleaned_path)
-    sto.store(transcript_cleaned, transcript_cleaned_path)
+
+    offsets_path = get_offsets_file_path(output_dir)
+    if chunksize is None:
+        sto.store(transcript_cleaned, transcript_cleaned_path)
+        sto.store(
+            idx.gen_offsets(transcript_cleaned['profile_id'].values,
+                            transcript_cleaned['offer_id'].values),
+            offsets_path)
+    else:
+        sto.remove(offsets_path)
+        print('Clean up and store data about transcript (event record) '
+              'in chunks of {} lines...'.format(chunksize))
+        transcript_chunks = (schema.enforce(chunk, schema.TRANSCRIPT_CLEANED)
+                             for chunk in clean_transcript_chunks(
+                                 transcript_path, offer_id_map,
+                                 profile_id_map, chunksize))
+        sto.store_chunks(transcript_chunks, transcript_cleaned_path)
 
     print('Done.\n')
 
 
+def gen_id_maps(portfolio, profile, id_map_dir):
+    """Generates the maps for offer ID and customer ID,
+    which are extended from and stored to the files in `id_map_dir`.
+    """
+    offer_id_map_path, profile_id_map_path = get_id_map_file_paths(id_map_dir)
+
+    print('Generate map for offer ID...')
+    offer_id_map = gen.gen_id_map(portfolio['id'], offer_id_map_path)
+
+    print('Generate map for customer ID...')
+    profile_id_map = gen.gen_id_map(profile['id'], profile_id_map_path)
+
+    return (offer_id_map, profile_id_map)
+
+
+def clean(portfolio,
+          profile,
+          transcript,
+          offer_id_map,
+          profile_id_map,
+          discretize=True,
+          drop_missing_rows=False):
+    """Cleans up the original data in memory and converts it to the declared schemas.
+
+    Returns
+    -------
+    portfolio_cleaned, profile_cleaned, transcript_cleaned : pandas.Dataframe
+        The cleaned data frames. transcript_cleaned is sorted by `indexer.sort_transcript`,
+        and it is None if transcript is None.
+    """
+    print('Clean up data about portfolio (offer)...')
+    portfolio_cleaned = clean_portfolio_df(portfolio, offer_id_map)
+    portfolio_cleaned = schema.enforce(portfolio_cleaned,
+                                       schema.PORTFOLIO_CLEANED)
+    schema.print_memory_report(portfolio_cleaned, 'portfolio_cleaned')
+
+    print('Clean up data about profile (customer)...')
+    profile_cleaned = clean_profile_df(profile, profile_id_map, discretize,
+                                       drop_missing_rows)
+    profile_cleaned = schema.enforce(profile_cleaned, schema.PROFILE_CLEANED)
+    schema.print_memory_report(profile_cleaned, 'profile_cleaned')
+
+    transcript_cleaned = None
+    if transcript is not None:
+        print('Clean up data about transcript (event record)...')
+        transcript_cleaned = clean_transcript_df(transcript, offer_id_map,
+                                                 profile_id_map)
+        transcript_cleaned = schema.enforce(transcript_cleaned,
+                                            schema.TRANSCRIPT_CLEANED)
+        print('Sort the transcript by customer, offer and time...')
+        transcript_cleaned = idx.sort_transcript(transcript_cleaned)
+        schema.print_memory_report(transcript_cleaned, 'transcript_cleaned')
+
+    return (portfolio_cleaned, profile_cleaned, transcript_cleaned)
+
+
 def check(output_dir):
     """Checks the validity for the pickle files.
     """
@@ -286,9 +469,12 @@ def check(output_dir):
 
     print('Check the output file located at {}...'.format(
         transcript_cleaned_path))
-    transcript_cleaned = sto.load(transcript_cleaned_path)
-    print('transcript_cleaned.shape: {}'.format(transcript_cleaned.shape))
-    assert transcript_cleaned.shape == (
+    num_rows = 0
+    for transcript_cleaned in sto.load_chunks(transcript_cleaned_path):
+        num_rows += transcript_cleaned.shape[0]
+    transcript_cleaned_shape = (num_rows, transcript_cleaned.shape[1])
+    print('transcript_cleaned.shape: {}'.format(transcript_cleaned_shape))
+    assert transcript_cleaned_shape == (
         306534, 7), "The shape of cleaned transcript is incorrect!"
 
     print('OK\n')
@@ -308,6 +494,37 @@ def get_output_file_paths(output_dir):
             transcript_cleaned_path)
 
 
+def get_offsets_file_path(output_dir):
+    """Returns the full path of the file storing the group offsets of the transcript.
+    """
+    return os.path.join(output_dir, constant.NPY_TRANSCRIPT_OFFSETS)
+
+
+def get_id_map_file_paths(output_dir):
+    """Returns the full path of the files storing the maps for ID.
+    """
+    offer_id_map_path = os.path.join(output_dir, constant.TXT_OFFER_ID_MAP)
+    profile_id_map_path = os.path.join(output_dir, constant.TXT_PROFILE_ID_MAP)
+
+    return (offer_id_map_path, profile_id_map_path)
+
+
 if __name__ == '__main__':
-    main(constant.DATA_DIR, constant.PROCESSED_DATA_DIR)
+    parser = argparse.ArgumentParser(description='Clean up the original data.')
+    parser.add_argument(
+        '--chunksize',
+        type=int,
+        default=None,
+        help='stream the transcript in chunks of this many lines')
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='always clean up the data instead of using the stage cache')
+    args = parser.parse_args()
+
+    main(
+        constant.DATA_DIR,
+        constant.PROCESSED_DATA_DIR,
+        args.chunksize,
+        cache_dir=None if args.no_cache else constant.STAGE_CACHE_DIR)
     check(constant.PROCESSED_DATA_DIR)
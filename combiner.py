@@ -1,31 +1,119 @@
 import pandas as pd
-from collections import defaultdict
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 import generator as gen
+import indexer as idx
 import separater as sprt
 
 import os
+import argparse
+import tempfile
 import constant
+import cacher as cch
 import time
 import storer as sto
+import schema
 
 
 class AmountStorer:
     """AmountStorer is used to store the amounts that
     the customers spend at certain times.
+
+    The amounts are kept in two compact arrays: the sorted 64-bit keys packed
+    from (profile_id, time) and the total amount for each key. Lookups use
+    binary search and are also available in bulk. Single writes go to a small
+    dictionary that is merged into the arrays before the next bulk operation.
     """
 
     def __init__(self):
-        self.map = defaultdict(float)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.amounts = np.empty(0, dtype=np.float64)
+        self.overlay = {}
+
+    @classmethod
+    def from_transactions(cls, profile_ids, times, amounts):
+        """Creates an AmountStorer containing the given transactions.
+        """
+        amountStorer = cls()
+        amountStorer.set_amounts(profile_ids, times, amounts)
+        return amountStorer
 
     def gen_key(self, profile_id, time):
-        return str(profile_id) + "-" + str(time)
+        """Packs profile ID and time (both non-negative and less than 2**32)
+        into a 64-bit integer key that keeps the order of (profile_id, time).
+        It accepts either scalars or arrays.
+        """
+        return (np.asarray(profile_id, dtype=np.int64) << 32) | np.asarray(
+            time, dtype=np.int64)
 
     def set_amount(self, profile_id, time, amount):
-        self.map[self.gen_key(profile_id, time)] += amount
+        key = int(self.gen_key(profile_id, time))
+        if key not in self.overlay:
+            self.overlay[key] = self.lookup(np.array([key]))[0]
+        self.overlay[key] += amount
 
     def get_amount(self, profile_id, time):
-        return self.map[self.gen_key(profile_id, time)]
+        key = int(self.gen_key(profile_id, time))
+        if key in self.overlay:
+            return self.overlay[key]
+        return self.lookup(np.array([key]))[0]
+
+    def set_amounts(self, profile_ids, times, amounts):
+        """Adds the amounts of many transactions at once.
+        The amounts of the same key are added up in the given order.
+        """
+        self.merge_overlay()
+        self.merge(
+            self.gen_key(profile_ids, times),
+            np.asarray(amounts, dtype=np.float64))
+
+    def get_amounts(self, profile_ids, times):
+        """Returns the total amounts spent by the customers at the given times.
+        The amount is 0.0 if there is no transaction at that time.
+        """
+        self.merge_overlay()
+        return self.lookup(self.gen_key(profile_ids, times))
+
+    def lookup(self, query_keys):
+        amounts = np.zeros(len(query_keys), dtype=np.float64)
+        if len(self.keys) == 0:
+            return amounts
+
+        positions = np.searchsorted(self.keys, query_keys)
+        positions[positions == len(self.keys)] = len(self.keys) - 1
+        found = self.keys[positions] == query_keys
+        amounts[found] = self.amounts[positions[found]]
+
+        return amounts
+
+    def merge(self, keys, amounts):
+        keys = np.concatenate([self.keys, keys])
+        amounts = np.concatenate([self.amounts, amounts])
+
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        key_starts = np.ones(len(keys), dtype=bool)
+        key_starts[1:] = keys[1:] != keys[:-1]
+
+        # np.bincount adds the amounts one by one in the given order
+        self.keys = keys[key_starts]
+        self.amounts = np.bincount(
+            np.cumsum(key_starts) - 1,
+            weights=amounts[order],
+            minlength=len(self.keys))
+
+    def merge_overlay(self):
+        if not self.overlay:
+            return
+
+        keys = np.fromiter(self.overlay.keys(), dtype=np.int64)
+        amounts = np.fromiter(self.overlay.values(), dtype=np.float64)
+        self.overlay = {}
+
+        # the overlay holds the totals, so they replace the stored amounts
+        self.amounts[np.isin(self.keys, keys)] = 0.0
+        self.merge(keys, amounts)
 
 
 def check_validity(profile_id, group, expected_event_set, amountStorer):
@@ -62,7 +150,14 @@ def check_validity(profile_id, group, expected_event_set, amountStorer):
 
 def create_response(transcript_cleaned):
     """Creates a data frame about response based on the cleaned transcript.
-    
+
+    The transcript is sorted only once by 'profile_id', 'offer_id' and 'time'
+    (simultaneous events keep their original order), or not at all if it is
+    already sorted like the output of cleaner.py, and then the validity rule
+    of `check_validity` is applied to all groups at once with array operations:
+    every 'offer completed' event closes a segment of the group, and a completion
+    is valid when its segment also contains 'offer received' and 'offer viewed'.
+
     Parameters
     ----------
     transcript_cleaned : pandas.Dataframe
@@ -73,46 +168,299 @@ def create_response(transcript_cleaned):
     response : pandas.Dataframe
         The data frame containing response data.
     """
-    transcript_grouped = transcript_cleaned.groupby(['profile_id', 'offer_id'])
-    expected_event_set = {'offer received', 'offer viewed', 'offer completed'}
-    responses = []
+    profile_ids = transcript_cleaned['profile_id'].values
+    offer_ids = transcript_cleaned['offer_id'].values
+    times = transcript_cleaned['time'].values
+
+    events = transcript_cleaned['event'].values
+    amounts = transcript_cleaned['event_amount'].values
+    rewards = transcript_cleaned['event_reward'].values
+
+    if not idx.is_sorted(profile_ids, offer_ids, times):
+        # the stable sort keeps the original order of simultaneous events
+        order = np.lexsort((times, offer_ids, profile_ids))
+
+        profile_ids = profile_ids[order]
+        offer_ids = offer_ids[order]
+        times = times[order]
+        events = events[order]
+        amounts = amounts[order]
+        rewards = rewards[order]
+
+    # 'offer_id' == 0 means 'event_type' == transaction
+    is_transaction = offer_ids == 0
+    amountStorer = AmountStorer.from_transactions(
+        profile_ids[is_transaction], times[is_transaction],
+        amounts[is_transaction])
+
+    is_offer = ~is_transaction
+    profile_ids = profile_ids[is_offer]
+    offer_ids = offer_ids[is_offer]
+    times = times[is_offer]
+    events = events[is_offer]
+    rewards = rewards[is_offer]
+
+    # mark the first row of each (profile_id, offer_id) group
+    group_starts = np.ones(len(offer_ids), dtype=bool)
+    group_starts[1:] = (profile_ids[1:] != profile_ids[:-1]) | (
+        offer_ids[1:] != offer_ids[:-1])
+    group_ids = np.cumsum(group_starts) - 1
+    num_groups = group_ids[-1] + 1 if len(group_ids) > 0 else 0
+
+    # The validation criterion for a valid response is to
+    # receive, view, and complete an offer.
+    is_received = events == 'offer received'
+    is_viewed = events == 'offer viewed'
+    is_completed = events == 'offer completed'
+
+    # a new segment starts at each group and after each 'offer completed'
+    segment_starts = group_starts.copy()
+    segment_starts[1:] |= is_completed[:-1]
+    segment_ids = np.cumsum(segment_starts) - 1
+    segment_offsets = np.flatnonzero(segment_starts)
+
+    valid = is_completed
+    if len(segment_offsets) > 0:
+        valid = valid & np.logical_or.reduceat(
+            is_received, segment_offsets)[segment_ids]
+        valid = valid & np.logical_or.reduceat(is_viewed,
+                                               segment_offsets)[segment_ids]
+
+    valid_group_ids = group_ids[valid]
+    valid_amounts = amountStorer.get_amounts(profile_ids[valid], times[valid])
+
+    counts = np.bincount(valid_group_ids, minlength=num_groups)
+    resp_amounts = np.bincount(
+        valid_group_ids, weights=valid_amounts, minlength=num_groups)
+    resp_rewards = np.bincount(
+        valid_group_ids, weights=rewards[valid], minlength=num_groups)
+    if np.issubdtype(rewards.dtype, np.integer):
+        resp_rewards = resp_rewards.astype(np.int64)
+
+    group_offsets = np.flatnonzero(group_starts)
+
+    response = pd.DataFrame({
+        'response': (counts > 0).astype(np.int64),
+        'profile_id': profile_ids[group_offsets].astype(np.int64),
+        'offer_id': offer_ids[group_offsets].astype(np.int64),
+        'resp_number': counts.astype(np.int64),
+        'resp_amount': resp_amounts,
+        'resp_reward': resp_rewards
+    })
+
+    response = response[[
+        'response', 'profile_id', 'offer_id', 'resp_number', 'resp_amount',
+        'resp_reward'
+    ]]
 
-    amountStorer = AmountStorer()
+    return response
+
+
+RESPONSE_INPUT_COLUMNS = [
+    'event', 'event_amount', 'event_reward', 'time', 'profile_id', 'offer_id'
+]
+
+
+def create_response_shard(shard):
+    """Creates the response for one shard of the transcript.
+    The shard is a dictionary that maps column names to arrays.
+    """
+    return create_response(pd.DataFrame(shard))
+
+
+def create_response_parallel(transcript_cleaned, workers):
+    """Creates a data frame about response with several worker processes.
+
+    The transcript is hash-partitioned by 'profile_id', because the response of
+    a customer depends only on the events of that customer. Each worker only
+    receives the columns of its own shard, and the results are put back into
+    the order of `create_response`, so the output is identical to it.
+
+    Parameters
+    ----------
+    transcript_cleaned : pandas.Dataframe
+        The data frame containing the cleaned transcript data.
+
+    workers : int
+        The number of worker processes.
+
+    Returns
+    -------
+    response : pandas.Dataframe
+        The data frame containing response data.
+    """
+    if workers <= 1:
+        return create_response(transcript_cleaned)
+
+    shard_ids = transcript_cleaned['profile_id'].values % workers
+    shards = []
+    for shard_id in range(workers):
+        mask = shard_ids == shard_id
+        shards.append({
+            name: transcript_cleaned[name].values[mask]
+            for name in RESPONSE_INPUT_COLUMNS
+        })
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shard_responses = list(executor.map(create_response_shard, shards))
+
+    response = pd.concat(shard_responses, ignore_index=True)
+    order = np.lexsort((response['offer_id'].values,
+                        response['profile_id'].values))
+    response = response.iloc[order].reset_index(drop=True)
 
-    for name, group in transcript_grouped:
-        profile_id, offer_id = name
+    return response
 
-        if offer_id == 0:  # 'event_type' == transaction
-            # store the amount of each transaction for each customer
-            for _, row in group.iterrows():
-                amountStorer.set_amount(profile_id, row['time'],
-                                        row['event_amount'])
 
-            continue
+def create_window_spend(transcript_cleaned, portfolio_cleaned):
+    """Attributes the transactions of each customer to the offers the customer received.
 
-        # The validation criterion for a valid response is to
-        # receive, view, and complete an offer.
+    Every 'offer received' event opens a validity window from the time it is
+    received to the end of the duration of the offer (the duration is in days and
+    the time in hours), both included. All transactions of the customer within the
+    window are attributed to the offer, so a transaction may be attributed to
+    several offers whose windows overlap. Instead of comparing every receipt with
+    every transaction, the transactions are sorted once by their keys packed from
+    (profile_id, time), and the window bounds are found by binary search.
+    The amounts within each window are summed directly by `numpy.add.reduceat`,
+    so a window sum only depends on the transactions of its customer, and it
+    is the same however the transcript is partitioned.
 
-        count, amount, reward = check_validity(
-            profile_id, group, expected_event_set, amountStorer)
+    Parameters
+    ----------
+    transcript_cleaned : pandas.Dataframe
+        The data frame containing the cleaned transcript data.
 
-        if count > 0:
-            responses.append([1, profile_id, offer_id, count, amount, reward])
-        else:
-            responses.append([0, profile_id, offer_id, 0, 0.0, 0])
+    portfolio_cleaned : pandas.Dataframe
+        The data frame containing the cleaned offer data.
 
-    response = pd.DataFrame(
-        data=responses,
-        columns=[
-            'response', 'profile_id', 'offer_id', 'resp_number', 'resp_amount',
-            'resp_reward'
-        ])
+    Returns
+    -------
+    window_spend : pandas.Dataframe
+        The data frame containing the amount spent within the windows of every
+        (profile_id, offer_id) group with received offers, sorted by both IDs.
+    """
+    amountStorer = AmountStorer()
+    profile_ids = transcript_cleaned['profile_id'].values.astype(np.int64)
+    offer_ids = transcript_cleaned['offer_id'].values.astype(np.int64)
+    times = transcript_cleaned['time'].values.astype(np.int64)
+
+    # the amounts of the transactions sorted by (profile_id, time)
+    is_transaction = offer_ids == 0
+    keys = amountStorer.gen_key(profile_ids[is_transaction],
+                                times[is_transaction])
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    # a trailing zero makes the end of the last window a valid index
+    amounts = np.append(
+        transcript_cleaned['event_amount'].values[is_transaction][order].astype(
+            np.float64), 0.0)
+
+    # the durations of the offers indexed by offer ID
+    durations = np.zeros(
+        max(portfolio_cleaned['offer_id'].max(), offer_ids.max()) + 1,
+        dtype=np.int64)
+    durations[portfolio_cleaned['offer_id'].values] = portfolio_cleaned[
+        'duration'].values
+
+    is_received = (transcript_cleaned['event'].values == 'offer received') & (
+        ~is_transaction)
+    profile_ids = profile_ids[is_received]
+    offer_ids = offer_ids[is_received]
+    times = times[is_received]
+
+    starts = np.searchsorted(keys, amountStorer.gen_key(profile_ids, times),
+                             'left')
+    ends = np.searchsorted(
+        keys,
+        amountStorer.gen_key(profile_ids, times + durations[offer_ids] * 24),
+        'right')
+
+    # reduceat sums amounts[starts[i]:ends[i]] at the even positions of the
+    # interleaved bounds, but returns amounts[starts[i]] for an empty window
+    window_amounts = np.zeros(len(starts), dtype=np.float64)
+    if len(starts) > 0:
+        bounds = np.empty(2 * len(starts), dtype=np.intp)
+        bounds[0::2] = starts
+        bounds[1::2] = ends
+        window_amounts = np.where(ends > starts,
+                                  np.add.reduceat(amounts, bounds)[0::2], 0.0)
+
+    window_spend = pd.DataFrame({
+        'profile_id': profile_ids,
+        'offer_id': offer_ids,
+        'window_amount': window_amounts
+    })
+    window_spend = window_spend.groupby(
+        ['profile_id', 'offer_id'], sort=True).sum().reset_index()
+
+    return window_spend
+
+
+def add_window_spend(response, window_spend):
+    """Adds the amount spent within the windows of the received offers to the response.
+    """
+    response = pd.merge(
+        response,
+        window_spend,
+        on=['profile_id', 'offer_id'],
+        how='left',
+        validate='one_to_one')
+    response['window_amount'] = response['window_amount'].fillna(0.0)
 
     return response
 
 
-def merge_response(response, portfolio_cleaned, profile_cleaned):
+def get_positions(table_ids, ids):
+    """Returns the rows of a table for the IDs by direct indexing,
+    if the IDs of the table are unique and dense.
+
+    Parameters
+    ----------
+    table_ids : numpy.ndarray
+        The integer IDs of the rows of the table.
+
+    ids : numpy.ndarray
+        The integer IDs to be looked up.
+
+    Returns
+    -------
+    positions : numpy.ndarray
+        The row of each ID, or None if the IDs of the table are not unique
+        or cover less than half of their range, or if an ID is not in the table.
+    """
+    if len(table_ids) == 0 or len(ids) == 0:
+        return None
+
+    table_ids = table_ids.astype(np.int64)
+    min_id = table_ids.min()
+    num_slots = table_ids.max() - min_id + 1
+    if num_slots > 2 * len(table_ids):
+        return None
+
+    slots = np.full(num_slots, -1, dtype=np.int64)
+    slots[table_ids - min_id] = np.arange(len(table_ids))
+    # a duplicated ID overwrites the slot of another row
+    if (slots >= 0).sum() != len(table_ids):
+        return None
+
+    ids = ids.astype(np.int64) - min_id
+    if ids.min() < 0 or ids.max() >= num_slots:
+        return None
+    positions = slots[ids]
+    if (positions < 0).any():
+        return None
+
+    return positions
+
+
+def merge_response(response, portfolio_cleaned, profile_cleaned=None):
     """Merge the response data frame with cleaned portfolio and cleaned profile.
+
+    The integer offer and profile IDs are dense, so the columns of portfolio and
+    profile are taken by the positions of the IDs directly, and their types are kept.
+    If the IDs are not dense or not all found, the data frames are joined by hash
+    merges instead.
     
     Parameters
     ----------
@@ -124,37 +472,76 @@ def merge_response(response, portfolio_cleaned, profile_cleaned):
 
     profile_cleaned : pandas.Dataframe
         The data frame containing the cleaned profile data.
+        If it is None, only the cleaned portfolio is merged.
 
     Returns
     -------
     response_merged : pandas.Dataframe
         The data frame containing merged response data.
     """
-    response_merged = pd.merge(
-        response,
-        portfolio_cleaned,
-        on='offer_id',
-        how='left',
-        validate='many_to_one')
+    tables = [(portfolio_cleaned, 'offer_id')]
+    if profile_cleaned is not None:
+        tables.append((profile_cleaned, 'profile_id'))
+    positions = [
+        get_positions(df[key].values, response[key].values)
+        for df, key in tables
+    ]
 
-    response_merged = pd.merge(
-        response_merged,
-        profile_cleaned,
-        on='profile_id',
-        how='left',
-        validate='many_to_one')
+    if all(table_positions is not None for table_positions in positions):
+        columns = {col: response[col].values for col in response.columns}
+        for (df, key), table_positions in zip(tables, positions):
+            for col in df.columns:
+                if col != key:
+                    columns[col] = df[col].values.take(table_positions)
+
+        return pd.DataFrame(columns, columns=list(columns))
 
-    # make sure some column types are correct
-    response_merged[['reg_year']] = response_merged[['reg_year']].astype(int)
-    response_merged[['reg_month']] = response_merged[['reg_month']].astype(int)
+    response_merged = response
+    for df, key in tables:
+        response_merged = pd.merge(
+            response_merged, df, on=key, how='left', validate='many_to_one')
+
+    if profile_cleaned is not None:
+        # make sure some column types are correct
+        for col in ['reg_year', 'reg_month']:
+            response_merged[col] = response_merged[col].astype(
+                profile_cleaned[col].dtype)
 
     return response_merged
 
 
-def aggregate_merged_response(response_merged, profile_cleaned):
+# The aggregation of each feature for every (profile_id, offer_type).
+RESPONSE_AGG_FEATURES = [
+    ('response', 'sum', 'response_sum'),
+    # For the following features, I think we need to use their average.
+    ('resp_number', 'mean', 'resp_number_mean'),
+    ('resp_amount', 'mean', 'resp_amount_mean'),
+    ('resp_reward', 'mean', 'resp_reward_mean'),
+    # For the following features, the average is better than the others.
+    ('difficulty', 'mean', 'difficulty_mean'),
+    ('duration', 'mean', 'duration_mean'),
+    ('reward', 'mean', 'reward_mean'),
+]
+
+# The aggregations of the amount spent within the windows of the received offers,
+# which are added by `combine` with `window_spend`.
+RESPONSE_AGG_WINDOW_FEATURES = [
+    ('window_amount', 'sum', 'window_amount_sum'),
+    ('window_amount', 'mean', 'window_amount_mean'),
+]
+
+RESPONSE_AGG_OFFER_TYPES = ['bogo', 'discount']
+
+
+def aggregate_merged_response(response_merged, profile_cleaned=None):
     """Aggregates the merged response.
     Create a data frame centered only on profile_id.
 
+    All features are aggregated in a single groupby pass, and then the rows of
+    each offer type are unstacked into the '_bogo' and '_discount' columns.
+    The features of the in-window spend are included if the merged response
+    has the 'window_amount' column.
+
     Parameters
     ----------
     response_merged : pandas.Dataframe
@@ -162,100 +549,85 @@ def aggregate_merged_response(response_merged, profile_cleaned):
 
     profile_cleaned : pandas.Dataframe
         The data frame containing the cleaned profile data.
+        If it is None, only the aggregated features are returned.
 
     Returns
     -------
     response_agg : pandas.Dataframe
         The data frame containing aggregated response data.
     """
-    response_groups = response_merged[
-        response_merged['offer_type'] != 'informational'].groupby(
-            by=['profile_id', 'offer_type'])
+    response_merged = response_merged[response_merged['offer_type'].isin(
+        RESPONSE_AGG_OFFER_TYPES)]
 
-    response_agg = response_groups[['response']].sum().reset_index()
+    features = RESPONSE_AGG_FEATURES
+    if 'window_amount' in response_merged.columns:
+        features = features + RESPONSE_AGG_WINDOW_FEATURES
 
-    # For the following features, I think we need to use their average.
-    response_agg = response_agg.merge(
-        response_groups[['resp_number']].mean().reset_index(),
-        on=['profile_id', 'offer_type'])
+    aggregations = {}
+    for col, func, _ in features:
+        aggregations.setdefault(col, []).append(func)
+    response_agg = response_merged.groupby(
+        by=['profile_id', 'offer_type'], observed=True).agg(aggregations)
 
-    response_agg = response_agg.merge(
-        response_groups[['resp_amount']].mean().reset_index(),
-        on=['profile_id', 'offer_type'])
-
-    response_agg = response_agg.merge(
-        response_groups[['resp_reward']].mean().reset_index(),
-        on=['profile_id', 'offer_type'])
-
-    # For the following features, the average is better than the others.
-    response_agg = response_agg.merge(
-        response_groups[['difficulty']].mean().reset_index(),
-        on=['profile_id', 'offer_type'])
-
-    response_agg = response_agg.merge(
-        response_groups[['duration']].mean().reset_index(),
-        on=['profile_id', 'offer_type'])
-
-    response_agg = response_agg.merge(
-        response_groups[['reward']].mean().reset_index(),
-        on=['profile_id', 'offer_type'])
+    # Combine the responses of each customer to the two types of offer.
+    response_agg = response_agg.unstack('offer_type')
 
+    wide_columns = [(col, func, offer_type)
+                    for offer_type in RESPONSE_AGG_OFFER_TYPES
+                    for col, func, _ in features]
+    response_agg = response_agg.reindex(columns=wide_columns)
     response_agg.columns = [
-        'profile_id', 'offer_type', 'response_sum', 'resp_number_mean',
-        'resp_amount_mean', 'resp_reward_mean', 'difficulty_mean',
-        'duration_mean', 'reward_mean'
+        new_col + '_' + offer_type
+        for offer_type in RESPONSE_AGG_OFFER_TYPES
+        for _, _, new_col in features
     ]
 
-    # Combine the responses of each customer to the two types of offer.
-    response_agg_bogo = response_agg[response_agg['offer_type'] ==
-                                     'bogo'].drop(
-                                         'offer_type', axis=1)
-
-    response_agg_discount = response_agg[response_agg['offer_type'] ==
-                                         'discount'].drop(
-                                             'offer_type', axis=1)
-
-    response_agg = response_agg_bogo.merge(
-        response_agg_discount,
-        on='profile_id',
-        how='outer',
-        suffixes=['_bogo', '_discount'],
-        validate='one_to_one')
+    # Keep the row order of an outer join of the bogo part with the discount
+    # part: customers who received bogo offers come first.
+    has_first_type = response_agg[response_agg.columns[0]].notnull().values
+    order = np.argsort(~has_first_type, kind='mergesort')
+    response_agg = response_agg.iloc[order]
+
+    # Fill null values.
+    response_agg = response_agg.fillna(0.0).reset_index()
+    if profile_cleaned is None:
+        return response_agg
 
     # Merge the data in the profile as well.
     response_agg = response_agg.merge(
         profile_cleaned, on='profile_id', how='left', validate='one_to_one')
 
-    # Fill null values.
-    response_agg = response_agg.fillna(0.0)
-
     return response_agg
 
 
-def main(input_dir, output_dir):
-    """The main function.
+def combine(portfolio_cleaned,
+            profile_cleaned,
+            transcript_cleaned,
+            workers=1,
+            window_spend=False):
+    """Combines the cleaned data in memory into the aggregated response,
+    which is converted to its declared schema.
+    If `window_spend` is True, the features of the amount spent within
+    the windows of the received offers are added, see `create_window_spend`.
     """
-    print('Combine the cleaned data...')
-    portfolio_cleaned_path = os.path.join(input_dir,
-                                          constant.PICKLE_PORTFOLIO_CLEANED)
-    profile_cleaned_path = os.path.join(input_dir,
-                                        constant.PICKLE_PROFILE_CLEANED)
-    transcript_cleaned_path = os.path.join(input_dir,
-                                           constant.PICKLE_TRANSCRIPT_CLEANED)
-    print('Load cleaned data...')
-    portfolio_cleaned = sto.load(portfolio_cleaned_path)
-    profile_cleaned = sto.load(profile_cleaned_path)
-    transcript_cleaned = sto.load(transcript_cleaned_path)
-
     print(
-        'Create the data frame about the response based on cleaned transcript... (waiting for a minute)'
+        'Create the data frame about the response based on cleaned transcript...'
     )
     start_time = time.time()
-    response = create_response(transcript_cleaned)
+    response = create_response_parallel(transcript_cleaned, workers)
     end_time = time.time()
     print('The time spent creating the data frame: {}s'.\
       format(end_time - start_time))
 
+    if window_spend:
+        print('Attribute the transactions to the windows of received offers...')
+        start_time = time.time()
+        response = add_window_spend(
+            response,
+            create_window_spend(transcript_cleaned, portfolio_cleaned))
+        print('The time spent attributing the transactions: {}s'.format(
+            time.time() - start_time))
+
     print('Merge the response data with cleaned portfolio and profile...')
     response_merged = merge_response(response, portfolio_cleaned,
                                      profile_cleaned)
@@ -266,6 +638,271 @@ def main(input_dir, output_dir):
 
     print('Aggregates the merged response...')
     response_agg = aggregate_merged_response(response_merged, profile_cleaned)
+    response_agg = schema.enforce(response_agg, schema.RESPONSE_AGG)
+    schema.print_memory_report(response_agg, 'response_agg')
+
+    return response_agg
+
+
+# The size of an event with the columns in RESPONSE_INPUT_COLUMNS in bytes.
+EVENT_BYTES = 20
+# The peak memory of combining a partition, including its events,
+# in multiples of the size of its events (about 5.3 was measured).
+PARTITION_MEMORY_FACTOR = 6
+# The peak memory of spilling a chunk in multiples of the size of its events.
+SPILL_MEMORY_FACTOR = 4
+
+
+def parse_size(size):
+    """Parses a size in bytes with an optional unit, e.g. '512M' or '16G'.
+    """
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+
+def get_num_partitions(num_events, memory_budget):
+    """Returns the number of partitions needed to combine the events within the budget.
+    """
+    return max(
+        1,
+        int(
+            np.ceil(num_events * EVENT_BYTES * PARTITION_MEMORY_FACTOR /
+                    memory_budget)))
+
+
+def spill_partitions(transcript_cleaned_path, spill_dir, num_partitions,
+                     max_profile_id, chunksize):
+    """Splits the cleaned transcript into partitions on disk, one chunk at a time.
+
+    The integer profile IDs are dense, so the partitions are ranges of consecutive
+    profile IDs of about the same size. All events of a customer are in the same
+    partition, and the events of a partition keep their original order.
+    The partitions are stored by the columnar backend.
+
+    Returns
+    -------
+    partition_paths : list
+        The paths of the partitions, in the order of their profile IDs.
+    """
+    partition_paths = [
+        os.path.join(spill_dir, 'part-{:05d}'.format(i))
+        for i in range(num_partitions)
+    ]
+
+    for chunk in sto.load_chunks(
+            transcript_cleaned_path, chunksize,
+            columns=RESPONSE_INPUT_COLUMNS):
+        partition_ids = np.clip(
+            (chunk['profile_id'].values.astype(np.int64) - 1) *
+            num_partitions // max_profile_id, 0, num_partitions - 1)
+        order = np.argsort(partition_ids, kind='mergesort')
+        bounds = np.searchsorted(partition_ids[order],
+                                 np.arange(num_partitions + 1))
+        chunk = chunk.iloc[order]
+
+        for i in range(num_partitions):
+            if bounds[i] < bounds[i + 1]:
+                sto.store_columnar(
+                    chunk.iloc[bounds[i]:bounds[i + 1]],
+                    partition_paths[i],
+                    append=True)
+
+    return partition_paths
+
+
+def combine_partition(portfolio_cleaned,
+                      profile_cleaned,
+                      transcript_cleaned,
+                      window_spend=False):
+    """Combines the events of some customers into their rows of the aggregated response.
+
+    Returns
+    -------
+    response_agg : pandas.Dataframe
+        The rows of the aggregated response, converted to its declared schema.
+
+    has_bogo : numpy.ndarray
+        Whether each customer has received a bogo offer. These customers come
+        first in the aggregated response.
+    """
+    response = create_response(transcript_cleaned)
+    if window_spend:
+        response = add_window_spend(
+            response, create_window_spend(transcript_cleaned,
+                                          portfolio_cleaned))
+
+    response_merged = merge_response(response, portfolio_cleaned,
+                                     profile_cleaned)
+    response_merged = response_merged[
+        response_merged['offer_type'] != 'informational']
+
+    response_agg = aggregate_merged_response(response_merged, profile_cleaned)
+    response_agg = schema.enforce(response_agg, schema.RESPONSE_AGG)
+    has_bogo = response_agg['profile_id'].isin(response_merged['profile_id'][
+        response_merged['offer_type'] == 'bogo']).values
+
+    return (response_agg, has_bogo)
+
+
+def combine_out_of_core(portfolio_cleaned,
+                        profile_cleaned,
+                        transcript_cleaned_path,
+                        response_agg_path,
+                        memory_budget,
+                        window_spend=False):
+    """Combines a cleaned transcript that does not fit into memory.
+
+    The transcript is spilled to partitions of customers on disk, and the
+    partitions are combined one at a time. The rows of each partition are
+    streamed to the aggregated response, which is stored by the columnar backend.
+    The customers with bogo offers are written first, and the others are
+    spilled and appended at the end, so the rows are in the same order
+    as the output of `combine`.
+
+    Parameters
+    ----------
+    portfolio_cleaned : pandas.Dataframe
+        The data frame containing the cleaned offer data.
+
+    profile_cleaned : pandas.Dataframe
+        The data frame containing the cleaned profile data, which is kept in memory.
+
+    transcript_cleaned_path : str
+        The path of the cleaned transcript, stored by the columnar backend or in chunks.
+
+    response_agg_path : str
+        The path of the aggregated response.
+
+    memory_budget : int
+        The memory for the events of a partition and their processing in bytes.
+
+    window_spend : bool
+        Whether to add the features of the in-window spend, as in `combine`.
+
+    Returns
+    -------
+    num_customers : int
+        The number of rows of the aggregated response.
+    """
+    num_events = sto.count_rows(transcript_cleaned_path)
+    num_partitions = get_num_partitions(num_events, memory_budget)
+    chunksize = max(1, memory_budget // (EVENT_BYTES * SPILL_MEMORY_FACTOR))
+
+    profile_cleaned = profile_cleaned.iloc[np.argsort(
+        profile_cleaned['profile_id'].values, kind='mergesort')]
+    profile_ids = profile_cleaned['profile_id'].values
+    max_profile_id = max(int(profile_ids[-1]), 1) if len(profile_ids) else 1
+
+    output_dir = os.path.dirname(os.path.abspath(response_agg_path))
+    spill_dir = tempfile.mkdtemp(prefix='combiner-', dir=output_dir)
+    try:
+        print('Spill {} events to {} partitions in {}...'.format(
+            num_events, num_partitions, spill_dir))
+        partition_paths = spill_partitions(transcript_cleaned_path, spill_dir,
+                                           num_partitions, max_profile_id,
+                                           chunksize)
+
+        sto.remove(response_agg_path)
+        rest_path = os.path.join(spill_dir, 'rest')
+        num_customers = 0
+        for i, partition_path in enumerate(partition_paths):
+            if not os.path.exists(partition_path):
+                continue
+
+            transcript_partition = sto.load(partition_path)
+            # the customers of the partition are a range of profile IDs
+            start, stop = np.searchsorted(profile_ids, [
+                transcript_partition['profile_id'].min(),
+                transcript_partition['profile_id'].max() + 1
+            ])
+            response_agg, has_bogo = combine_partition(
+                portfolio_cleaned, profile_cleaned.iloc[start:stop],
+                transcript_partition, window_spend)
+            del transcript_partition
+            sto.remove(partition_path)
+
+            if has_bogo.any():
+                sto.store_columnar(
+                    response_agg[has_bogo], response_agg_path, append=True)
+            if not has_bogo.all():
+                sto.store_columnar(
+                    response_agg[~has_bogo], rest_path, append=True)
+            num_customers += response_agg.shape[0]
+            print('Partition {}/{}: {} customers'.format(
+                i + 1, num_partitions, response_agg.shape[0]))
+
+        if os.path.exists(rest_path):
+            for chunk in sto.load_chunks(rest_path, chunksize):
+                chunk = schema.enforce(chunk, schema.RESPONSE_AGG)
+                sto.store_columnar(chunk, response_agg_path, append=True)
+    finally:
+        sto.remove(spill_dir)
+
+    return num_customers
+
+
+def main(input_dir,
+         output_dir,
+         workers=1,
+         cache_dir=None,
+         memory_budget=None,
+         window_spend=False):
+    """The main function.
+    If `cache_dir` is given, the output is restored from the stage cache
+    when the cleaned data has not changed. If `memory_budget` (in bytes) is given,
+    the transcript is combined out of core, see `combine_out_of_core`.
+    If `window_spend` is True, the features of the in-window spend are added.
+    """
+    print('Combine the cleaned data...')
+    portfolio_cleaned_path = os.path.join(input_dir,
+                                          constant.PICKLE_PORTFOLIO_CLEANED)
+    profile_cleaned_path = os.path.join(input_dir,
+                                        constant.PICKLE_PROFILE_CLEANED)
+    transcript_cleaned_path = os.path.join(input_dir,
+                                           constant.PICKLE_TRANSCRIPT_CLEANED)
+
+    if cache_dir is not None:
+        # The number of workers and the size of the memory budget do not change
+        # the output, but with a memory budget it is stored as a columnar directory.
+        cch.run_cached(
+            'combiner', lambda: main(input_dir, output_dir, workers, None,
+                                     memory_budget, window_spend), [
+                portfolio_cleaned_path, profile_cleaned_path,
+                transcript_cleaned_path
+            ], [get_output_file_path(output_dir)],
+            {
+                'window_spend': window_spend,
+                'out_of_core': memory_budget is not None
+            }, cache_dir)
+        return
+
+    print('Load cleaned data...')
+    portfolio_cleaned = sto.load(portfolio_cleaned_path)
+    profile_cleaned = sto.load(profile_cleaned_path)
+
+    if memory_budget is not None:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        start_time = time.time()
+        num_customers = combine_out_of_core(
+            portfolio_cleaned, profile_cleaned, transcript_cleaned_path,
+            get_output_file_path(output_dir), memory_budget, window_spend)
+        print('The time spent combining {} customers out of core: {}s'.format(
+            num_customers,
+            time.time() - start_time))
+        print('Done.\n')
+        return
+
+    transcript_cleaned = sto.load(
+        transcript_cleaned_path, columns=RESPONSE_INPUT_COLUMNS)
+
+    response_agg = combine(portfolio_cleaned, profile_cleaned,
+                           transcript_cleaned, workers, window_spend)
 
     print('Store data...')
     if not os.path.exists(output_dir):
@@ -287,8 +924,11 @@ def check(output_dir):
     print('Check the output file located at {}...'.format(response_agg_path))
     response_agg = sto.load(response_agg_path)
     print('response_agg.shape: {}'.format(response_agg.shape))
+    num_columns = 22
+    if 'window_amount_sum_bogo' in response_agg.columns:
+        num_columns += 2 * len(RESPONSE_AGG_WINDOW_FEATURES)
     assert response_agg.shape == (
-        16928, 22), "The shape of aggregated response is incorrect!"
+        16928, num_columns), "The shape of aggregated response is incorrect!"
 
     print('OK\n')
 
@@ -302,5 +942,29 @@ def get_output_file_path(output_dir):
 
 
 if __name__ == "__main__":
-    main(constant.PROCESSED_DATA_DIR, constant.PROCESSED_DATA_DIR)
+    parser = argparse.ArgumentParser(description='Combine the cleaned data.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='the number of worker processes used to create the response')
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='always combine the data instead of using the stage cache')
+    parser.add_argument(
+        '--memory-budget',
+        help='combine the transcript out of core in partitions that fit into '
+        'this much memory, e.g. 512M or 16G')
+    parser.add_argument(
+        '--window-spend',
+        action='store_true',
+        help='add the total and the mean amount spent within the validity '
+        'windows of the received offers')
+    args = parser.parse_args()
+
+    main(constant.PROCESSED_DATA_DIR, constant.PROCESSED_DATA_DIR,
+         args.workers, None if args.no_cache else constant.STAGE_CACHE_DIR,
+         None if args.memory_budget is None else parse_size(
+             args.memory_budget), args.window_spend)
     check(constant.PROCESSED_DATA_DIR)
\ No newline at end of file
@@ -31,16 +31,32 @@ import constant
 constant.DATA_DIR = 'data'  # store the original data file
 constant.PROCESSED_DATA_DIR = 'processed_data'  # store files containing processed data
 constant.MODEL_DIR = 'model'  # store the trained model files
+constant.STAGE_CACHE_DIR = 'stage_cache'  # store the cached outputs of the stages
 
 constant.JSON_PORTFOLIO = 'portfolio.json'
 constant.JSON_PROFILE = 'profile.json'
 constant.JSON_TRANSCRIPT = 'transcript.json'
 
+constant.TXT_OFFER_ID_MAP = 'offer_id_map.txt'
+constant.TXT_PROFILE_ID_MAP = 'profile_id_map.txt'
+
 constant.PICKLE_PORTFOLIO_CLEANED = 'portfolio_cleaned.pkl'
 constant.PICKLE_PROFILE_CLEANED = 'profile_cleaned.pkl'
 constant.PICKLE_TRANSCRIPT_CLEANED = 'transcript_cleaned.pkl'
+constant.NPY_TRANSCRIPT_OFFSETS = 'transcript_offsets.npy'  # the group offsets of the sorted transcript
 
 constant.PICKLE_RESPONSE_AGG = 'response_agg.pkl'
+constant.DIR_RESPONSE_STATE = 'response_state'  # the state of updater.py, a directory of .npy files
+
+constant.DIR_DISTANCE_CACHE = 'distance_cache'  # the cached distance matrices, in the processed data directory
 
 constant.PICKLE_CLUSTERING_MODEL = 'clustering_model.pkl'
 constant.PICKLE_RESPONSE_LABELED = 'response_labeled.pkl'
+constant.PICKLE_CLUSTER_ASSIGNER = 'cluster_assigner.pkl'
+constant.CSV_CLUSTER_SWEEP = 'cluster_sweep.csv'
+
+# The storage backend of each artifact, see storer.store. The default is 'joblib'.
+constant.STORAGE_BACKENDS = {
+    constant.PICKLE_TRANSCRIPT_CLEANED: 'columnar',
+    constant.NPY_TRANSCRIPT_OFFSETS: 'npy'
+}
@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+
+import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# The default limits of a distance cache. A matrix of 16,917 customers takes 1.1 GB.
+MAX_BYTES = 4 * 2**30
+MAX_AGE = 30 * 24 * 3600
+
+
+class DistanceCache:
+    """DistanceCache stores the condensed pairwise manhattan distance matrices
+    of data matrices in a directory, keyed by a content hash of the data.
+
+    A matrix is stored as a raw float64 file in the order of
+    scipy.spatial.distance.pdist, and it is memory-mapped when loaded,
+    so the repeated experiments on the same data skip the computation.
+    The distances are the same as those of pdist, so the linkage tree is also
+    the same; float32 distances changed the order of some merges.
+
+    A new matrix evicts the matrices unused for longer than `max_age` seconds,
+    and then the least recently used ones until the cache is within `max_bytes`,
+    as `cacher.evict` does for the stage cache.
+    """
+
+    def __init__(self,
+                 cache_dir,
+                 dtype=np.float64,
+                 max_bytes=MAX_BYTES,
+                 max_age=MAX_AGE):
+        self.cache_dir = cache_dir
+        self.dtype = np.dtype(dtype)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def gen_key(self, X):
+        """Generates the key of a data matrix from its content.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        digest = hashlib.sha1()
+        digest.update(str(X.shape).encode())
+        digest.update(self.dtype.str.encode())
+        digest.update(X.tobytes())
+        return digest.hexdigest()
+
+    def get_path(self, X):
+        return os.path.join(self.cache_dir, '{}-{}.dist'.format(
+            self.gen_key(X), X.shape[0]))
+
+    def get(self, X, block_bytes=64 * 2**20, n_jobs=None):
+        """Returns the condensed distance matrix of a data matrix as a read-only memory map.
+        It is computed and stored first if it is not in the cache.
+        """
+        path = self.get_path(X)
+        num_samples = X.shape[0]
+        size = num_samples * (num_samples - 1) // 2
+
+        if not os.path.exists(path):
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            if size > 0:
+                distances = np.memmap(
+                    tmp_path, dtype=self.dtype, mode='w+', shape=(size, ))
+                compute_condensed(X, distances, block_bytes, n_jobs)
+                distances.flush()
+                del distances
+            else:
+                open(tmp_path, 'wb').close()
+            os.replace(tmp_path, path)
+            self.evict(keep_path=path)
+        else:
+            # the age of a matrix is counted from its last use
+            os.utime(path)
+
+        if size == 0:
+            return np.empty(0, dtype=self.dtype)
+
+        return np.memmap(path, dtype=self.dtype, mode='r', shape=(size, ))
+
+    def __contains__(self, X):
+        return os.path.exists(self.get_path(X))
+
+    def evict(self, keep_path=None):
+        """Removes the matrices unused for longer than `max_age` seconds,
+        and then the least recently used matrices until the cache is within `max_bytes`.
+        The matrix at `keep_path` is never removed. Returns the number of removed matrices.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.dist') and path != keep_path:
+                entries.append((os.path.getmtime(path), os.path.getsize(path),
+                                path))
+        entries.sort()
+
+        total_bytes = sum(size for _, size, _ in entries)
+        if keep_path is not None:
+            total_bytes += os.path.getsize(keep_path)
+        now = time.time()
+        num_removed = 0
+        for used_time, size, path in entries:
+            if now - used_time <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            # a matrix memory-mapped by another process stays readable
+            os.remove(path)
+            total_bytes -= size
+            num_removed += 1
+
+        return num_removed
+
+
+def row_offsets(rows, num_samples):
+    """Returns the position of distance (i, i + 1) in the condensed matrix for each row i.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    return num_samples * rows - rows * (rows + 1) // 2
+
+
+def compute_condensed(X, distances, block_bytes=64 * 2**20, n_jobs=None):
+    """Computes the condensed manhattan distance matrix into an array.
+    The rows are computed in blocks by a thread pool.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    num_samples = X.shape[0]
+    block_rows = max(1, block_bytes // (8 * max(num_samples, 1)))
+
+    def compute_block(start):
+        stop = min(start + block_rows, num_samples)
+        block = cdist(X[start:stop], X[start:], metric='cityblock')
+        offsets = row_offsets(np.arange(start, stop), num_samples)
+        for i in range(stop - start):
+            distances[offsets[i]:offsets[i] + num_samples - start - i - 1] = \
+                block[i, i + 1:]
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        list(executor.map(compute_block, range(0, num_samples, block_rows)))
+
@@ -0,0 +1,262 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import cdist
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def sort_by_label(X, labels):
+    """Sorts the samples by label, so that each cluster is a contiguous block.
+
+    Returns
+    -------
+    X_sorted : numpy.ndarray
+        The sorted samples.
+
+    labels_sorted : numpy.ndarray
+        The sorted labels.
+
+    order : numpy.ndarray
+        The positions of the sorted samples in the original data.
+
+    offsets : numpy.ndarray
+        The position of the first sample of each cluster in the sorted data.
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='mergesort')
+    labels_sorted = labels[order]
+    starts = np.ones(len(labels_sorted), dtype=bool)
+    starts[1:] = labels_sorted[1:] != labels_sorted[:-1]
+
+    return (np.asarray(X)[order], labels_sorted, order, np.flatnonzero(starts))
+
+
+def block_silhouettes(X_sorted, cluster_ids, offsets, sizes, rows):
+    """Computes the silhouette values of the given rows of the sorted samples
+    from one block of pairwise manhattan distances.
+    """
+    distances = cdist(X_sorted[rows], X_sorted, metric='cityblock')
+    cluster_sums = np.add.reduceat(distances, offsets, axis=1)
+    del distances
+
+    block = np.arange(len(rows))
+    own = cluster_ids[rows]
+    own_sizes = sizes[own]
+
+    # the mean distance to the other samples in the same cluster
+    a = cluster_sums[block, own] / np.maximum(own_sizes - 1, 1)
+
+    # the smallest mean distance to the samples in another cluster
+    cluster_means = cluster_sums / sizes
+    cluster_means[block, own] = np.inf
+    b = cluster_means.min(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        s = (b - a) / np.maximum(a, b)
+    # the silhouette of a sample in a cluster of size 1 is 0
+    s[(own_sizes == 1) | ~np.isfinite(s)] = 0.0
+
+    return s
+
+
+def chunked_silhouette_samples(X,
+                               labels,
+                               positions=None,
+                               block_bytes=64 * 2**20,
+                               n_jobs=None):
+    """Computes the exact silhouette of samples with manhattan distance.
+    The distances from the samples to all samples are computed in blocks of rows
+    by a thread pool, so the memory is bounded by `block_bytes` per thread
+    instead of O(n^2).
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        The samples.
+
+    labels : numpy.ndarray
+        The cluster label of each sample.
+
+    positions : numpy.ndarray
+        The positions of the samples to be scored. All samples are scored by default.
+
+    block_bytes : int
+        The size of a block of pairwise distances in bytes.
+
+    n_jobs : int
+        The number of threads. By default, the number of CPUs.
+
+    Returns
+    -------
+    silhouettes : numpy.ndarray
+        The silhouette of each scored sample, in the order of `positions`.
+    """
+    X_sorted, labels_sorted, order, offsets = sort_by_label(X, labels)
+    num_samples = X_sorted.shape[0]
+    sizes = np.diff(np.append(offsets, num_samples))
+    cluster_ids = np.repeat(np.arange(len(offsets)), sizes)
+
+    if len(offsets) < 2:
+        raise ValueError('The number of clusters must be at least 2.')
+
+    # the positions of the scored samples in the sorted data
+    sorted_positions = np.empty(num_samples, dtype=np.int64)
+    sorted_positions[order] = np.arange(num_samples)
+    if positions is None:
+        positions = np.arange(num_samples)
+    rows = sorted_positions[np.asarray(positions, dtype=np.int64)]
+
+    block_rows = max(1, block_bytes // (8 * max(num_samples, 1)))
+    blocks = [
+        rows[start:start + block_rows]
+        for start in range(0, len(rows), block_rows)
+    ]
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        silhouettes = list(
+            executor.map(
+                lambda block: block_silhouettes(X_sorted, cluster_ids, offsets,
+                                                sizes, block), blocks))
+
+    if not silhouettes:
+        return np.empty(0, dtype=np.float64)
+
+    return np.concatenate(silhouettes)
+
+
+def chunked_silhouette_score(X, labels, block_bytes=64 * 2**20, n_jobs=None):
+    """Computes the exact mean silhouette with manhattan distance in bounded memory.
+    Returns the score and the silhouette of each sample.
+    """
+    silhouettes = chunked_silhouette_samples(
+        X, labels, block_bytes=block_bytes, n_jobs=n_jobs)
+    return (silhouettes.mean(), silhouettes)
+
+
+def stratified_sample(labels, sample_size, random_state):
+    """Draws a random sample in which each cluster keeps its share of samples.
+    Each cluster gets at least 2 samples if it has them.
+    """
+    labels = np.asarray(labels)
+    positions = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        size = int(round(sample_size * len(members) / len(labels)))
+        size = min(len(members), max(size, 2))
+        positions.append(random_state.choice(members, size, replace=False))
+
+    return np.sort(np.concatenate(positions))
+
+
+def sampled_silhouette_score(X,
+                             labels,
+                             sample_size=2000,
+                             confidence=1.96,
+                             random_state=103,
+                             block_bytes=64 * 2**20,
+                             n_jobs=None):
+    """Estimates the mean silhouette with manhattan distance from a stratified random sample.
+
+    The exact silhouettes of the sampled samples are computed against all samples,
+    which costs O(sample_size * n) instead of O(n^2), and the score is the
+    stratified mean of them, weighted by the size of each cluster.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        The samples.
+
+    labels : numpy.ndarray
+        The cluster label of each sample.
+
+    sample_size : int
+        The number of samples to be scored.
+
+    confidence : float
+        The z value of the confidence interval, 1.96 for 95%.
+
+    random_state : int
+        The seed of the random number generator.
+
+    block_bytes : int
+        The size of a block of pairwise distances in bytes.
+
+    n_jobs : int
+        The number of threads.
+
+    Returns
+    -------
+    score : float
+        The estimated mean silhouette.
+
+    interval : tuple
+        The confidence interval of the score.
+
+    silhouettes : pandas.DataFrame
+        The silhouette of each sampled sample, with columns 'position', 'label' and 'silhouette'.
+    """
+    labels = np.asarray(labels)
+    positions = stratified_sample(labels, sample_size,
+                                  np.random.RandomState(random_state))
+
+    silhouettes = pd.DataFrame({
+        'position': positions,
+        'label': labels[positions],
+        'silhouette': chunked_silhouette_samples(X, labels, positions,
+                                                 block_bytes, n_jobs)
+    })
+
+    # the stratified estimate of the mean and its variance
+    strata = silhouettes.groupby('label')['silhouette'].agg(
+        ['mean', 'var', 'count'])
+    weights = pd.Series(labels).value_counts()[strata.index] / len(labels)
+    finite_correction = 1 - strata['count'] / (weights * len(labels))
+    score = (weights * strata['mean']).sum()
+    variance = (weights**2 * strata['var'].fillna(0.0) / strata['count'] *
+                finite_correction).sum()
+    half_width = confidence * np.sqrt(variance)
+
+    return (score, (score - half_width, score + half_width), silhouettes)
+
+
+def summarize_clusters(labels, sample_labels, sample_silhouettes):
+    """Summarizes the silhouettes of each cluster.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        The cluster label of every sample.
+
+    sample_labels : numpy.ndarray
+        The cluster labels of the samples that were scored.
+
+    sample_silhouettes : numpy.ndarray
+        The silhouettes of the samples that were scored.
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        The size of each cluster and the mean, minimum, median and maximum silhouette,
+        and the share of negative silhouettes in it.
+    """
+    silhouettes = pd.DataFrame({
+        'label': sample_labels,
+        'silhouette': sample_silhouettes
+    })
+    groups = silhouettes.groupby('label')['silhouette']
+
+    summary = pd.DataFrame({
+        'size': pd.Series(labels).value_counts(),
+        'silhouette_mean': groups.mean(),
+        'silhouette_min': groups.min(),
+        'silhouette_median': groups.median(),
+        'silhouette_max': groups.max(),
+        'negative_share': groups.apply(lambda s: (s < 0).mean())
+    })
+    summary.index.name = 'cluster'
+
+    return summary[[
+        'size', 'silhouette_mean', 'silhouette_min', 'silhouette_median',
+        'silhouette_max', 'negative_share'
+    ]].sort_index()
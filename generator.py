@@ -1,16 +1,123 @@
-from collections import defaultdict
+import numpy as np
+import pandas as pd
 
+import os
 
-def gen_id_map(id_col):
+
+class UnknownIdError(KeyError):
+    """UnknownIdError is raised when IDs that are not in an IdEncoder are encoded.
+    """
+
+    def __init__(self, unknown_ids):
+        self.unknown_ids = unknown_ids
+        super().__init__('{} unknown ID(s), e.g. {}'.format(
+            len(unknown_ids), list(unknown_ids[:5])))
+
+
+class IdEncoder:
+    """IdEncoder maps the original IDs to new integer IDs.
+    The new IDs are 1, 2, 3... in the order in which the original IDs are added,
+    so the IDs already in an encoder never change when new IDs are appended.
+    Whole columns are encoded with a single hash table lookup.
+    """
+
+    def __init__(self, ids=()):
+        self.ids = pd.Index(list(ids), dtype=object)
+
+    def fit(self, id_col):
+        """Appends the IDs that are not in the encoder yet.
+        Returns the number of new IDs.
+        """
+        uniques = pd.unique(np.asarray(id_col, dtype=object))
+        new_ids = uniques[self.ids.get_indexer(uniques) < 0]
+        if len(new_ids) > 0:
+            self.ids = self.ids.append(pd.Index(new_ids, dtype=object))
+
+        return len(new_ids)
+
+    def encode(self, id_col, unknown='raise'):
+        """Encodes a column of original IDs into an array of new integer IDs.
+
+        Parameters
+        ----------
+        id_col : array-like
+            The column containing the original IDs.
+
+        unknown : str
+            How to handle IDs that are not in the encoder:
+            'raise' raises an UnknownIdError listing them,
+            'append' adds them to the encoder, and 'zero' encodes them as 0.
+
+        Returns
+        -------
+        new_ids : numpy.ndarray
+            The new integer IDs.
+        """
+        id_col = np.asarray(id_col, dtype=object)
+        if unknown == 'append':
+            self.fit(id_col)
+
+        new_ids = self.ids.get_indexer(id_col).astype(np.int64) + 1
+
+        if unknown == 'raise' and (new_ids == 0).any():
+            raise UnknownIdError(pd.unique(id_col[new_ids == 0]))
+
+        return new_ids
+
+    def decode(self, new_ids):
+        """Decodes an array of new integer IDs into the original IDs.
+        """
+        return self.ids.values[np.asarray(new_ids, dtype=np.int64) - 1]
+
+    def store(self, file_path):
+        """Stores the original IDs to a text file, one ID per line in the order of the new IDs.
+        """
+        with open(file_path, 'w') as f:
+            for id in self.ids:
+                f.write(id + '\n')
+
+    @classmethod
+    def load(cls, file_path):
+        """Loads an encoder from a text file written by `store`.
+        """
+        with open(file_path) as f:
+            return cls(line.rstrip('\n') for line in f)
+
+    def __getitem__(self, id):
+        return int(self.encode([id])[0])
+
+    def __contains__(self, id):
+        return id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def gen_id_map(id_col, file_path=None):
     """Generates a map for ID.
     The keys are the original ID and the values are the new integer ID.
+
+    If the file path is given, the map stored in it is loaded first,
+    the new IDs in the column are appended, and then the map is stored back,
+    so that the integer IDs stay the same across runs.
     """
-    coded_dict = defaultdict(int)
-    counter = 1
+    if file_path is not None and os.path.exists(file_path):
+        coded_map = IdEncoder.load(file_path)
+    else:
+        coded_map = IdEncoder()
+
+    coded_map.fit(id_col)
+
+    if file_path is not None:
+        coded_map.store(file_path)
 
-    for id in id_col:
-        if id not in coded_dict:
-            coded_dict[id] = counter
-            counter += 1
+    return coded_map
+
+
+def encode_ids(id_col, id_map):
+    """Encodes a column of original IDs with an IdEncoder or a plain dictionary.
+    """
+    if isinstance(id_map, IdEncoder):
+        return id_map.encode(id_col)
 
-    return coded_dict
+    return np.array([id_map[id] for id in id_col], dtype=np.int64)
@@ -0,0 +1,133 @@
+import numpy as np
+
+import storer as sto
+
+# The order of the sorted transcript.
+SORT_COLUMNS = ['profile_id', 'offer_id', 'time']
+
+
+def is_sorted(profile_ids, offer_ids, times):
+    """Returns whether the events are sorted by 'profile_id', 'offer_id' and 'time'.
+    """
+    if len(profile_ids) < 2:
+        return True
+
+    profile_diffs = np.diff(profile_ids.astype(np.int64))
+    offer_diffs = np.diff(offer_ids.astype(np.int64))
+    time_diffs = np.diff(times.astype(np.int64))
+
+    return bool(((profile_diffs > 0) | ((profile_diffs == 0) & (
+        (offer_diffs > 0) | ((offer_diffs == 0) & (time_diffs >= 0))))).all())
+
+
+def sort_transcript(transcript_cleaned):
+    """Sorts the cleaned transcript by 'profile_id', 'offer_id' and 'time'.
+    The sort is stable, so simultaneous events keep their original order,
+    which is also the order of their 'event_id'.
+    """
+    profile_ids = transcript_cleaned['profile_id'].values
+    offer_ids = transcript_cleaned['offer_id'].values
+    times = transcript_cleaned['time'].values
+    if is_sorted(profile_ids, offer_ids, times):
+        return transcript_cleaned
+
+    order = np.lexsort((times, offer_ids, profile_ids))
+
+    return transcript_cleaned.iloc[order].reset_index(drop=True)
+
+
+def gen_offsets(profile_ids, offer_ids):
+    """Generates the offsets of the (profile_id, offer_id) groups of a sorted transcript.
+
+    Returns
+    -------
+    offsets : numpy.ndarray
+        The row where each group starts, followed by the number of rows,
+        so the rows of group i are offsets[i]:offsets[i + 1].
+    """
+    group_starts = np.ones(len(profile_ids), dtype=bool)
+    group_starts[1:] = (profile_ids[1:] != profile_ids[:-1]) | (
+        offer_ids[1:] != offer_ids[:-1])
+
+    return np.append(np.flatnonzero(group_starts),
+                     len(profile_ids)).astype(np.int64)
+
+
+class TranscriptIndex:
+    """TranscriptIndex gives access to the groups of a sorted transcript
+    through the offsets of the groups, without any groupby or sort.
+
+    A group is returned as a dictionary of column slices, which are views
+    of the column arrays. If the transcript was loaded from the columnar
+    backend, they are views of its memory-mapped files.
+
+    Parameters
+    ----------
+    arrays : dict
+        The dictionary containing all mappings from column name to array
+        of the transcript sorted by `sort_transcript`.
+
+    offsets : numpy.ndarray
+        The offsets of the groups generated by `gen_offsets`.
+    """
+
+    def __init__(self, arrays, offsets):
+        self.arrays = arrays
+        self.offsets = offsets
+
+        first_rows = offsets[:-1]
+        self.group_keys = (np.asarray(
+            arrays['profile_id'][first_rows], dtype=np.int64) << 32) | np.asarray(
+                arrays['offer_id'][first_rows], dtype=np.int64)
+
+    @classmethod
+    def load(cls, transcript_cleaned_path, offsets_path, columns=None):
+        """Loads the index of a sorted transcript stored by the columnar backend.
+        A ValueError is raised if the offsets do not match the transcript.
+        """
+        if columns is not None:
+            # the keys of the groups are needed to find them
+            columns = list(columns) + [
+                name for name in ['profile_id', 'offer_id']
+                if name not in columns
+            ]
+        arrays = sto.load_arrays(transcript_cleaned_path, columns)
+        offsets = sto.load(offsets_path)
+
+        num_rows = len(next(iter(arrays.values())))
+        if len(offsets) == 0 or offsets[-1] != num_rows:
+            raise ValueError(
+                'The offsets in {} do not match the transcript in {}, '
+                'please run cleaner.py again.'.format(offsets_path,
+                                                      transcript_cleaned_path))
+
+        return cls(arrays, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_group(self, i):
+        """Returns the events of group i as a dictionary of column views.
+        """
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return {name: values[start:stop] for name, values in self.arrays.items()}
+
+    def find_group(self, profile_id, offer_id):
+        """Returns the number of the group of a customer and an offer, or -1.
+        Transactions are in the group with the offer ID 0.
+        """
+        key = (int(profile_id) << 32) | int(offer_id)
+        i = np.searchsorted(self.group_keys, key)
+        if i < len(self.group_keys) and self.group_keys[i] == key:
+            return int(i)
+
+        return -1
+
+    def get_customer(self, profile_id):
+        """Returns all events of a customer as a dictionary of column views.
+        """
+        first, last = np.searchsorted(
+            self.group_keys,
+            [int(profile_id) << 32, (int(profile_id) + 1) << 32])
+        start, stop = self.offsets[first], self.offsets[last]
+        return {name: values[start:stop] for name, values in self.arrays.items()}
@@ -1,23 +1,159 @@
 import pandas as pd
+import numpy as np
 from sklearn import cluster
 from sklearn.metrics import silhouette_score
+from sklearn.metrics import adjusted_rand_score
+from sklearn.metrics import pairwise_distances_argmin
 from sklearn.preprocessing import MinMaxScaler
+from scipy.cluster.hierarchy import linkage
+from concurrent.futures import ThreadPoolExecutor
 
 import os
-import constant
+import heapq
 import time
+import argparse
+import tracemalloc
+import constant
+import assigner as asg
+import cacher as cch
+import combiner as cmb
+import distcache as dch
+import evaluator as evl
 import storer as sto
 
 
-def main(input_dir, output_dir):
-    """The main function.
+class SummaryClustering:
+    """SummaryClustering is a scalable alternative to average-linkage manhattan
+    AgglomerativeClustering, whose pairwise distances need O(n^2) memory.
+
+    It first compresses the data into the subclusters of a BIRCH CF-tree,
+    which is built chunk by chunk, then clusters the subcluster centers with
+    average-linkage manhattan AgglomerativeClustering, and finally labels every
+    sample by its nearest subcluster center in manhattan distance.
     """
-    print('Build the clustering model...')
-    response_agg_path = os.path.join(input_dir, constant.PICKLE_RESPONSE_AGG)
 
-    print('Load aggregated data...')
-    response_agg = sto.load(response_agg_path)
+    def __init__(self, n_clusters, threshold=0.4, branching_factor=50,
+                 chunksize=100000):
+        self.n_clusters = n_clusters
+        self.threshold = threshold
+        self.branching_factor = branching_factor
+        self.chunksize = chunksize
+
+    def fit(self, X):
+        birch = cluster.Birch(
+            threshold=self.threshold,
+            branching_factor=self.branching_factor,
+            n_clusters=None)
+        for start in range(0, X.shape[0], self.chunksize):
+            birch.partial_fit(X[start:start + self.chunksize])
+
+        self.subcluster_centers_ = birch.subcluster_centers_
+        if len(self.subcluster_centers_) < self.n_clusters:
+            raise ValueError(
+                'Only {} subclusters were found, please lower the threshold.'.
+                format(len(self.subcluster_centers_)))
+
+        summary_model = cluster.AgglomerativeClustering(
+            n_clusters=self.n_clusters, affinity='manhattan', linkage='average')
+        self.subcluster_labels_ = summary_model.fit_predict(
+            self.subcluster_centers_)
+
+        self.labels_ = self.predict(X)
+
+        return self
+
+    def predict(self, X):
+        nearest = pairwise_distances_argmin(
+            X, self.subcluster_centers_, metric='manhattan')
+        return self.subcluster_labels_[nearest]
+
+    def fit_predict(self, X):
+        return self.fit(X).labels_
+
+
+class PrecomputedClustering:
+    """PrecomputedClustering is average-linkage AgglomerativeClustering
+    on a condensed distance matrix, e.g. from a `distcache.DistanceCache`.
+
+    Given the float64 manhattan distances, it builds the same tree as
+    AgglomerativeClustering with linkage='average', and numbers the clusters
+    in the same way, but it does not compute the pairwise distances again.
+    scipy's linkage still copies the condensed matrix into memory,
+    so the peak memory is the same as without the precomputed distances.
+    """
+
+    def __init__(self, n_clusters):
+        self.n_clusters = n_clusters
+
+    def fit(self, distances):
+        self.linkage_matrix_ = linkage(distances, method='average')
+        self.children_ = self.linkage_matrix_[:, :2].astype(np.intp)
+        self.n_leaves_ = self.children_.shape[0] + 1
+        self.labels_ = cut_tree(self.children_, self.n_clusters,
+                                self.n_leaves_)
+
+        return self
+
+    def fit_predict(self, distances):
+        return self.fit(distances).labels_
+
+
+def cut_tree(children, n_clusters, n_leaves):
+    """Cuts a linkage tree into clusters, which are numbered
+    in the same way as AgglomerativeClustering.
+
+    Parameters
+    ----------
+    children : numpy.ndarray
+        The children of each non-leaf node, as `children_` of AgglomerativeClustering.
+
+    n_clusters : int
+        The number of clusters.
+
+    n_leaves : int
+        The number of leaves.
 
+    Returns
+    -------
+    labels : numpy.ndarray
+        The cluster label of each leaf.
+    """
+    # split the node with the largest id until there are n_clusters nodes
+    nodes = [-(max(children[-1]) + 1)]
+    for _ in range(n_clusters - 1):
+        these_children = children[-nodes[0] - n_leaves]
+        heapq.heappush(nodes, -these_children[0])
+        heapq.heappushpop(nodes, -these_children[1])
+
+    node_labels = np.full(n_leaves + len(children), -1, dtype=np.intp)
+    for i, node in enumerate(nodes):
+        node_labels[-node] = i
+
+    # pass the labels down from the root to the leaves
+    for parent in range(len(children) - 1, -1, -1):
+        label = node_labels[n_leaves + parent]
+        if label >= 0:
+            node_labels[children[parent]] = label
+
+    return node_labels[:n_leaves]
+
+
+def measure(func, *args):
+    """Returns the result, the wall time and the peak memory allocated by a function call.
+    """
+    tracemalloc.start()
+    start_time = time.time()
+    result = func(*args)
+    end_time = time.time()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (result, end_time - start_time, peak)
+
+
+def prepare_features(response_agg):
+    """Prepares the features for model from the aggregated response.
+    """
     print('Separate the column named gender for model...')
     gender_type_df = pd.get_dummies(
         response_agg['gender'], prefix='gender', prefix_sep='_')
@@ -33,42 +169,340 @@ def main(input_dir, output_dir):
     # The value of this column in the new data will most likely not exist in the existing data.
     response_model = response_model.drop(columns=['profile_id', 'reg_year'])
 
+    # The features of the in-window spend (combiner.py --window-spend) are kept
+    # in the labeled response, but they are not used by the model,
+    # so that the clusters stay the same with or without them.
+    response_model = response_model.drop(columns=[
+        col for col in response_model.columns
+        if col.startswith('window_amount_')
+    ])
+
+    return response_model
+
+
+def evaluate(X_scaled, labels, evaluation='full', sample_size=2000):
+    """Evaluates the clustering model by the silhouette with manhattan distance.
+    The distances are computed in blocks, which was faster than gathering them
+    from a cached condensed distance matrix.
+    """
+    if evaluation == 'full':
+        print("Score: {}\n".format(
+            silhouette_score(X_scaled, labels, metric='manhattan')))
+        return
+
+    if evaluation == 'sampled':
+        score, interval, silhouettes = evl.sampled_silhouette_score(
+            X_scaled, labels, sample_size)
+        print("Score: {} (95% confidence interval: [{}, {}], {} samples)".
+              format(score, interval[0], interval[1], silhouettes.shape[0]))
+        summary = evl.summarize_clusters(labels, silhouettes['label'].values,
+                                         silhouettes['silhouette'].values)
+    else:
+        score, silhouettes = evl.chunked_silhouette_score(X_scaled, labels)
+        print("Score: {}".format(score))
+        summary = evl.summarize_clusters(labels, labels, silhouettes)
+
+    print('Silhouette of each cluster:')
+    print(summary.to_string())
+    print()
+
+
+def sweep(X_scaled, numbers, sample_size=2000, n_jobs=None, distances=None):
+    """Evaluates the average-linkage manhattan clustering for many cluster numbers.
+    The full linkage tree is built only once and then cut for each number,
+    and the cuts are scored by the sampled silhouette in parallel.
+
+    Parameters
+    ----------
+    X_scaled : numpy.ndarray
+        The scaled data for model.
+
+    numbers : list
+        The numbers of clusters.
+
+    sample_size : int
+        The number of customers scored for each number of clusters.
+
+    n_jobs : int
+        The number of threads used to score the cuts.
+
+    distances : numpy.ndarray
+        The condensed float64 manhattan distance matrix of the data, optional.
+        It is used to build the tree, and the cuts are scored from the data.
+
+    Returns
+    -------
+    sweep_df : pandas.Dataframe
+        The data frame containing the score, the confidence interval,
+        the cluster sizes and the time spent for each number of clusters.
+    """
+    print('Build the full linkage tree... (waiting for a moment)')
+    start_time = time.time()
+    # the same tree as AgglomerativeClustering(affinity='manhattan', linkage='average')
+    if distances is None:
+        linkage_matrix = linkage(
+            X_scaled, method='average', metric='cityblock')
+    else:
+        linkage_matrix = linkage(distances, method='average')
+    tree_time = time.time() - start_time
+    print('The time spent building the tree: {}s'.format(tree_time))
+
+    # cut the tree as PrecomputedClustering does, so that a cut always has
+    # `number` clusters and the labels are the same as the model's
+    children = linkage_matrix[:, :2].astype(np.intp)
+    n_leaves = children.shape[0] + 1
+
+    def evaluate_cut(number):
+        start_time = time.time()
+        labels = cut_tree(children, number, n_leaves)
+        cut_time = time.time() - start_time
+
+        start_time = time.time()
+        score, interval, _ = evl.sampled_silhouette_score(
+            X_scaled, labels, sample_size, n_jobs=1)
+        score_time = time.time() - start_time
+
+        return [
+            number, score, interval[0], interval[1],
+            ' '.join(str(size) for size in np.bincount(labels)), cut_time,
+            score_time
+        ]
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        rows = list(executor.map(evaluate_cut, numbers))
+
+    sweep_df = pd.DataFrame(
+        data=rows,
+        columns=[
+            'number', 'score', 'score_low', 'score_high', 'cluster_sizes',
+            'cut_time', 'score_time'
+        ])
+    sweep_df['tree_time'] = tree_time
+
+    return sweep_df
+
+
+def scale_features(response_agg, distance_cache_dir=None):
+    """Prepares and scales the features for model.
+    If `distance_cache_dir` is given, the condensed manhattan distance matrix
+    of the scaled data is taken from the distance cache in it.
+
+    Returns
+    -------
+    response_model : pandas.Dataframe
+        The features for model.
+
+    scaler : sklearn.preprocessing.MinMaxScaler
+        The fitted scaler.
+
+    X_scaled : numpy.ndarray
+        The scaled data for model.
+
+    distances : numpy.ndarray
+        The condensed distance matrix, or None.
+    """
+    response_model = prepare_features(response_agg)
+
     print('Scale the data for model...')
     X = response_model
     scaler = MinMaxScaler()
     scaler.fit(X)
     X_scaled = scaler.transform(X)
 
+    distances = None
+    if distance_cache_dir is not None:
+        cache = dch.DistanceCache(distance_cache_dir)
+        if X_scaled in cache:
+            print('Load the cached distance matrix...')
+        else:
+            print('Compute and cache the distance matrix... '
+                  '(waiting for a moment)')
+        start_time = time.time()
+        distances = cache.get(X_scaled)
+        print('The time spent getting the distance matrix: {}s'.format(
+            time.time() - start_time))
+
+    return (response_model, scaler, X_scaled, distances)
+
+
+def train(response_agg,
+          mode='exact',
+          threshold=0.4,
+          compare=False,
+          evaluation='full',
+          sample_size=2000,
+          distance_cache_dir=None,
+          selected_number=6):
+    """Trains and evaluates the clustering model in memory, see `main` for the parameters.
+
+    Returns
+    -------
+    clustering_model : object
+        The trained clustering model.
+
+    response_labeled : pandas.Dataframe
+        The aggregated response with the cluster label as the first column.
+
+    cluster_assigner : assigner.ClusterAssigner
+        The cluster assigner for new customers.
+    """
+    response_model, scaler, X_scaled, distances = scale_features(
+        response_agg, distance_cache_dir)
+
     print('Initialize the clustering model...')
-    selected_number = 6
-    clustering_model = cluster.AgglomerativeClustering(
-        n_clusters=selected_number, affinity='manhattan', linkage='average')
+    if mode == 'scalable':
+        clustering_model = SummaryClustering(
+            n_clusters=selected_number, threshold=threshold)
+    elif distances is not None:
+        clustering_model = PrecomputedClustering(n_clusters=selected_number)
+    else:
+        clustering_model = cluster.AgglomerativeClustering(
+            n_clusters=selected_number, affinity='manhattan', linkage='average')
 
     print('Train the clustering model... (waiting for a moment)')
-    start_time = time.time()
-    labels = clustering_model.fit_predict(X_scaled)
-    end_time = time.time()
+    labels, train_time, train_peak = measure(
+        clustering_model.fit_predict,
+        X_scaled if mode == 'scalable' or distances is None else distances)
     print('The time spent training model and prediction: {}s'.\
-        format(end_time - start_time))
+        format(train_time))
+    print('The peak memory allocated by training: {:.1f} MB'.format(
+        train_peak / 1e6))
+
+    if mode == 'scalable':
+        print('The number of subclusters: {}'.format(
+            len(clustering_model.subcluster_centers_)))
+
+        if compare:
+            print('Train the exact clustering model for comparison...')
+            exact_model = cluster.AgglomerativeClustering(
+                n_clusters=selected_number,
+                affinity='manhattan',
+                linkage='average')
+            exact_labels, exact_time, exact_peak = measure(
+                exact_model.fit_predict, X_scaled)
+            print('The time spent training exact model: {}s'.format(
+                exact_time))
+            print('The peak memory allocated by exact training: {:.1f} MB'.
+                  format(exact_peak / 1e6))
+            print('Label agreement (adjusted Rand index): {}'.format(
+                adjusted_rand_score(exact_labels, labels)))
 
     print('Evaluate the clustering model... (waiting for a moment)')
-    print("Score: {}\n".format(
-        silhouette_score(X_scaled, labels, metric='manhattan')))
+    evaluate(X_scaled, labels, evaluation, sample_size)
 
     print('Generate labeled response data...')
     cluster_col_name = 'cluster_' + str(selected_number)
     response_labeled = response_agg.copy()
     response_labeled.insert(0, cluster_col_name, labels)
 
+    print('Build the cluster assigner for new customers...')
+    cluster_assigner = asg.ClusterAssigner(response_model.columns, scaler,
+                                           X_scaled, labels, threshold)
+
+    return (clustering_model, response_labeled, cluster_assigner)
+
+
+def main(input_dir,
+         output_dir,
+         mode='exact',
+         threshold=0.4,
+         compare=False,
+         evaluation='full',
+         sample_size=2000,
+         sweep_range=None,
+         distance_cache=False,
+         selected_number=6,
+         cache_dir=None):
+    """The main function.
+
+    In 'exact' mode, AgglomerativeClustering is trained on all customers.
+    In 'scalable' mode, SummaryClustering is trained instead, and if `compare`
+    is True, the exact model is trained as well to report the label agreement.
+
+    The evaluation is 'full' (silhouette_score on all customers),
+    'chunked' (the exact score in bounded memory) or 'sampled'
+    (an estimate from `sample_size` customers with a confidence interval).
+
+    If `sweep_range` (the smallest and the largest number of clusters) is given,
+    the numbers of clusters are evaluated by `sweep` instead of building the model.
+
+    If `distance_cache` is True, the condensed manhattan distance matrix is
+    cached in `input_dir` by the content of the scaled data, and the trees of
+    the exact model and the sweep are built from it. The cache evicts the
+    matrices by age and size, see `distcache.DistanceCache`.
+
+    If `cache_dir` is given, the outputs are restored from the stage cache
+    when the aggregated data and the parameters have not changed.
+    The cache is not used if `compare` or an evaluation other than 'full'
+    is asked for, because their results are only printed.
+    """
+    print('Build the clustering model...')
+    response_agg_path = os.path.join(input_dir, constant.PICKLE_RESPONSE_AGG)
+
+    # The evaluation and the comparison are only printed, and a cache hit would skip them,
+    # so the cache is not used when they are asked for.
+    # The distance cache does not change the outputs.
+    reporting = sweep_range is None and (compare or evaluation != 'full')
+    if cache_dir is not None and not reporting:
+        if sweep_range is None:
+            output_paths = list(get_output_file_paths(output_dir))
+        else:
+            output_paths = [
+                os.path.join(output_dir, constant.CSV_CLUSTER_SWEEP)
+            ]
+        cch.run_cached(
+            'model', lambda: main(input_dir, output_dir, mode, threshold,
+                                  compare, evaluation, sample_size,
+                                  sweep_range, distance_cache, selected_number),
+            [response_agg_path], output_paths, {
+                'mode': mode,
+                'threshold': threshold,
+                'selected_number': selected_number,
+                'sweep_range': sweep_range,
+                'sample_size': sample_size if sweep_range else None
+            }, cache_dir)
+        return
+
+    print('Load aggregated data...')
+    response_agg = sto.load(response_agg_path)
+
+    distance_cache_dir = None
+    if distance_cache:
+        distance_cache_dir = os.path.join(input_dir,
+                                          constant.DIR_DISTANCE_CACHE)
+
+    if sweep_range is not None:
+        _, _, X_scaled, distances = scale_features(response_agg,
+                                                   distance_cache_dir)
+
+        print('Sweep the numbers of clusters...')
+        sweep_df = sweep(X_scaled,
+                         list(range(sweep_range[0], sweep_range[1] + 1)),
+                         sample_size,
+                         distances=distances)
+        print(sweep_df.to_string(index=False))
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        sweep_path = os.path.join(output_dir, constant.CSV_CLUSTER_SWEEP)
+        sweep_df.to_csv(sweep_path, index=False)
+        print('The sweep results are stored in {}.\n'.format(sweep_path))
+        return
+
+    clustering_model, response_labeled, cluster_assigner = train(
+        response_agg, mode, threshold, compare, evaluation, sample_size,
+        distance_cache_dir, selected_number)
+
     print('Store data...')
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    clustering_model_path, response_labeled_path = get_output_file_paths(
-        output_dir)
+    clustering_model_path, response_labeled_path, cluster_assigner_path = \
+        get_output_file_paths(output_dir)
 
     sto.store(clustering_model, clustering_model_path)
     sto.store(response_labeled, response_labeled_path)
+    sto.store(cluster_assigner, cluster_assigner_path)
 
     print('Done.\n')
 
@@ -77,8 +511,8 @@ def check(output_dir):
     """Checks the validity for the pickle files.
     """
     print('Check the validity for the pickle files...')
-    clustering_model_path, response_labeled_path = get_output_file_paths(
-        output_dir)
+    clustering_model_path, response_labeled_path, cluster_assigner_path = \
+        get_output_file_paths(output_dir)
 
     print(
         'Check the output file located at {}...'.format(clustering_model_path))
@@ -91,8 +525,22 @@ def check(output_dir):
         'Check the output file located at {}...'.format(response_labeled_path))
     response_labeled = sto.load(response_labeled_path)
     print('response_labeled.shape: {}'.format(response_labeled.shape))
+    # the columns of the aggregated response and the cluster label
+    num_columns = 23
+    if 'window_amount_sum_bogo' in response_labeled.columns:
+        num_columns += 2 * len(cmb.RESPONSE_AGG_WINDOW_FEATURES)
     assert response_labeled.shape == (
-        16928, 23), "The shape of labeled response is incorrect!"
+        16928, num_columns), "The shape of labeled response is incorrect!"
+
+    print(
+        'Check the output file located at {}...'.format(cluster_assigner_path))
+    cluster_assigner = sto.load(cluster_assigner_path)
+    cluster_col_name = response_labeled.columns[0]
+    assigned_labels = cluster_assigner.assign(response_labeled)
+    print('The share of customers assigned to their own clusters: {}'.format(
+        (assigned_labels == response_labeled[cluster_col_name].values).mean()))
+    assert len(assigned_labels) == response_labeled.shape[
+        0], "The number of assigned labels is incorrect!"
 
     print('OK\n')
 
@@ -104,10 +552,71 @@ def get_output_file_paths(output_dir):
                                          constant.PICKLE_CLUSTERING_MODEL)
     response_labeled_path = os.path.join(output_dir,
                                          constant.PICKLE_RESPONSE_LABELED)
+    cluster_assigner_path = os.path.join(output_dir,
+                                         constant.PICKLE_CLUSTER_ASSIGNER)
 
-    return (clustering_model_path, response_labeled_path)
+    return (clustering_model_path, response_labeled_path,
+            cluster_assigner_path)
 
 
 if __name__ == "__main__":
-    main(constant.PROCESSED_DATA_DIR, constant.MODEL_DIR)
+    parser = argparse.ArgumentParser(description='Build the clustering model.')
+    parser.add_argument(
+        '--mode',
+        choices=['exact', 'scalable'],
+        default='exact',
+        help='exact: AgglomerativeClustering on all customers; '
+        'scalable: AgglomerativeClustering on BIRCH subclusters')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.4,
+        help='the BIRCH subcluster radius threshold in scalable mode '
+        'and for the representatives of the cluster assigner')
+    parser.add_argument(
+        '--compare',
+        action='store_true',
+        help='also train the exact model in scalable mode and '
+        'report the label agreement')
+    parser.add_argument(
+        '--evaluation',
+        choices=['full', 'chunked', 'sampled'],
+        default='full',
+        help='full: silhouette_score on all customers; '
+        'chunked: the exact score computed in bounded memory; '
+        'sampled: an estimate from a stratified random sample')
+    parser.add_argument(
+        '--sample-size',
+        type=int,
+        default=2000,
+        help='the number of customers scored in sampled evaluation')
+    parser.add_argument(
+        '--sweep',
+        type=int,
+        nargs=2,
+        metavar=('MIN', 'MAX'),
+        help='evaluate the numbers of clusters from MIN to MAX '
+        'by cutting one linkage tree, instead of building the model')
+    parser.add_argument(
+        '--distance-cache',
+        action='store_true',
+        help='cache the distance matrix on disk and reuse it '
+        'to build the trees of the exact model and the sweep')
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='always build the model instead of using the stage cache')
+    args = parser.parse_args()
+
+    main(
+        constant.PROCESSED_DATA_DIR,
+        constant.MODEL_DIR,
+        args.mode,
+        args.threshold,
+        args.compare,
+        args.evaluation,
+        args.sample_size,
+        args.sweep,
+        args.distance_cache,
+        cache_dir=None if args.no_cache else constant.STAGE_CACHE_DIR)
     check(constant.MODEL_DIR)
\ No newline at end of file
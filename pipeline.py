@@ -0,0 +1,341 @@
+import pandas as pd
+
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import constant
+import cleaner as cln
+import combiner as cmb
+import indexer as idx
+import model as mdl
+import storer as sto
+
+STAGE_NAMES = ['cleaner', 'combiner', 'model']
+
+
+class Stage:
+    """Stage is a step of the pipeline, which computes its output artifacts
+    from its input artifacts in memory.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage, which is also the name of its module.
+
+    inputs : list
+        The names of the input artifacts.
+
+    outputs : list
+        The names of the output artifacts.
+
+    func : function
+        The function that receives the input artifacts as positional arguments,
+        and returns the output artifacts as a tuple.
+
+    check : function
+        The function that checks the stored outputs, which receives no argument.
+    """
+
+    def __init__(self, name, inputs, outputs, func, check):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.func = func
+        self.check = check
+
+
+class Persister:
+    """Persister stores the artifacts of the pipeline.
+
+    With 'async', the artifacts are stored by a background thread
+    while the next stages are running. With 'sync', they are stored
+    before the next stage starts, and with 'none', they are not stored.
+    """
+
+    def __init__(self, persist='async'):
+        self.persist = persist
+        self.futures = []
+        self.executor = None
+        if persist == 'async':
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def store(self, obj, file_path):
+        if self.persist == 'none':
+            return
+
+        dir_path = os.path.dirname(file_path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        if self.executor is None:
+            sto.store(obj, file_path)
+        else:
+            self.futures.append(self.executor.submit(sto.store, obj, file_path))
+
+    def wait(self):
+        """Waits until all artifacts are stored, and raises the first error.
+        """
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def get_artifact_paths(processed_data_dir, model_dir):
+    """Returns the dictionary containing all mappings from artifact name to file path.
+    """
+    portfolio_cleaned_path, profile_cleaned_path, transcript_cleaned_path = \
+        cln.get_output_file_paths(processed_data_dir)
+    clustering_model_path, response_labeled_path, cluster_assigner_path = \
+        mdl.get_output_file_paths(model_dir)
+
+    return {
+        'portfolio_cleaned': portfolio_cleaned_path,
+        'profile_cleaned': profile_cleaned_path,
+        'transcript_cleaned': transcript_cleaned_path,
+        'transcript_offsets': cln.get_offsets_file_path(processed_data_dir),
+        'response_agg': cmb.get_output_file_path(processed_data_dir),
+        'clustering_model': clustering_model_path,
+        'response_labeled': response_labeled_path,
+        'cluster_assigner': cluster_assigner_path,
+    }
+
+
+def build_stages(data_dir,
+                 processed_data_dir,
+                 model_dir,
+                 workers=1,
+                 mode='exact',
+                 evaluation='full',
+                 distance_cache=False,
+                 window_spend=False):
+    """Builds the stages of the pipeline.
+    """
+
+    def clean():
+        print('Load original data...')
+        portfolio = pd.read_json(
+            os.path.join(data_dir, constant.JSON_PORTFOLIO),
+            orient='records',
+            lines=True)
+        profile = pd.read_json(
+            os.path.join(data_dir, constant.JSON_PROFILE),
+            orient='records',
+            lines=True)
+        transcript = pd.read_json(
+            os.path.join(data_dir, constant.JSON_TRANSCRIPT),
+            orient='records',
+            lines=True)
+
+        if not os.path.exists(processed_data_dir):
+            os.makedirs(processed_data_dir)
+        offer_id_map, profile_id_map = cln.gen_id_maps(portfolio, profile,
+                                                       processed_data_dir)
+
+        portfolio_cleaned, profile_cleaned, transcript_cleaned = cln.clean(
+            portfolio, profile, transcript, offer_id_map, profile_id_map)
+        transcript_offsets = idx.gen_offsets(
+            transcript_cleaned['profile_id'].values,
+            transcript_cleaned['offer_id'].values)
+
+        return (portfolio_cleaned, profile_cleaned, transcript_cleaned,
+                transcript_offsets)
+
+    def combine(portfolio_cleaned, profile_cleaned, transcript_cleaned):
+        return (cmb.combine(portfolio_cleaned, profile_cleaned,
+                            transcript_cleaned, workers, window_spend), )
+
+    def train(response_agg):
+        distance_cache_dir = None
+        if distance_cache:
+            distance_cache_dir = os.path.join(processed_data_dir,
+                                              constant.DIR_DISTANCE_CACHE)
+        return mdl.train(
+            response_agg,
+            mode,
+            evaluation=evaluation,
+            distance_cache_dir=distance_cache_dir)
+
+    return [
+        Stage('cleaner', [], [
+            'portfolio_cleaned', 'profile_cleaned', 'transcript_cleaned',
+            'transcript_offsets'
+        ], clean, lambda: cln.check(processed_data_dir)),
+        Stage('combiner',
+              ['portfolio_cleaned', 'profile_cleaned', 'transcript_cleaned'],
+              ['response_agg'], combine,
+              lambda: cmb.check(processed_data_dir)),
+        Stage('model', ['response_agg'],
+              ['clustering_model', 'response_labeled', 'cluster_assigner'],
+              train, lambda: mdl.check(model_dir)),
+    ]
+
+
+def sort_stages(stages):
+    """Sorts the stages so that every stage comes after the stages producing its inputs.
+    """
+    producers = {
+        output: stage.name
+        for stage in stages for output in stage.outputs
+    }
+    dependencies = {
+        stage.name: {
+            producers[input]
+            for input in stage.inputs if input in producers
+        }
+        for stage in stages
+    }
+
+    sorted_stages = []
+    done = set()
+    while len(sorted_stages) < len(stages):
+        ready = [
+            stage for stage in stages
+            if stage.name not in done and dependencies[stage.name] <= done
+        ]
+        if not ready:
+            raise ValueError('The stages have a cycle!')
+        for stage in ready:
+            sorted_stages.append(stage)
+            done.add(stage.name)
+
+    return sorted_stages
+
+
+def select_stages(stages, start=None, stop=None):
+    """Sorts the stages and selects the range from `start` to `stop`, both included.
+    """
+    stages = sort_stages(stages)
+    names = [stage.name for stage in stages]
+    first = names.index(start) if start is not None else 0
+    last = names.index(stop) if stop is not None else len(stages) - 1
+
+    return stages[first:last + 1]
+
+
+def run(stages, artifact_paths, start=None, stop=None, persist='async'):
+    """Runs a range of stages in one process, passing the artifacts in memory.
+    The inputs that are not produced by the selected stages are loaded from their files.
+
+    Parameters
+    ----------
+    stages : list
+        The stages of the pipeline.
+
+    artifact_paths : dict
+        The dictionary containing all mappings from artifact name to file path.
+
+    start, stop : str
+        The names of the first and the last stage to run. All stages are run by default.
+
+    persist : str
+        'async', 'sync' or 'none', see `Persister`.
+
+    Returns
+    -------
+    artifacts : dict
+        The dictionary containing all mappings from artifact name to artifact.
+    """
+    artifacts = {}
+    persister = Persister(persist)
+    for stage in select_stages(stages, start, stop):
+        for input in stage.inputs:
+            if input not in artifacts:
+                print('Load {} from {}...'.format(input,
+                                                  artifact_paths[input]))
+                artifacts[input] = sto.load(artifact_paths[input])
+
+        print('Run {}...'.format(stage.name))
+        start_time = time.time()
+        outputs = stage.func(*[artifacts[input] for input in stage.inputs])
+        print('The time spent running {}: {}s\n'.format(
+            stage.name,
+            time.time() - start_time))
+
+        for output, obj in zip(stage.outputs, outputs):
+            artifacts[output] = obj
+            persister.store(obj, artifact_paths[output])
+
+    print('Wait for the artifacts to be stored...')
+    persister.wait()
+
+    return artifacts
+
+
+def main(data_dir,
+         processed_data_dir,
+         model_dir,
+         start=None,
+         stop=None,
+         persist='async',
+         check=False,
+         workers=1,
+         mode='exact',
+         evaluation='full',
+         distance_cache=False,
+         window_spend=False):
+    """The main function.
+    """
+    stages = build_stages(data_dir, processed_data_dir, model_dir, workers,
+                          mode, evaluation, distance_cache, window_spend)
+    start_time = time.time()
+    run(stages, get_artifact_paths(processed_data_dir, model_dir), start, stop,
+        persist)
+    print('The time spent running the pipeline: {}s'.format(time.time() -
+                                                           start_time))
+
+    if check and persist != 'none':
+        for stage in select_stages(stages, start, stop):
+            stage.check()
+
+    print('Done.\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run the pipeline in one process.')
+    parser.add_argument(
+        '--start', choices=STAGE_NAMES, help='the first stage to run')
+    parser.add_argument(
+        '--stop', choices=STAGE_NAMES, help='the last stage to run')
+    parser.add_argument(
+        '--persist',
+        choices=['async', 'sync', 'none'],
+        default='async',
+        help='async: store the artifacts in the background; '
+        'sync: store them between the stages; none: do not store them')
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='check the stored artifacts after running')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='the number of worker processes used to create the response')
+    parser.add_argument(
+        '--mode',
+        choices=['exact', 'scalable'],
+        default='exact',
+        help='the mode of model.py')
+    parser.add_argument(
+        '--evaluation',
+        choices=['full', 'chunked', 'sampled'],
+        default='full',
+        help='the evaluation of model.py')
+    parser.add_argument(
+        '--distance-cache',
+        action='store_true',
+        help='cache the distance matrix on disk, as in model.py')
+    parser.add_argument(
+        '--window-spend',
+        action='store_true',
+        help='add the features of the in-window spend, as in combiner.py')
+    args = parser.parse_args()
+
+    main(constant.DATA_DIR, constant.PROCESSED_DATA_DIR, constant.MODEL_DIR,
+         args.start, args.stop, args.persist, args.check, args.workers,
+         args.mode, args.evaluation, args.distance_cache, args.window_spend)
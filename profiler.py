@@ -0,0 +1,311 @@
+import numpy as np
+import pandas as pd
+
+import os
+import sys
+import ast
+import csv
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import inspect
+import argparse
+import resource
+import functools
+import importlib
+import threading
+
+# The modules whose functions are instrumented by default.
+MODULE_NAMES = ['cleaner', 'combiner', 'separater', 'model', 'storer']
+LOG_COLUMNS = [
+    'run_id', 'script', 'function', 'calls', 'wall_time', 'cpu_time',
+    'peak_rss_delta', 'rows_in', 'rows_out', 'rows_per_second'
+]
+
+
+class Profiler:
+    """Profiler collects the statistics of the instrumented functions.
+
+    For each function, it records the number of calls, the wall time and
+    the CPU time (both inclusive of the instrumented functions it calls),
+    the largest growth of the peak resident set size during a call,
+    and the numbers of rows in the data frames and arrays passed in and returned.
+
+    Parameters
+    ----------
+    cprofile_function : str
+        The qualified name of a function, e.g. 'combiner.create_response',
+        whose calls are also profiled by cProfile.
+
+    cprofile_path : str
+        The path of the cProfile dump.
+    """
+
+    def __init__(self, cprofile_function=None, cprofile_path=None):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.cprofile_function = cprofile_function
+        self.cprofile_path = cprofile_path
+        self.cprofile = None
+
+    def wrap(self, func, name):
+        """Returns a wrapper of a function that records its statistics under the name.
+        """
+        profiler = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = None
+            peak_rss = get_peak_rss()
+            start_cpu_time = time.process_time()
+            start_time = time.perf_counter()
+            try:
+                if name == profiler.cprofile_function:
+                    result = profiler.run_cprofile(func, *args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+                return result
+            finally:
+                profiler.record(
+                    name,
+                    time.perf_counter() - start_time,
+                    time.process_time() - start_cpu_time,
+                    get_peak_rss() - peak_rss,
+                    count_rows(list(args) + list(kwargs.values())),
+                    count_rows([result]))
+
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def run_cprofile(self, func, *args, **kwargs):
+        if self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+        return self.cprofile.runcall(func, *args, **kwargs)
+
+    def record(self, name, wall_time, cpu_time, rss_delta, rows_in, rows_out):
+        with self.lock:
+            stat = self.stats.setdefault(
+                name, {
+                    'calls': 0,
+                    'wall_time': 0.0,
+                    'cpu_time': 0.0,
+                    'peak_rss_delta': 0,
+                    'rows_in': 0,
+                    'rows_out': 0
+                })
+            stat['calls'] += 1
+            stat['wall_time'] += wall_time
+            stat['cpu_time'] += cpu_time
+            stat['peak_rss_delta'] = max(stat['peak_rss_delta'], rss_delta)
+            stat['rows_in'] += rows_in
+            stat['rows_out'] += rows_out
+
+    def instrument(self, module):
+        """Replaces the functions and the methods defined in a module with wrappers.
+        Generator functions are left alone, because their work is done by the caller.
+        """
+        for attr_name, obj in list(vars(module).items()):
+            if inspect.isfunction(obj) and obj.__module__ == module.__name__:
+                if not inspect.isgeneratorfunction(obj):
+                    setattr(module, attr_name,
+                            self.wrap(obj, '{}.{}'.format(
+                                module.__name__, attr_name)))
+            elif inspect.isclass(obj) and obj.__module__ == module.__name__:
+                self.instrument_class(obj, module.__name__)
+
+    def instrument_class(self, cls, module_name):
+        for attr_name, obj in list(vars(cls).items()):
+            if attr_name.startswith('__') and attr_name != '__init__':
+                continue
+            name = '{}.{}.{}'.format(module_name, cls.__name__, attr_name)
+            if isinstance(obj, classmethod):
+                setattr(cls, attr_name,
+                        classmethod(self.wrap(obj.__func__, name)))
+            elif isinstance(obj, staticmethod):
+                setattr(cls, attr_name,
+                        staticmethod(self.wrap(obj.__func__, name)))
+            elif inspect.isfunction(obj) and not inspect.isgeneratorfunction(
+                    obj):
+                setattr(cls, attr_name, self.wrap(obj, name))
+
+    def get_records(self, run_id, script):
+        """Returns the statistics as a list of records, sorted by wall time.
+        """
+        records = []
+        with self.lock:
+            for name, stat in self.stats.items():
+                record = {'run_id': run_id, 'script': script, 'function': name}
+                record.update(stat)
+                record['rows_per_second'] = (
+                    stat['rows_in'] / stat['wall_time']
+                    if stat['wall_time'] > 0 else 0.0)
+                records.append(record)
+
+        return sorted(records, key=lambda r: r['wall_time'], reverse=True)
+
+    def write_log(self, log_path, run_id, script):
+        """Appends the statistics of this run to a JSON lines or a CSV run log.
+        """
+        records = self.get_records(run_id, script)
+        if log_path.endswith('.csv'):
+            is_new = not os.path.exists(log_path)
+            with open(log_path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=LOG_COLUMNS)
+                if is_new:
+                    writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(log_path, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+        return records
+
+    def dump_cprofile(self):
+        if self.cprofile is None:
+            return
+
+        self.cprofile.dump_stats(self.cprofile_path)
+        print('The cProfile dump of {} is stored in {}.'.format(
+            self.cprofile_function, self.cprofile_path))
+        pstats.Stats(self.cprofile_path).sort_stats('cumulative').print_stats(
+            20)
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of the process in bytes.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # the size is in bytes on macOS and in kilobytes on Linux
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def count_rows(values):
+    """Counts the rows of the data frames, the series and the arrays in a list,
+    including the ones in tuples.
+    """
+    num_rows = 0
+    for value in values:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            num_rows += value.shape[0]
+        elif isinstance(value, np.ndarray) and value.ndim > 0:
+            num_rows += value.shape[0]
+        elif isinstance(value, tuple):
+            num_rows += count_rows(value)
+
+    return num_rows
+
+
+def print_records(records):
+    print('{:<48}{:>7}{:>11}{:>11}{:>12}{:>11}{:>11}{:>13}'.format(
+        'function', 'calls', 'wall (s)', 'cpu (s)', 'rss (MB)', 'rows in',
+        'rows out', 'rows/s'))
+    for r in records:
+        print('{:<48}{:>7}{:>11.3f}{:>11.3f}{:>12.1f}{:>11}{:>11}{:>13.0f}'.
+              format(r['function'], r['calls'], r['wall_time'], r['cpu_time'],
+                     r['peak_rss_delta'] / 1e6, r['rows_in'], r['rows_out'],
+                     r['rows_per_second']))
+
+
+def enable(log_path,
+           module_names=MODULE_NAMES,
+           cprofile_function=None,
+           cprofile_path=None,
+           script=''):
+    """Instruments the modules and writes the run log when the process exits.
+
+    Parameters
+    ----------
+    log_path : str
+        The path of the run log. A path ending with '.csv' gets a CSV log,
+        and other paths get a JSON lines log.
+
+    module_names : list
+        The names of the modules to be instrumented.
+
+    cprofile_function : str
+        The qualified name of a function to be profiled by cProfile, optional.
+
+    cprofile_path : str
+        The path of the cProfile dump. By default, '<function>.prof'.
+
+    script : str
+        The name of the script recorded in the run log.
+
+    Returns
+    -------
+    profiler : Profiler
+        The profiler collecting the statistics.
+    """
+    if cprofile_function is not None and cprofile_path is None:
+        cprofile_path = cprofile_function + '.prof'
+    profiler = Profiler(cprofile_function, cprofile_path)
+    for module_name in module_names:
+        profiler.instrument(importlib.import_module(module_name))
+
+    run_id = time.strftime('%Y%m%dT%H%M%S')
+
+    def finish():
+        records = profiler.write_log(log_path, run_id, script)
+        print('\nProfile of run {} (stored in {}):'.format(run_id, log_path))
+        print_records(records)
+        profiler.dump_cprofile()
+
+    atexit.register(finish)
+
+    return profiler
+
+
+def run_script(script_path, argv):
+    """Runs the `if __name__ == '__main__':` block of a script in its imported module,
+    so that the block calls the instrumented functions.
+    """
+    module_name = os.path.splitext(os.path.basename(script_path))[0]
+    module = importlib.import_module(module_name)
+
+    with open(script_path) as f:
+        tree = ast.parse(f.read(), script_path)
+    body = []
+    for node in tree.body:
+        if isinstance(node, ast.If) and '__main__' in ast.dump(node.test):
+            body += node.body
+    code = compile(ast.Module(body=body, type_ignores=[]), script_path, 'exec')
+
+    sys.argv = [script_path] + argv
+    exec(code, vars(module))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run a program of the pipeline with profiling, '
+        'e.g. python profiler.py --log runs.jsonl combiner.py --workers 2')
+    parser.add_argument(
+        '--log',
+        default='profile_runs.jsonl',
+        help='the run log, in CSV if it ends with .csv, otherwise in JSON lines')
+    parser.add_argument(
+        '--cprofile',
+        metavar='FUNCTION',
+        help='also profile a function by cProfile, '
+        'e.g. combiner.create_response or combiner.main')
+    parser.add_argument(
+        '--cprofile-out', help='the path of the cProfile dump')
+    parser.add_argument(
+        '--modules',
+        nargs='+',
+        default=MODULE_NAMES,
+        help='the modules to be instrumented')
+    parser.add_argument('script', help='the program, e.g. combiner.py')
+    parser.add_argument(
+        'args', nargs=argparse.REMAINDER, help='the arguments of the program')
+    args = parser.parse_args()
+
+    enable(
+        args.log,
+        args.modules,
+        cprofile_function=args.cprofile,
+        cprofile_path=args.cprofile_out,
+        script=' '.join([args.script] + args.args))
+    run_script(args.script, args.args)
@@ -0,0 +1,127 @@
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+import separater as sprt
+
+EVENT_DTYPE = CategoricalDtype(
+    ['offer received', 'offer viewed', 'offer completed', 'transaction'])
+OFFER_TYPE_DTYPE = CategoricalDtype(['bogo', 'discount', 'informational'])
+GENDER_DTYPE = CategoricalDtype(['F', 'M', 'O', 'U'])
+AGE_BACKET_DTYPE = CategoricalDtype(
+    sprt.make_segment_labels(sprt.AGE_BOUNDARIES), ordered=True)
+INCOME_BACKET_DTYPE = CategoricalDtype(
+    sprt.make_segment_labels(sprt.INCOME_BOUNDARIES), ordered=True)
+
+# The declared column types of the cleaned data frames and the aggregated response.
+# Amounts stay float64, because the response sums them up exactly.
+PORTFOLIO_CLEANED = {
+    'offer_id': 'int16',
+    'offer_type': OFFER_TYPE_DTYPE,
+    'difficulty': 'int8',
+    'duration': 'int8',
+    'reward': 'int8',
+    'channel_email': 'int8',
+    'channel_mobile': 'int8',
+    'channel_social': 'int8',
+    'channel_web': 'int8',
+}
+
+PROFILE_CLEANED = {
+    'profile_id': 'int32',
+    'gender': GENDER_DTYPE,
+    'age': 'float32',
+    'age_backet': AGE_BACKET_DTYPE,
+    'income': 'float32',
+    'income_backet': INCOME_BACKET_DTYPE,
+    'reg_year': 'int16',
+    'reg_month': 'int8',
+}
+
+TRANSCRIPT_CLEANED = {
+    'event_id': 'int32',
+    'event': EVENT_DTYPE,
+    'event_amount': 'float64',
+    'event_reward': 'int8',
+    'time': 'int32',
+    'profile_id': 'int32',
+    'offer_id': 'int16',
+}
+
+RESPONSE_AGG = dict(PROFILE_CLEANED)
+for offer_type in ['bogo', 'discount']:
+    RESPONSE_AGG['response_sum_' + offer_type] = 'int16'
+    for name in [
+            'resp_number_mean', 'resp_amount_mean', 'resp_reward_mean',
+            'difficulty_mean', 'duration_mean', 'reward_mean',
+            'window_amount_sum', 'window_amount_mean'
+    ]:
+        RESPONSE_AGG[name + '_' + offer_type] = 'float64'
+
+
+class SchemaError(ValueError):
+    """SchemaError is raised when a data frame can not be converted to its schema safely.
+    """
+    pass
+
+
+def enforce(df, schema):
+    """Converts the columns of a data frame to the types declared in a schema.
+
+    Parameters
+    ----------
+    df : pandas.Dataframe
+        The data frame to be converted. All its columns must be declared in the schema.
+
+    schema : dict
+        The dictionary containing all mappings from the column name to the type.
+
+    Returns
+    -------
+    df : pandas.Dataframe
+        The new data frame with the declared types.
+        A SchemaError is raised if a value would be changed by the conversion.
+    """
+    undeclared = [col for col in df.columns if col not in schema]
+    if undeclared:
+        raise SchemaError('Undeclared columns: {}'.format(undeclared))
+
+    converted = {}
+    for col in df.columns:
+        converted[col] = convert(df[col], schema[col])
+
+    return pd.DataFrame(converted, index=df.index, columns=df.columns)
+
+
+def convert(col, dtype):
+    """Converts a column to a type, and checks that no value is changed.
+    """
+    try:
+        new_col = col.astype(dtype)
+    except (TypeError, ValueError) as e:
+        raise SchemaError('Column {} can not be converted to {}: {}'.format(
+            col.name, dtype, e))
+
+    if isinstance(new_col.dtype, CategoricalDtype):
+        # the values that are not in the categories become null
+        changed = new_col.isnull().values != col.isnull().values
+    else:
+        changed = new_col.values != col.values
+        changed &= ~(pd.isnull(new_col.values) & pd.isnull(col.values))
+
+    if changed.any():
+        raise SchemaError(
+            'Column {} can not be converted to {} safely, e.g. value {}'.format(
+                col.name, dtype, col[changed].iloc[0]))
+
+    return new_col
+
+
+def print_memory_report(df, name):
+    """Prints the memory usage of each column of a data frame.
+    """
+    usage = df.memory_usage(deep=True)
+    print('Memory usage of {} ({} rows):'.format(name, df.shape[0]))
+    for col, num_bytes in usage.items():
+        print('    {:<28}{:>14,} bytes  {}'.format(
+            str(col), num_bytes, df[col].dtype if col in df.columns else ''))
+    print('    {:<28}{:>14,} bytes'.format('total', usage.sum()))
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 
 
 def separate_channels_col(channels_col, types, col_name_prefix):
@@ -122,6 +123,56 @@ def separate_reg_month_col(reg_month_col):
     return df
 
 
+# The boundaries of the fixed segments of age and income.
+# Values below the first inner boundary fall into the first segment,
+# and values above the last inner boundary (or missing) fall into the last one.
+AGE_BOUNDARIES = [0, 20, 30, 40, 50, 60, 70, 80, 90, 100, 120]
+INCOME_BOUNDARIES = [
+    0, 30000, 40000, 50000, 60000, 70000, 80000, 90000, 100000, 110000, 120000
+]
+
+
+def make_segment_labels(boundaries):
+    """Makes the labels like '(20, 30]' of the segments between the boundaries.
+    """
+    return [
+        '({}, {}]'.format(lower, upper)
+        for lower, upper in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
+def separate_vals(col, boundaries):
+    """Separates the values in a column according to fixed segments.
+    The whole column is processed at once by binary search over the boundaries.
+
+    Parameters
+    ----------
+    col : pandas.Series
+        The column containing data to be separated.
+
+    boundaries : list
+        The ascending boundaries of the segments. Each segment includes its upper boundary.
+
+    Returns
+    -------
+    new_col : pandas.Series
+        The new categorical column containing the labels of the segments.
+    """
+    # NaN is sorted after all numbers, so it falls into the last segment.
+    codes = np.searchsorted(
+        np.asarray(boundaries[1:-1], dtype=np.float64),
+        col.values.astype(np.float64),
+        side='left')
+
+    new_col = pd.Series(
+        pd.Categorical.from_codes(
+            codes, categories=make_segment_labels(boundaries), ordered=True),
+        index=col.index,
+        name=col.name)
+
+    return new_col
+
+
 def separate_age_vals(age_col):
     """Separates the values in column 'age' according to fixed segments.
 
@@ -133,10 +184,9 @@ def separate_age_vals(age_col):
     Returns
     -------
     new_col : pandas.Series
-        The new column containing the age values that have been discretized.
+        The new categorical column containing the age values that have been discretized.
     """
-    new_col = age_col.apply(lambda x: get_age_segment(x))
-    return new_col
+    return separate_vals(age_col, AGE_BOUNDARIES)
 
 
 def get_age_segment(age):
@@ -152,29 +202,7 @@ def get_age_segment(age):
     new_val : str
         The string representation of the segment at which given age value.
     """
-    new_val = -1
-    if age <= 20:
-        new_val = '(0, 20]'
-    elif age > 20 and age <= 30:
-        new_val = '(20, 30]'
-    elif age > 30 and age <= 40:
-        new_val = '(30, 40]'
-    elif age > 40 and age <= 50:
-        new_val = '(40, 50]'
-    elif age > 50 and age <= 60:
-        new_val = '(50, 60]'
-    elif age > 60 and age <= 70:
-        new_val = '(60, 70]'
-    elif age > 70 and age <= 80:
-        new_val = '(70, 80]'
-    elif age > 80 and age <= 90:
-        new_val = '(80, 90]'
-    elif age > 90 and age <= 100:
-        new_val = '(90, 100]'
-    else:
-        new_val = '(100, 120]'
-
-    return new_val
+    return separate_age_vals(pd.Series([age]))[0]
 
 
 def separate_income_vals(income_col):
@@ -188,10 +216,9 @@ def separate_income_vals(income_col):
     Returns
     -------
     new_col : pandas.Series
-        The new column containing the income values that have been discretized.
+        The new categorical column containing the income values that have been discretized.
     """
-    new_col = income_col.apply(lambda x: get_income_segment(x))
-    return new_col
+    return separate_vals(income_col, INCOME_BOUNDARIES)
 
 
 def get_income_segment(income):
@@ -207,26 +234,4 @@ def get_income_segment(income):
     new_val : str
         The string representation of the segment at which given income value.
     """
-    new_val = -1
-    if income <= 30000:
-        new_val = '(0, 30000]'
-    elif income > 30000 and income <= 40000:
-        new_val = '(30000, 40000]'
-    elif income > 40000 and income <= 50000:
-        new_val = '(40000, 50000]'
-    elif income > 50000 and income <= 60000:
-        new_val = '(50000, 60000]'
-    elif income > 60000 and income <= 70000:
-        new_val = '(60000, 70000]'
-    elif income > 70000 and income <= 80000:
-        new_val = '(70000, 80000]'
-    elif income > 80000 and income <= 90000:
-        new_val = '(80000, 90000]'
-    elif income > 90000 and income <= 100000:
-        new_val = '(90000, 100000]'
-    elif income > 100000 and income <= 110000:
-        new_val = '(100000, 110000]'
-    else:
-        new_val = '(110000, 120000]'
-
-    return new_val
\ No newline at end of file
+    return separate_income_vals(pd.Series([income]))[0]
@@ -0,0 +1,224 @@
+from flask import Flask, jsonify, request
+import numpy as np
+
+import os
+import time
+import argparse
+import functools
+import threading
+import constant
+import generator as gen
+import storer as sto
+
+
+class CustomerIndex:
+    """CustomerIndex keeps the labeled customers in memory,
+    keyed by the encoded integer profile_id.
+
+    Each customer is kept as a ready-to-serialize dictionary of its cluster label
+    and its response features, so a lookup is a single dictionary access.
+    The original hex IDs are encoded by the profile ID map through an LRU cache.
+
+    Parameters
+    ----------
+    response_labeled : pandas.Dataframe
+        The labeled response data, whose first column is the cluster label.
+
+    profile_id_map : generator.IdEncoder
+        The map from the original profile IDs to the integer IDs, optional.
+
+    cache_size : int
+        The maximum number of original IDs kept in the LRU cache.
+    """
+
+    def __init__(self, response_labeled, profile_id_map=None,
+                 cache_size=100000):
+        self.cluster_col_name = response_labeled.columns[0]
+        self.profile_id_map = profile_id_map
+
+        columns = {}
+        for col in response_labeled.columns:
+            values = response_labeled[col]
+            if values.dtype.name == 'category':
+                values = values.astype(object)
+            # JSON has no NaN, so the missing values become null
+            columns[col] = [
+                None if isinstance(value, float) and np.isnan(value) else value
+                for value in values.values.tolist()
+            ]
+
+        names = list(columns)
+        if profile_id_map is not None:
+            names.append('id')
+            columns['id'] = profile_id_map.decode(
+                response_labeled['profile_id'].values).tolist()
+
+        self.customers = {
+            record['profile_id']: record
+            for record in (dict(zip(names, row))
+                           for row in zip(*[columns[name] for name in names]))
+        }
+
+        self.encode_profile_id = functools.lru_cache(maxsize=cache_size)(
+            self.encode_profile_id)
+
+    def encode_profile_id(self, id):
+        """Encodes an original profile ID into the integer ID, or 0 if it is unknown.
+        """
+        if self.profile_id_map is None:
+            return 0
+        return int(self.profile_id_map.encode([id], unknown='zero')[0])
+
+    def lookup(self, key):
+        """Looks up a customer by the integer profile_id or the original ID.
+        Returns None if the customer is unknown or the key is neither a string nor an integer.
+        """
+        if not is_customer_key(key):
+            return None
+        if isinstance(key, str):
+            key = int(key) if key.isdigit() else self.encode_profile_id(key)
+        return self.customers.get(key)
+
+    def __len__(self):
+        return len(self.customers)
+
+
+def is_customer_key(key):
+    """Returns whether a value can be a key of a customer, i.e. a string or an integer.
+    """
+    return isinstance(key, str) or (isinstance(key, int)
+                                    and not isinstance(key, bool))
+
+
+class CustomerService:
+    """CustomerService holds the current CustomerIndex and reloads it
+    in a background thread when a new labeled response file appears.
+
+    The new index is built completely before it replaces the old one,
+    so the requests in flight are always answered by one of them.
+    A file is loaded only after its modification time has not changed
+    for one polling interval, so that a file being written is not read.
+    """
+
+    def __init__(self, model_dir, processed_data_dir, reload_interval=5.0):
+        self.response_labeled_path = os.path.join(
+            model_dir, constant.PICKLE_RESPONSE_LABELED)
+        self.profile_id_map_path = os.path.join(processed_data_dir,
+                                                constant.TXT_PROFILE_ID_MAP)
+        self.reload_interval = reload_interval
+
+        self.loaded_mtime = self.get_mtime()
+        self.seen_mtime = self.loaded_mtime
+        self.index = self.load_index()
+        self.loaded_at = time.time()
+
+        if reload_interval > 0:
+            watcher = threading.Thread(target=self.watch, daemon=True)
+            watcher.start()
+
+    def get_mtime(self):
+        mtimes = [os.path.getmtime(self.response_labeled_path)]
+        if os.path.exists(self.profile_id_map_path):
+            mtimes.append(os.path.getmtime(self.profile_id_map_path))
+        return max(mtimes)
+
+    def load_index(self):
+        print('Load the labeled response from {}...'.format(
+            self.response_labeled_path))
+        response_labeled = sto.load(self.response_labeled_path)
+        profile_id_map = None
+        if os.path.exists(self.profile_id_map_path):
+            profile_id_map = gen.IdEncoder.load(self.profile_id_map_path)
+
+        return CustomerIndex(response_labeled, profile_id_map)
+
+    def reload_if_changed(self):
+        """Reloads the index if the files have changed and are no longer being written.
+        Returns whether the index was reloaded.
+        """
+        try:
+            mtime = self.get_mtime()
+        except OSError:
+            # the file is being replaced
+            return False
+
+        stable = mtime == self.seen_mtime
+        self.seen_mtime = mtime
+        if mtime == self.loaded_mtime or not stable:
+            return False
+
+        try:
+            index = self.load_index()
+        except Exception as e:
+            print('Failed to reload the labeled response: {}'.format(e))
+            return False
+
+        self.index = index
+        self.loaded_mtime = mtime
+        self.loaded_at = time.time()
+        print('Reloaded {} customers.'.format(len(index)))
+
+        return True
+
+    def watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            self.reload_if_changed()
+
+
+def create_app(service):
+    """Creates the Flask application serving the customers of a CustomerService.
+
+    GET /customers/<id> returns one customer by the integer profile_id or the original ID.
+    POST /customers with {"ids": [...]} returns {"customers": [...]},
+    with null for the unknown customers.
+    GET /health returns the number of customers and the time the index was loaded.
+    """
+    app = Flask(__name__)
+
+    @app.route('/customers/<key>', methods=['GET'])
+    def get_customer(key):
+        customer = service.index.lookup(key)
+        if customer is None:
+            return jsonify({'error': 'Unknown customer: {}'.format(key)}), 404
+        return jsonify(customer)
+
+    @app.route('/customers', methods=['POST'])
+    def get_customers():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('ids'), list):
+            return jsonify({'error': 'The body must be {"ids": [...]}.'}), 400
+        if not all(is_customer_key(key) for key in body['ids']):
+            return jsonify({
+                'error': 'The IDs must be strings or integers.'
+            }), 400
+
+        # the same index answers the whole batch
+        index = service.index
+        return jsonify({'customers': [index.lookup(key) for key in body['ids']]})
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({
+            'customers': len(service.index),
+            'loaded_at': service.loaded_at
+        })
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Serve the cluster and the response features of customers.')
+    parser.add_argument('--host', default='127.0.0.1', help='the host name')
+    parser.add_argument('--port', type=int, default=5000, help='the port')
+    parser.add_argument(
+        '--reload-interval',
+        type=float,
+        default=5.0,
+        help='the seconds between checks for a new model, 0 to disable')
+    args = parser.parse_args()
+
+    service = CustomerService(constant.MODEL_DIR, constant.PROCESSED_DATA_DIR,
+                              args.reload_interval)
+    create_app(service).run(host=args.host, port=args.port, threaded=True)
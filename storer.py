@@ -1,15 +1,342 @@
 from sklearn.externals import joblib
+import numpy as np
+import pandas as pd
 
+import os
+import json
+import shutil
+import hashlib
+import constant
 
-def store(obj, file_path):
+# The sidecar file describing the columns of a data frame stored by the columnar backend.
+COLUMNAR_META = 'columns.json'
+
+
+def store(obj, file_path, backend=None):
     """Stores an object to a specified file.
+
+    Parameters
+    ----------
+    obj : object
+        The object to be stored.
+
+    file_path : str
+        The path of the file.
+
+    backend : str
+        'joblib' stores any object as a gzip compressed pickle.
+        'columnar' stores a data frame as a directory with one raw file for each column,
+        which can be loaded partially and memory-mapped.
+        'npy' stores a numpy array as an uncompressed .npy file, which is memory-mapped when loaded.
+        Model objects and other objects are always stored with 'joblib'.
+        By default, the backend of the artifact in `constant.STORAGE_BACKENDS` is used.
+
+    Returns
+    -------
+    filenames : list
+        The list of the files written.
     """
+    remove(file_path)
+
+    backend = get_backend(file_path, backend)
+    if backend == 'columnar' and isinstance(obj, pd.DataFrame):
+        return store_columnar(obj, file_path)
+    if backend == 'npy' and isinstance(obj, np.ndarray):
+        # np.save does not add the extension to an open file
+        with open(file_path, 'wb') as f:
+            np.save(f, obj)
+        return [file_path]
+
     filenames = joblib.dump(obj, file_path, compress=('gzip', 6), protocol=4)
 
     return filenames
 
 
-def load(file_path):
+def load(file_path, columns=None):
     """Loads an object from the specified file.
+    The chunks of a chunked data frame are concatenated into one data frame.
+    Only the given columns are read from a data frame stored by the columnar backend.
+    """
+    if is_columnar(file_path):
+        if columns is None:
+            columns = [col['name'] for col in load_meta(file_path)['columns']]
+        return pd.DataFrame(load_arrays(file_path, columns), columns=columns)
+
+    if get_backend(file_path) == 'npy':
+        return np.load(file_path, mmap_mode='r')
+
+    if os.path.isdir(file_path):
+        obj = pd.concat(list(load_chunks(file_path)), ignore_index=True)
+    else:
+        obj = joblib.load(file_path)
+
+    if columns is not None:
+        obj = obj[columns]
+
+    return obj
+
+
+def store_chunks(chunks, dir_path, backend=None):
+    """Stores the chunks of a data frame one by one to a specified directory,
+    so that only one chunk has to be kept in memory at a time.
+    With the columnar backend, the chunks are appended to a single data frame.
+    """
+    remove(dir_path)
+
+    if get_backend(dir_path, backend) == 'columnar':
+        filenames = []
+        for chunk in chunks:
+            filenames = store_columnar(chunk, dir_path, append=True)
+        return filenames
+
+    os.makedirs(dir_path)
+
+    filenames = []
+    for i, chunk in enumerate(chunks):
+        chunk_path = os.path.join(dir_path, 'part-{:05d}.pkl'.format(i))
+        filenames += store(chunk, chunk_path, 'joblib')
+
+    return filenames
+
+
+def load_chunks(file_path, chunksize=1000000, columns=None):
+    """Loads the chunks of a data frame one by one from the specified path.
+    An object stored by the joblib backend is loaded as a single chunk,
+    and a data frame stored by the columnar backend is read in chunks of `chunksize` rows.
+    """
+    if is_columnar(file_path):
+        meta = load_meta(file_path)
+        if columns is None:
+            columns = [col['name'] for col in meta['columns']]
+        for start in range(0, meta['num_rows'], chunksize):
+            yield pd.DataFrame(
+                load_arrays(file_path, columns, start, start + chunksize),
+                columns=columns)
+        return
+
+    if not os.path.isdir(file_path):
+        yield load(file_path, columns)
+        return
+
+    for name in sorted(os.listdir(file_path)):
+        if name.startswith('part-'):
+            yield load(os.path.join(file_path, name), columns)
+
+
+def count_rows(file_path):
+    """Counts the rows of a stored data frame.
+    Only the sidecar is read for a data frame stored by the columnar backend.
+    """
+    if is_columnar(file_path):
+        return load_meta(file_path)['num_rows']
+
+    return sum(chunk.shape[0] for chunk in load_chunks(file_path))
+
+
+def fingerprint(file_path):
+    """Returns a hash of the content of a stored object.
+    Only the sidecar is read for a data frame stored by the columnar backend,
+    and the other files are hashed as a whole. Returns None if nothing is stored.
+    """
+    if is_columnar(file_path):
+        return load_meta(file_path).get('digest')
+
+    if os.path.isfile(file_path):
+        file_paths = [file_path]
+    elif os.path.isdir(file_path):
+        file_paths = [
+            os.path.join(file_path, name)
+            for name in sorted(os.listdir(file_path))
+        ]
+    else:
+        return None
+
+    digest = hashlib.sha1()
+    for path in file_paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+
+def remove(file_path):
+    """Removes the file or the directory of chunks at the specified path.
+    """
+    if os.path.isdir(file_path):
+        shutil.rmtree(file_path)
+    elif os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def get_backend(file_path, backend=None):
+    """Returns the storage backend for an artifact.
+    """
+    if backend is not None:
+        return backend
+
+    return constant.STORAGE_BACKENDS.get(
+        os.path.basename(os.path.normpath(file_path)), 'joblib')
+
+
+def is_columnar(file_path):
+    """Returns whether the path contains a data frame stored by the columnar backend.
+    """
+    return os.path.isfile(os.path.join(file_path, COLUMNAR_META))
+
+
+def store_columnar(df, dir_path, append=False):
+    """Stores a data frame as a directory with one raw file for each column
+    and a JSON sidecar describing the columns. The index is not stored.
+    Categorical columns are stored as their codes.
+
+    If `append` is True and the directory exists, the rows are appended to it.
+    A ValueError is raised if a column can not be stored in the type of the stored
+    column without a change, or if it has values outside the stored categories.
+
+    The sidecar also keeps a digest of the content, which is the hash of the
+    written bytes chained to the digest before them, so it is updated
+    in proportion to the appended rows, see `fingerprint`.
+    """
+    meta_path = os.path.join(dir_path, COLUMNAR_META)
+    if append and os.path.exists(meta_path):
+        meta = load_meta(dir_path)
+        if [col['name'] for col in meta['columns']] != list(df.columns):
+            raise ValueError('The columns do not match the stored data frame!')
+    else:
+        remove(dir_path)
+        os.makedirs(dir_path)
+        meta = {'num_rows': 0, 'columns': describe_columns(df)}
+
+    digest = hashlib.sha1(meta.get('digest', '').encode())
+    filenames = []
+    for i, col in enumerate(meta['columns']):
+        values = df.iloc[:, i]
+        if 'categories' in col:
+            codes = pd.Categorical(
+                values,
+                categories=col['categories'],
+                ordered=col['ordered']).codes
+            if ((codes == -1) & values.notnull().values).any():
+                raise ValueError(
+                    'Column {} has values that are not in the stored categories!'.
+                    format(col['name']))
+            values = codes
+        else:
+            values = values.values
+            if isinstance(values, pd.Categorical) or not np.can_cast(
+                    values.dtype, col['dtype'], casting='safe'):
+                raise ValueError(
+                    'Column {} of type {} can not be stored as {}!'.format(
+                        col['name'], values.dtype, np.dtype(col['dtype'])))
+
+        values = np.ascontiguousarray(values, dtype=col['dtype'])
+        digest.update(values.tobytes())
+        col_path = os.path.join(dir_path, '{}.bin'.format(i))
+        with open(col_path, 'ab') as f:
+            values.tofile(f)
+        filenames.append(col_path)
+
+    meta['num_rows'] += df.shape[0]
+    meta['digest'] = digest.hexdigest()
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    filenames.append(meta_path)
+
+    return filenames
+
+
+def describe_columns(df):
+    """Describes the name and the type of each column for the columnar backend.
     """
-    return joblib.load(file_path)
+    columns = []
+    for name in df.columns:
+        dtype = df[name].dtype
+        if isinstance(dtype, pd.api.types.CategoricalDtype):
+            columns.append({
+                'name': name,
+                'dtype': dtype_str(df[name].cat.codes.dtype),
+                'categories': dtype.categories.tolist(),
+                'ordered': bool(dtype.ordered)
+            })
+        elif dtype == object:
+            raise TypeError(
+                'Column {} of object type can not be stored by the columnar '
+                'backend, please convert it to category first.'.format(name))
+        else:
+            columns.append({'name': name, 'dtype': dtype_str(dtype)})
+
+    return columns
+
+
+def dtype_str(dtype):
+    return np.dtype(dtype).str
+
+
+def load_meta(dir_path):
+    """Loads the sidecar of a data frame stored by the columnar backend.
+    """
+    with open(os.path.join(dir_path, COLUMNAR_META)) as f:
+        return json.load(f)
+
+
+def load_arrays(dir_path, columns=None, start=0, stop=None, mmap=True):
+    """Loads the columns of a data frame stored by the columnar backend as arrays.
+
+    Parameters
+    ----------
+    dir_path : str
+        The directory of the data frame.
+
+    columns : list
+        The names of the columns to be loaded. All columns are loaded by default.
+
+    start, stop : int
+        The range of the rows to be loaded.
+
+    mmap : bool
+        Whether to memory-map the numeric columns instead of reading them into memory.
+
+    Returns
+    -------
+    arrays : dict
+        The dictionary containing all mappings from column name to array
+        (or pandas.Categorical for categorical columns).
+    """
+    meta = load_meta(dir_path)
+    num_rows = meta['num_rows']
+    stop = num_rows if stop is None else min(stop, num_rows)
+    start = min(start, stop)
+
+    positions = {col['name']: i for i, col in enumerate(meta['columns'])}
+    if columns is None:
+        columns = list(positions)
+
+    arrays = {}
+    for name in columns:
+        i = positions[name]
+        col = meta['columns'][i]
+        dtype = np.dtype(col['dtype'])
+        col_path = os.path.join(dir_path, '{}.bin'.format(i))
+
+        if stop == start:
+            values = np.empty(0, dtype=dtype)
+        elif mmap:
+            values = np.memmap(
+                col_path,
+                dtype=dtype,
+                mode='r',
+                offset=start * dtype.itemsize,
+                shape=(stop - start, ))
+        else:
+            with open(col_path, 'rb') as f:
+                f.seek(start * dtype.itemsize)
+                values = np.fromfile(f, dtype=dtype, count=stop - start)
+
+        if 'categories' in col:
+            values = pd.Categorical.from_codes(
+                values, categories=col['categories'], ordered=col['ordered'])
+
+        arrays[name] = values
+
+    return arrays
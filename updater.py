@@ -0,0 +1,592 @@
+import pandas as pd
+import numpy as np
+
+import os
+import json
+import time
+import argparse
+import constant
+import cleaner as cln
+import combiner as cmb
+import generator as gen
+import schema
+import storer as sto
+
+
+# The sidecar file describing a stored state.
+STATE_META = 'state.json'
+
+# The arrays of a state, besides the aggregated features.
+STATE_ARRAYS = [
+    'group_slots', 'received', 'viewed', 'counts', 'amounts', 'rewards',
+    'pending', 'last_times', 'last_amounts', 'has_row', 'has_bogo'
+]
+
+# The columns of the aggregated response computed from the response.
+AGG_FEATURE_COLUMNS = [
+    new_col + '_' + offer_type
+    for offer_type in cmb.RESPONSE_AGG_OFFER_TYPES
+    for _, _, new_col in cmb.RESPONSE_AGG_FEATURES
+]
+
+
+class ResponseUpdater:
+    """ResponseUpdater keeps the state of `combiner.create_response` between runs,
+    so that a batch of new transcript events only updates the response of the
+    customers in the batch and their rows of the aggregated response.
+
+    For every (profile_id, offer_id) group, the state holds the events seen
+    since the last 'offer completed' (whether the offer was received and viewed),
+    the number of valid responses, and their amounts and rewards. For every
+    customer, it holds the time of the latest event and the amount of the
+    transactions at that time, which is the only time at which a later batch
+    can still match a transaction with a completion, and the aggregated features.
+
+    The integer IDs are dense, so nothing is searched or sorted: the groups get
+    slots in the order they are first seen, `group_slots[profile_id, offer_id]`
+    is the slot of a group (or -1), and the arrays of the customers are indexed
+    by profile_id. The arrays grow geometrically and are updated in place,
+    so the time of a batch is proportional to the batch, and not to the events
+    or the customers seen before.
+
+    The batches must arrive in time order: an event older than the latest event
+    of its customer raises a ValueError, and the state has to be rebuilt from
+    the whole transcript. Then the result is the same as combining the whole
+    transcript, except for the rounding of the summed amounts.
+    """
+
+    def __init__(self):
+        # the slot of each (profile_id, offer_id) group, or -1
+        self.group_slots = np.full((0, 0), -1, dtype=np.int64)
+        self.num_groups = 0
+
+        # the groups, by slot
+        self.received = np.zeros(0, dtype=bool)
+        self.viewed = np.zeros(0, dtype=bool)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.amounts = np.zeros(0, dtype=np.float64)
+        self.rewards = np.zeros(0, dtype=np.int64)
+        # the valid completions at the latest time of the customer
+        self.pending = np.zeros(0, dtype=np.int64)
+
+        # the customers, by profile_id; -1 is the time of a customer without events
+        self.last_times = np.full(0, -1, dtype=np.int64)
+        self.last_amounts = np.zeros(0, dtype=np.float64)
+
+        # the aggregated response, by profile_id
+        self.has_row = np.zeros(0, dtype=bool)
+        self.has_bogo = np.zeros(0, dtype=bool)
+        self.features = {
+            name: np.zeros(0, dtype=np.float64)
+            for name in AGG_FEATURE_COLUMNS
+        }
+
+        self.num_events = 0
+        # the fingerprint of the cleaned transcript the state was built from
+        self.transcript_fingerprint = None
+
+    def reserve(self, max_profile_id, max_offer_id):
+        """Makes room for the customers and the offers up to the given IDs.
+        """
+        size = max_profile_id + 1
+        self.group_slots = grow(self.group_slots, size, -1)
+        self.last_times = grow(self.last_times, size, -1)
+        self.last_amounts = grow(self.last_amounts, size)
+        self.has_row = grow(self.has_row, size)
+        self.has_bogo = grow(self.has_bogo, size)
+        for name in AGG_FEATURE_COLUMNS:
+            self.features[name] = grow(self.features[name], size)
+
+        if self.group_slots.shape[1] <= max_offer_id:
+            group_slots = np.full((self.group_slots.shape[0], max_offer_id + 1),
+                                  -1,
+                                  dtype=np.int64)
+            group_slots[:, :self.group_slots.shape[1]] = self.group_slots
+            self.group_slots = group_slots
+
+    def get_group_indices(self, profile_ids):
+        """Returns the slots of the groups of the given customers,
+        ordered by customer and offer, and the customer of each slot
+        as an index into `profile_ids`.
+        """
+        rows = self.group_slots[profile_ids]
+        customers, offer_ids = np.nonzero(rows >= 0)
+        return (rows[customers, offer_ids], customers)
+
+    def update(self, transcript_batch, portfolio_cleaned):
+        """Updates the state with a batch of cleaned transcript events.
+
+        Parameters
+        ----------
+        transcript_batch : pandas.Dataframe
+            The data frame containing the new cleaned transcript events.
+
+        portfolio_cleaned : pandas.Dataframe
+            The data frame containing the cleaned offer data.
+
+        Returns
+        -------
+        profile_ids : numpy.ndarray
+            The sorted IDs of the customers in the batch.
+        """
+        num_events = transcript_batch.shape[0]
+        if num_events == 0:
+            return np.empty(0, dtype=np.int64)
+
+        profile_ids = transcript_batch['profile_id'].values.astype(np.int64)
+        offer_ids = transcript_batch['offer_id'].values.astype(np.int64)
+        times = transcript_batch['time'].values.astype(np.int64)
+
+        # the same stable sort as create_response
+        order = np.lexsort((times, offer_ids, profile_ids))
+
+        profile_ids = profile_ids[order]
+        offer_ids = offer_ids[order]
+        times = times[order]
+        events = np.asarray(transcript_batch['event'].values)[order]
+        amounts = transcript_batch['event_amount'].values[order]
+        rewards = transcript_batch['event_reward'].values[order]
+
+        # the customers in the batch
+        profile_starts = np.ones(num_events, dtype=bool)
+        profile_starts[1:] = profile_ids[1:] != profile_ids[:-1]
+        profile_offsets = np.flatnonzero(profile_starts)
+        row_customers = np.cumsum(profile_starts) - 1
+        batch_profile_ids = profile_ids[profile_offsets]
+        first_times = np.minimum.reduceat(times, profile_offsets)
+        new_last_times = np.maximum.reduceat(times, profile_offsets)
+
+        self.reserve(batch_profile_ids[-1], offer_ids.max())
+        last_times = self.last_times[batch_profile_ids]
+        last_amounts = self.last_amounts[batch_profile_ids]
+
+        if (first_times < last_times).any():
+            raise ValueError(
+                'The batch contains events older than the latest events of '
+                '{} customer(s), please rebuild the state.'.format(
+                    (first_times < last_times).sum()))
+
+        is_transaction = offer_ids == 0
+        amountStorer = cmb.AmountStorer.from_transactions(
+            profile_ids[is_transaction], times[is_transaction],
+            amounts[is_transaction])
+
+        # The completions at the latest time of a customer get the amounts
+        # of the new transactions at that time.
+        group_indices, group_customers = self.get_group_indices(
+            batch_profile_ids)
+        late_amounts = amountStorer.get_amounts(
+            batch_profile_ids[group_customers], last_times[group_customers])
+        self.amounts[group_indices] += self.pending[
+            group_indices] * late_amounts
+
+        # A later event makes the pending completions final.
+        advanced = new_last_times[group_customers] > last_times[
+            group_customers]
+        self.pending[group_indices[advanced]] = 0
+
+        # the groups in the batch, as in create_response
+        is_offer = ~is_transaction
+        profile_ids = profile_ids[is_offer]
+        offer_ids = offer_ids[is_offer]
+        times = times[is_offer]
+        events = events[is_offer]
+        rewards = rewards[is_offer]
+        row_customers = row_customers[is_offer]
+
+        if len(offer_ids) > 0:
+            self.update_groups(profile_ids, offer_ids, times, events, rewards,
+                               row_customers, last_times, last_amounts,
+                               new_last_times, amountStorer)
+
+        # the customers
+        new_amounts = amountStorer.get_amounts(batch_profile_ids,
+                                               new_last_times)
+        same_time = new_last_times == last_times
+        new_amounts[same_time] += last_amounts[same_time]
+        self.last_times[batch_profile_ids] = new_last_times
+        self.last_amounts[batch_profile_ids] = new_amounts
+
+        self.update_response_agg(batch_profile_ids, portfolio_cleaned)
+        self.num_events += num_events
+
+        return batch_profile_ids
+
+    def update_groups(self, profile_ids, offer_ids, times, events, rewards,
+                      row_customers, last_times, last_amounts, new_last_times,
+                      amountStorer):
+        """Applies the validity rule of `combiner.check_validity` to the offer events
+        of the batch, continuing from the events seen since the last completion.
+        """
+        group_starts = np.ones(len(offer_ids), dtype=bool)
+        group_starts[1:] = (profile_ids[1:] != profile_ids[:-1]) | (
+            offer_ids[1:] != offer_ids[:-1])
+        group_ids = np.cumsum(group_starts) - 1
+        group_offsets = np.flatnonzero(group_starts)
+        group_ends = np.append(group_offsets[1:], len(offer_ids)) - 1
+        num_groups = len(group_offsets)
+
+        group_profile_ids = profile_ids[group_offsets]
+        group_offer_ids = offer_ids[group_offsets]
+        positions = self.group_slots[group_profile_ids, group_offer_ids]
+        known = positions >= 0
+
+        is_received = events == 'offer received'
+        is_viewed = events == 'offer viewed'
+        is_completed = events == 'offer completed'
+
+        segment_starts = group_starts.copy()
+        segment_starts[1:] |= is_completed[:-1]
+        segment_ids = np.cumsum(segment_starts) - 1
+        segment_offsets = np.flatnonzero(segment_starts)
+
+        # the first segment of a group continues the events seen before
+        segment_groups = group_ids[segment_offsets]
+        is_first_segment = group_starts[segment_offsets]
+        was_received = np.zeros(num_groups, dtype=bool)
+        was_received[known] = self.received[positions[known]]
+        was_viewed = np.zeros(num_groups, dtype=bool)
+        was_viewed[known] = self.viewed[positions[known]]
+
+        segment_received = np.logical_or.reduceat(is_received, segment_offsets)
+        segment_received |= is_first_segment & was_received[segment_groups]
+        segment_viewed = np.logical_or.reduceat(is_viewed, segment_offsets)
+        segment_viewed |= is_first_segment & was_viewed[segment_groups]
+
+        valid = is_completed & segment_received[segment_ids] & segment_viewed[
+            segment_ids]
+
+        valid_group_ids = group_ids[valid]
+        valid_customers = row_customers[valid]
+        valid_times = times[valid]
+        valid_amounts = amountStorer.get_amounts(profile_ids[valid],
+                                                 valid_times)
+        at_last_time = valid_times == last_times[valid_customers]
+        valid_amounts[at_last_time] += last_amounts[
+            valid_customers[at_last_time]]
+
+        counts = np.bincount(valid_group_ids, minlength=num_groups)
+        amounts = np.bincount(
+            valid_group_ids, weights=valid_amounts, minlength=num_groups)
+        group_rewards = np.bincount(
+            valid_group_ids, weights=rewards[valid],
+            minlength=num_groups).astype(np.int64)
+        pending = np.bincount(
+            valid_group_ids[valid_times == new_last_times[valid_customers]],
+            minlength=num_groups)
+
+        # the events seen since the last completion of each group
+        is_open = ~is_completed[group_ends]
+        received = is_open & segment_received[segment_ids[group_ends]]
+        viewed = is_open & segment_viewed[segment_ids[group_ends]]
+
+        old = positions[known]
+        self.received[old] = received[known]
+        self.viewed[old] = viewed[known]
+        self.counts[old] += counts[known]
+        self.amounts[old] += amounts[known]
+        self.rewards[old] += group_rewards[known]
+        self.pending[old] += pending[known]
+
+        if known.all():
+            return
+
+        # the new groups get the next slots
+        new = self.num_groups + np.arange((~known).sum())
+        self.num_groups += len(new)
+        self.group_slots[group_profile_ids[~known], group_offer_ids[
+            ~known]] = new
+        self.received = grow(self.received, self.num_groups)
+        self.viewed = grow(self.viewed, self.num_groups)
+        self.counts = grow(self.counts, self.num_groups)
+        self.amounts = grow(self.amounts, self.num_groups)
+        self.rewards = grow(self.rewards, self.num_groups)
+        self.pending = grow(self.pending, self.num_groups)
+
+        self.received[new] = received[~known]
+        self.viewed[new] = viewed[~known]
+        self.counts[new] = counts[~known]
+        self.amounts[new] = amounts[~known]
+        self.rewards[new] = group_rewards[~known]
+        self.pending[new] = pending[~known]
+
+    def get_response(self, profile_ids=None):
+        """Returns the response of the given customers (in ascending order),
+        or of all customers, in the format of `combiner.create_response`.
+        """
+        if profile_ids is None:
+            profile_ids = np.arange(self.group_slots.shape[0])
+        else:
+            profile_ids = np.asarray(profile_ids, dtype=np.int64)
+            profile_ids = profile_ids[profile_ids < self.group_slots.shape[0]]
+
+        rows = self.group_slots[profile_ids]
+        customers, offer_ids = np.nonzero(rows >= 0)
+        group_indices = rows[customers, offer_ids]
+        counts = self.counts[group_indices]
+
+        return pd.DataFrame({
+            'response': (counts > 0).astype(np.int64),
+            'profile_id': profile_ids[customers],
+            'offer_id': offer_ids.astype(np.int64),
+            'resp_number': counts,
+            'resp_amount': self.amounts[group_indices],
+            'resp_reward': self.rewards[group_indices]
+        })[[
+            'response', 'profile_id', 'offer_id', 'resp_number', 'resp_amount',
+            'resp_reward'
+        ]]
+
+    def update_response_agg(self, profile_ids, portfolio_cleaned):
+        """Recomputes the aggregated features of the given customers in place.
+        """
+        response_merged = cmb.merge_response(
+            self.get_response(profile_ids), portfolio_cleaned)
+        response_merged = response_merged[
+            response_merged['offer_type'] != 'informational']
+        if response_merged.shape[0] == 0:
+            return
+
+        rows = cmb.aggregate_merged_response(response_merged)
+        row_profile_ids = rows['profile_id'].values
+        for name in AGG_FEATURE_COLUMNS:
+            self.features[name][row_profile_ids] = rows[name].values
+        self.has_row[row_profile_ids] = True
+        self.has_bogo[row_profile_ids] = np.isin(
+            row_profile_ids, response_merged['profile_id'].values[
+                (response_merged['offer_type'] == 'bogo').values])
+
+    def get_response_agg(self, profile_cleaned):
+        """Returns the aggregated response in the row order of `combiner.combine`
+        (the customers with bogo offers first, each part by profile_id),
+        merged with the cleaned profile and converted to its declared schema.
+        """
+        profile_ids = np.concatenate([
+            np.flatnonzero(self.has_row & self.has_bogo),
+            np.flatnonzero(self.has_row & ~self.has_bogo)
+        ])
+
+        columns = {'profile_id': profile_ids}
+        for name in AGG_FEATURE_COLUMNS:
+            columns[name] = self.features[name][profile_ids]
+        response_agg = pd.DataFrame(columns, columns=list(columns)).merge(
+            profile_cleaned, on='profile_id', how='left', validate='one_to_one')
+
+        return schema.enforce(response_agg, schema.RESPONSE_AGG)
+
+    def get_arrays(self):
+        """Returns all arrays of the state by their file names.
+        """
+        arrays = {name: getattr(self, name) for name in STATE_ARRAYS}
+        for name in AGG_FEATURE_COLUMNS:
+            arrays['feature.' + name] = self.features[name]
+
+        return arrays
+
+    def store(self, dir_path):
+        """Stores the state to a directory with one .npy file for each array
+        and a JSON sidecar. The arrays that were loaded from the directory are
+        memory-mapped, so only their changed pages are written, and only the
+        arrays that have grown are written again.
+        """
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        for name, values in self.get_arrays().items():
+            file_path = os.path.join(dir_path, name + '.npy')
+            if isinstance(values, np.memmap) and os.path.abspath(
+                    values.filename) == os.path.abspath(file_path):
+                values.flush()
+                continue
+
+            # the old file may still be memory-mapped, so it is replaced
+            tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.save(f, values)
+            os.replace(tmp_path, file_path)
+
+        with open(os.path.join(dir_path, STATE_META), 'w') as f:
+            json.dump({
+                'num_groups': self.num_groups,
+                'num_events': self.num_events,
+                'transcript_fingerprint': self.transcript_fingerprint
+            },
+                      f,
+                      indent=2)
+
+    @classmethod
+    def load(cls, dir_path):
+        """Loads a state stored by `store`. The arrays are memory-mapped
+        for writing, so the updates are made in place.
+        Returns None if there is no complete state in the directory.
+        """
+        meta_path = os.path.join(dir_path, STATE_META)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        updater = cls()
+        for name in updater.get_arrays():
+            values = np.load(
+                os.path.join(dir_path, name + '.npy'), mmap_mode='r+')
+            if name.startswith('feature.'):
+                updater.features[name[len('feature.'):]] = values
+            else:
+                setattr(updater, name, values)
+        updater.num_groups = meta['num_groups']
+        updater.num_events = meta['num_events']
+        updater.transcript_fingerprint = meta.get('transcript_fingerprint')
+
+        return updater
+
+
+def grow(values, size, fill=0):
+    """Returns an array with at least `size` rows, which starts with the rows
+    of the given array. The array is returned itself if it is large enough,
+    otherwise its size is at least doubled and the new rows are set to `fill`.
+    """
+    if len(values) >= size:
+        return values
+
+    new_values = np.full(
+        (max(size, 2 * len(values)), ) + values.shape[1:],
+        fill,
+        dtype=values.dtype)
+    new_values[:len(values)] = values
+
+    return new_values
+
+
+def main(input_dir, output_dir, batch_path=None):
+    """The main function.
+    The state is built from the whole cleaned transcript if it does not exist
+    or does not match the fingerprint of the cleaned transcript, see `storer.fingerprint`.
+    A batch of new events in the format of the original transcript is cleaned,
+    appended to the cleaned transcript and applied to the state.
+    The features of the in-window spend (combiner.py --window-spend) are not
+    kept in the state, so a ValueError is raised if the aggregated response has them.
+
+    With the columnar cleaned transcript, the state and the transcript are
+    updated in place in proportion to the batch. Reading the ID maps and the
+    cleaned profile and writing "response_agg.pkl" are proportional to the number
+    of customers, but none of the steps depends on the number of past events.
+    """
+    portfolio_cleaned_path, profile_cleaned_path, transcript_cleaned_path = \
+        cln.get_output_file_paths(input_dir)
+    state_path, response_agg_path = get_output_file_paths(output_dir)
+
+    if has_window_spend(response_agg_path):
+        raise ValueError(
+            'The aggregated response has the features of the in-window spend, '
+            'which can not be updated, please run combiner.py --window-spend again.')
+
+    print('Load cleaned data...')
+    portfolio_cleaned = sto.load(portfolio_cleaned_path)
+
+    updater = ResponseUpdater.load(state_path)
+    if updater is not None:
+        print('Loaded the state of the response from {}.'.format(state_path))
+        # the cleaned transcript is rebuilt when cleaner.py runs again
+        if updater.transcript_fingerprint != sto.fingerprint(
+                transcript_cleaned_path):
+            print('The cleaned transcript has changed, rebuild the state...')
+            updater = None
+
+    if updater is None:
+        print('Build the state of the response from the cleaned transcript...')
+        start_time = time.time()
+        updater = ResponseUpdater()
+        updater.transcript_fingerprint = sto.fingerprint(
+            transcript_cleaned_path)
+        updater.update(
+            sto.load(
+                transcript_cleaned_path, columns=cmb.RESPONSE_INPUT_COLUMNS),
+            portfolio_cleaned)
+        print('The time spent building the state: {}s'.format(time.time() -
+                                                               start_time))
+
+    if batch_path is not None:
+        print('Clean up the new events in {}...'.format(batch_path))
+        offer_id_map_path, profile_id_map_path = cln.get_id_map_file_paths(
+            input_dir)
+        transcript_batch = cln.clean_transcript_df(
+            pd.read_json(batch_path, orient='records', lines=True),
+            gen.IdEncoder.load(offer_id_map_path),
+            gen.IdEncoder.load(profile_id_map_path), updater.num_events + 1)
+        transcript_batch = schema.enforce(transcript_batch,
+                                          schema.TRANSCRIPT_CLEANED)
+
+        # the arrays are changed in place, so the stored state is incomplete
+        # until it is stored again, and an interrupted run rebuilds it
+        sto.remove(os.path.join(state_path, STATE_META))
+
+        print('Update the response with {} new events...'.format(
+            transcript_batch.shape[0]))
+        start_time = time.time()
+        profile_ids = updater.update(transcript_batch, portfolio_cleaned)
+        print('The time spent updating {} customers: {}s'.format(
+            len(profile_ids),
+            time.time() - start_time))
+
+        print('Append the new events to the cleaned transcript...')
+        # the transcript is no longer sorted, so its group offsets are removed
+        sto.remove(cln.get_offsets_file_path(input_dir))
+        if sto.is_columnar(transcript_cleaned_path):
+            sto.store_columnar(
+                transcript_batch, transcript_cleaned_path, append=True)
+        else:
+            sto.store(
+                pd.concat([sto.load(transcript_cleaned_path), transcript_batch],
+                          ignore_index=True), transcript_cleaned_path)
+        updater.transcript_fingerprint = sto.fingerprint(
+            transcript_cleaned_path)
+
+    print('Store data...')
+    updater.store(state_path)
+    sto.store(
+        updater.get_response_agg(sto.load(profile_cleaned_path)),
+        response_agg_path)
+
+    print('Done.\n')
+
+
+def has_window_spend(response_agg_path):
+    """Returns whether a stored aggregated response has the features of the in-window spend.
+    """
+    if sto.is_columnar(response_agg_path):
+        columns = [
+            col['name'] for col in sto.load_meta(response_agg_path)['columns']
+        ]
+    elif os.path.exists(response_agg_path):
+        columns = sto.load(response_agg_path).columns
+    else:
+        return False
+
+    return any(
+        name + '_' + offer_type in columns
+        for offer_type in cmb.RESPONSE_AGG_OFFER_TYPES
+        for _, _, name in cmb.RESPONSE_AGG_WINDOW_FEATURES)
+
+
+def get_output_file_paths(output_dir):
+    """Returns the full paths of output files.
+    """
+    state_path = os.path.join(output_dir, constant.DIR_RESPONSE_STATE)
+    response_agg_path = cmb.get_output_file_path(output_dir)
+
+    return (state_path, response_agg_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Update the aggregated response with new transcript events.')
+    parser.add_argument(
+        'batch',
+        nargs='?',
+        help='a JSON lines file of new events in the format of transcript.json; '
+        'without it, the state is only built')
+    args = parser.parse_args()
+
+    main(constant.PROCESSED_DATA_DIR, constant.PROCESSED_DATA_DIR, args.batch)
+    cmb.check(constant.PROCESSED_DATA_DIR)